@@ -4,6 +4,8 @@ from .models import *
 # Register your models here.
 admin.site.register(CalorieLog)
 admin.site.register(Coach)
+admin.site.register(Conversation)
+admin.site.register(DailyHealthSummary)
 admin.site.register(EquipmentBank)
 admin.site.register(ExerciseBank)
 admin.site.register(ExerciseInWorkoutPlan)
@@ -0,0 +1,58 @@
+import copy
+from django.db.models import Exists, OuterRef
+from django.utils.translation import gettext_lazy
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from .models import AuthToken, Coach, Admin
+from .services.token_cache import token_cache, is_revoked
+
+
+def annotate_user_type(queryset, user_id='pk'):
+    # Adds is_coach / is_admin to each row, user_id is the field holding the user's id
+    return queryset.annotate(
+        is_coach=Exists(Coach.objects.filter(user_id=OuterRef(user_id))),
+        is_admin=Exists(Admin.objects.filter(user_id=OuterRef(user_id))),
+    )
+
+
+def get_user_type(row):  # row is annotated by annotate_user_type
+    if row.is_admin:
+        return 'admin'
+    if row.is_coach:
+        return 'coach'
+    return 'user'
+
+
+# Authorization: Token <key>
+# request.user is the User and request.auth the AuthToken, with the user's role in request.auth.user_type
+# Tokens are resolved from token_cache, so authenticated requests only query the db on a cache miss
+# An unknown, logged out or malformed token leaves the request anonymous instead of failing it, the same as sending
+# no token: most endpoints are public, and a stale token kept by a client must not lock it out of them.
+# Views that need a user check request.user / request.auth themselves
+class CachedTokenAuthentication(TokenAuthentication):
+    model = AuthToken
+
+    def authenticate(self, request):
+        try:
+            return super().authenticate(request)
+        except exceptions.AuthenticationFailed:
+            return None
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None and is_revoked(key):  # Logged out through another process
+            token_cache.invalidate(key)
+            cached = None
+        if cached is None:
+            try:
+                token = annotate_user_type(AuthToken.objects.select_related('user'), 'user_id').get(key=key)
+            except AuthToken.DoesNotExist:
+                raise exceptions.AuthenticationFailed(gettext_lazy('Invalid token.'))
+            token_cache.set(key, token.user, get_user_type(token))
+            cached = token.user, get_user_type(token)
+
+        # Each request gets its own copy, so changes a view makes to request.user don't reach other requests
+        user, user_type = copy.copy(cached[0]), cached[1]
+        token = AuthToken(key=key, user=user)
+        token.user_type = user_type
+        return user, token
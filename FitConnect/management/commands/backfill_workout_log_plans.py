@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from FitConnect.services.workout_logs import backfill_workout_log_plans
+
+
+class Command(BaseCommand):
+    help = 'Sets workout_log.plan_id from exercise_in_plan for logs written before the column existed'
+
+    def handle(self, *args, **options):
+        count = backfill_workout_log_plans()
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {count} workout logs'))
@@ -0,0 +1,42 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from FitConnect.services.exercise_search import ExerciseSearchIndex
+
+WORDS = ['bench', 'press', 'incline', 'decline', 'dumbbell', 'barbell', 'cable', 'curl', 'row', 'squat', 'front',
+         'back', 'lunge', 'deadlift', 'romanian', 'fly', 'raise', 'lateral', 'overhead', 'extension', 'pulldown',
+         'pullup', 'chinup', 'dip', 'plank', 'crunch', 'hammer', 'preacher', 'shrug', 'calf', 'hip', 'thrust',
+         'kettlebell', 'swing', 'single', 'arm', 'leg', 'seated', 'standing', 'machine', 'smith', 'close', 'grip',
+         'wide', 'reverse', 'face', 'pull', 'glute', 'bridge', 'split']
+QUERIES = ['bench press', 'inc', 'dumbbell curl', 'romanian dead', 'seated cable row', 'kettlebell swing', 'hammer',
+           'wide grip pull', 'se ca pu de ro', 'pr cu sq', 's c p d r', 'p c s r d', 'xyz']
+
+
+# Measures SearchExercises ?q= lookups against a synthetic in-memory catalog (no database involved)
+class Command(BaseCommand):
+    help = 'Benchmarks the in-memory exercise search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--exercises', type=int, default=50000, help='Catalog size')
+        parser.add_argument('--iterations', type=int, default=1000, help='Searches per query')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        catalog = [
+            (exercise_id,
+             ' '.join(rng.sample(WORDS, 3)) + f' variation {exercise_id}',
+             ' '.join(rng.choices(WORDS, k=12)))
+            for exercise_id in range(1, options['exercises'] + 1)
+        ]
+
+        index = ExerciseSearchIndex()
+        start = time.perf_counter()
+        index.build(catalog)
+        self.stdout.write(f'Built index of {len(index)} exercises in {(time.perf_counter() - start) * 1000:.0f} ms')
+
+        for query in QUERIES:
+            start = time.perf_counter()
+            for _ in range(options['iterations']):
+                results = index.search(query, limit=50)
+            elapsed = (time.perf_counter() - start) / options['iterations'] * 1000
+            self.stdout.write(f'{query!r:24} {len(results):3} results  {elapsed:.3f} ms/query')
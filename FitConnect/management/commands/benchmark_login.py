@@ -0,0 +1,34 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from FitConnect.services.passwords import hash_password, verify_password
+
+
+# Measures login password verification throughput (the argon2 part of LoginView) with concurrent requests,
+# verifying on the request threads and through the bounded verification pool
+class Command(BaseCommand):
+    help = 'Benchmarks argon2 password verification throughput for logins'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=200, help='Logins per run')
+        parser.add_argument('--concurrency', type=int, default=8, help='Concurrent login requests')
+        parser.add_argument('--pool-sizes', type=int, nargs='+', default=[0, 2, 4, 8],
+                            help='PASSWORD_VERIFY_POOL_SIZE values to compare (0 = request thread)')
+
+    def handle(self, *args, **options):
+        hashed_password = hash_password('benchmark-password1!')
+
+        for pool_size in options['pool_sizes']:
+            with override_settings(PASSWORD_VERIFY_POOL_SIZE=pool_size):
+                verify_password(hashed_password, 'benchmark-password1!')  # Warm up the hasher and pool
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=options['concurrency']) as requests:
+                    results = list(requests.map(
+                        lambda _: verify_password(hashed_password, 'benchmark-password1!')[0],
+                        range(options['logins'])))
+                elapsed = time.perf_counter() - start
+
+            assert all(results)
+            self.stdout.write(f'pool size {pool_size or "-":>2}: {options["logins"] / elapsed:7.1f} logins/s '
+                              f'({elapsed / options["logins"] * 1000:.1f} ms avg)')
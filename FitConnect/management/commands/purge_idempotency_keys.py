@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from FitConnect.services.idempotency import purge_expired_idempotency_keys
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired idempotency keys'
+
+    def handle(self, *args, **options):
+        count = purge_expired_idempotency_keys()
+        self.stdout.write(self.style.SUCCESS(f'Purged {count} idempotency keys'))
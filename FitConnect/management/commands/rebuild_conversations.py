@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from FitConnect.services.conversations import rebuild_conversations
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the conversation table from message_log'
+
+    def handle(self, *args, **options):
+        count = rebuild_conversations()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} conversations'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from FitConnect.services.daily_health_summary import rebuild_daily_health_summaries
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily_health_summary table from the calorie, water, mental and physical health logs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='Only rebuild the summaries of this user_id')
+
+    def handle(self, *args, **options):
+        count = rebuild_daily_health_summaries(user_id=options['user'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} daily health summaries'))
@@ -0,0 +1,80 @@
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .services.request_metrics import RequestStats, QueryBudgetExceeded, current_stats, get_query_budget, \
+    get_view_name, install_query_counter, instrument_serializers, request_metrics
+
+logger = logging.getLogger(__name__)
+
+# One extra query is allowed over a view's budget for token authentication on a token cache miss
+AUTH_QUERY_ALLOWANCE = 1
+
+
+# Records SQL query count, db time, serializer time, total time and response size for every request
+# They are sent back in a Server-Timing header and aggregated per view in request_metrics (see RequestMetricsView)
+# Views declare a query budget with a `query_budget` attribute (or @query_budget for function views); going over it
+# logs a warning, or raises QueryBudgetExceeded when settings.QUERY_BUDGET_STRICT is set (it is under tests)
+# Works the same under WSGI and ASGI: the request's stats live in a context variable, which follows sync views and
+# the sync_to_async calls of async views onto the thread they run on, where process_view installs the query counter
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        instrument_serializers()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        try:
+            install_query_counter()
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.finish(request, response, start, stats)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        stats = RequestStats()
+        token = current_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return self.finish(request, response, start, stats)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Under ASGI this runs on the same thread as sync views and sync_to_async calls
+        install_query_counter()
+        request.metrics_view = (get_view_name(view_func), get_query_budget(view_func, request.method))
+
+    def finish(self, request, response, start, stats):
+        total_ms = (time.perf_counter() - start) * 1000
+        view_name, budget = getattr(request, 'metrics_view', (None, None))
+        response_bytes = 0 if response.streaming else len(response.content)
+
+        timings = [f'total;dur={total_ms:.1f}', f'resp;desc="bytes={response_bytes}"',
+                   f'db;dur={stats.db_time * 1000:.1f};desc="queries={stats.queries}"',
+                   f'serializer;dur={stats.serializer_time * 1000:.1f}']
+        response['Server-Timing'] = ', '.join(timings)
+
+        over_budget = False
+        if budget is not None:
+            allowed = budget + (AUTH_QUERY_ALLOWANCE if 'HTTP_AUTHORIZATION' in request.META else 0)
+            over_budget = stats.queries > allowed
+        if view_name is not None:
+            request_metrics.record(view_name, total_ms, stats, response_bytes, over_budget)
+        if over_budget:
+            message = f'{view_name} ran {stats.queries} queries, over its budget of {budget} ({request.path})'
+            if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
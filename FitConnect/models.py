@@ -4,12 +4,16 @@
 #   * Make sure each model has one field with primary_key=True
 #   * Make sure each ForeignKey and OneToOneField has `on_delete` set to the desired behavior
 # Feel free to rename the models, but don't rename db_table values or field names.
+import datetime
 from django.db import models
+from django.db.models import Count, F, Sum
 from django.utils import timezone
 from django.utils.translation import gettext_lazy
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from rest_framework.authtoken.models import Token
+from .services.lookup_cache import invalidate_lookup_bank, EXERCISES, MUSCLE_GROUPS, EQUIPMENT, GOALS
+from .services.token_cache import token_cache, revoke as revoke_token
 
 class Admin(models.Model):
     admin_id = models.AutoField(primary_key=True)
@@ -38,7 +42,19 @@ class BecomeCoachRequest(models.Model):
         db_table = 'become_coach_request'
 
 
-class CalorieLog(models.Model):
+class SummarizedLogMixin:
+    # For the daily survey logs rolled up into DailyHealthSummary: remembers the (user, day) the log was loaded or
+    # last saved with, so moving a log to another day refreshes the summary of the day it left too
+    _summary_day = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._summary_day = (instance.__dict__.get('user_id'), instance.__dict__.get('recorded_date'))
+        return instance
+
+
+class CalorieLog(SummarizedLogMixin, models.Model):
     calorie_id = models.AutoField(primary_key=True)
     user = models.ForeignKey('User', models.DO_NOTHING)
     amount = models.PositiveIntegerField()
@@ -49,13 +65,21 @@ class CalorieLog(models.Model):
     def __str__(self):
         return self.user
 
-    def save(self, *args, **kwargs):
+    def save(self, *args, update_summary=True, **kwargs):
+        created = self._state.adding
         self.last_update = timezone.now()
         super(CalorieLog, self).save(*args, **kwargs)
+        previous_day, self._summary_day = self._summary_day, (self.user_id, self.recorded_date)
+        if update_summary:
+            DailyHealthSummary.update_from_log(self, created, previous_day)
 
     class Meta:
         managed = True
         db_table = 'calorie_log'
+        indexes = [
+            models.Index(fields=['user', 'recorded_date']),
+            models.Index(fields=['user', 'last_update']),
+        ]
 
 
 class Coach(models.Model):
@@ -78,6 +102,157 @@ class Coach(models.Model):
     class Meta:
         managed = True
         db_table = 'coach'
+        # Coach search sort orders (ties by coach_id, which InnoDB appends to every index), with and without a goal
+        indexes = [
+            models.Index(fields=['goal', 'cost']),
+            models.Index(fields=['goal', 'experience']),
+            models.Index(fields=['cost']),
+            models.Index(fields=['experience']),
+        ]
+
+
+# One row per pair of users that have exchanged messages, so contact lists don't scan message_log
+# user_one is always the participant with the lower user_id
+# Kept up to date from MessageLog.save() and rebuilt with `python manage.py rebuild_conversations`
+class Conversation(models.Model):
+    conversation_id = models.AutoField(primary_key=True)
+    user_one = models.ForeignKey('User', models.DO_NOTHING, related_name='conversation_user_one_set')
+    user_two = models.ForeignKey('User', models.DO_NOTHING, related_name='conversation_user_two_set')
+    last_message = models.ForeignKey('MessageLog', models.DO_NOTHING, blank=True, null=True, related_name='+')
+    last_message_time = models.DateTimeField(blank=True, null=True)
+    user_one_unread = models.PositiveIntegerField(default=0)
+    user_two_unread = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(default=timezone.now)
+    last_update = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.user_one_id} {self.user_two_id}'
+
+    def save(self, *args, **kwargs):
+        self.last_update = timezone.now()
+        super(Conversation, self).save(*args, **kwargs)
+
+    @staticmethod
+    def participants(user_id, other_user_id):
+        return sorted([int(user_id), int(other_user_id)])
+
+    @classmethod
+    def unread_field(cls, conversation_user_one_id, user_id):
+        return 'user_one_unread' if int(user_id) == conversation_user_one_id else 'user_two_unread'
+
+    @classmethod
+    def record_message(cls, message):
+        # Moves the conversation's last message forward and bumps the recipient's unread count
+        user_one_id, user_two_id = cls.participants(message.sender_id, message.recipient_id)
+        conversation, created = cls.objects.get_or_create(user_one_id=user_one_id, user_two_id=user_two_id)
+        unread = cls.unread_field(user_one_id, message.recipient_id)
+        cls.objects.filter(pk=conversation.pk).update(
+            last_message=message, last_message_time=message.sent_date, last_update=timezone.now(),
+            **{unread: F(unread) + 1}
+        )
+
+    @classmethod
+    def mark_read(cls, user_id, other_user_id):
+        user_one_id, user_two_id = cls.participants(user_id, other_user_id)
+        return cls.objects.filter(user_one_id=user_one_id, user_two_id=user_two_id).update(
+            **{cls.unread_field(user_one_id, user_id): 0}
+        )
+
+    class Meta:
+        managed = True
+        db_table = 'conversation'
+        constraints = [
+            models.UniqueConstraint(fields=['user_one', 'user_two'], name='conversation_participants')
+        ]
+        indexes = [
+            models.Index(fields=['user_one', '-last_message_time']),
+            models.Index(fields=['user_two', '-last_message_time']),
+        ]
+
+
+# One row per user per day rolling up the four daily log tables, so dashboards don't rescan raw logs
+def _as_date(value):
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+# Kept up to date from the log save() methods, the post_delete receiver at the bottom and DailySurveyView.post
+# Can be rebuilt from scratch with `python manage.py rebuild_daily_health_summary`
+class DailyHealthSummary(models.Model):
+    summary_id = models.AutoField(primary_key=True)
+    user = models.ForeignKey('User', models.DO_NOTHING)
+    recorded_date = models.DateField()
+    total_calories = models.PositiveIntegerField(default=0)
+    total_water = models.IntegerField(default=0)
+    last_mood = models.CharField(max_length=7, blank=True, null=True)
+    last_weight = models.DecimalField(max_digits=5, decimal_places=2, blank=True, null=True)
+    created = models.DateTimeField(default=timezone.now)
+    last_update = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.user_id} {self.recorded_date}'
+
+    def save(self, *args, **kwargs):
+        self.last_update = timezone.now()
+        super(DailyHealthSummary, self).save(*args, **kwargs)
+
+    @classmethod
+    def add_day(cls, user_id, recorded_date, calories=0, water=0, mood=None, weight=None):
+        # Folds newly written logs into the day's row without rereading the raw logs
+        recorded_date = _as_date(recorded_date)
+        summary, created = cls.objects.get_or_create(user_id=user_id, recorded_date=recorded_date)
+        updates = {
+            'total_calories': F('total_calories') + (calories or 0),
+            'total_water': F('total_water') + (water or 0),
+            'last_update': timezone.now(),
+        }
+        if mood is not None:
+            updates['last_mood'] = mood
+        if weight is not None:
+            updates['last_weight'] = weight
+        cls.objects.filter(pk=summary.pk).update(**updates)
+
+    @classmethod
+    def refresh_day(cls, user_id, recorded_date):
+        # Recomputes the day's row from the raw logs, used when an existing log is edited, moved or deleted
+        # The row is removed once the day has no logs left
+        day = {'user_id': user_id, 'recorded_date': _as_date(recorded_date)}
+        calories = CalorieLog.objects.filter(**day).aggregate(total=Sum('amount'), logs=Count('pk'))
+        water = WaterLog.objects.filter(**day).aggregate(total=Sum('amount'), logs=Count('pk'))
+        last_mood = MentalHealthLog.objects.filter(**day).order_by('-created', '-mental_health_id') \
+            .values_list('mood', flat=True).first()
+        last_weight = PhysicalHealthLog.objects.filter(**day, weight__isnull=False) \
+            .order_by('-created', '-physical_health_id').values_list('weight', flat=True).first()
+        if not calories['logs'] and not water['logs'] and last_mood is None and last_weight is None:
+            cls.objects.filter(**day).delete()
+            return
+        cls.objects.update_or_create(**day, defaults={
+            'total_calories': calories['total'] or 0,
+            'total_water': water['total'] or 0,
+            'last_mood': last_mood,
+            'last_weight': last_weight,
+        })
+
+    @classmethod
+    def update_from_log(cls, log, created, previous_day=None):
+        if not created:
+            cls.refresh_day(log.user_id, log.recorded_date)
+            if previous_day is not None and previous_day != (log.user_id, _as_date(log.recorded_date)):
+                cls.refresh_day(*previous_day)
+        elif isinstance(log, CalorieLog):
+            cls.add_day(log.user_id, log.recorded_date, calories=log.amount)
+        elif isinstance(log, WaterLog):
+            cls.add_day(log.user_id, log.recorded_date, water=log.amount)
+        elif isinstance(log, MentalHealthLog):
+            cls.add_day(log.user_id, log.recorded_date, mood=log.mood)
+        elif isinstance(log, PhysicalHealthLog):
+            cls.add_day(log.user_id, log.recorded_date, weight=log.weight)
+
+    class Meta:
+        managed = True
+        db_table = 'daily_health_summary'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'recorded_date'], name='daily_health_summary_user_date')
+        ]
 
 
 class EquipmentBank(models.Model):
@@ -92,6 +267,7 @@ class EquipmentBank(models.Model):
     def save(self, *args, **kwargs):
         self.last_update = timezone.now()
         super(EquipmentBank, self).save(*args, **kwargs)
+        invalidate_lookup_bank(EQUIPMENT)
 
     class Meta:
         managed = True
@@ -114,6 +290,7 @@ class ExerciseBank(models.Model):
     def save(self, *args, **kwargs):
         self.last_update = timezone.now()
         super(ExerciseBank, self).save(*args, **kwargs)
+        invalidate_lookup_bank(EXERCISES)
 
     class Meta:
         managed = True
@@ -142,6 +319,7 @@ class ExerciseInWorkoutPlan(models.Model):
     class Meta:
         managed = True
         db_table = 'exercise_in_workout_plan'
+        indexes = [models.Index(fields=['plan', 'last_update'])]
 
 
 class GoalBank(models.Model):
@@ -156,13 +334,40 @@ class GoalBank(models.Model):
     def save(self, *args, **kwargs):
         self.last_update = timezone.now()
         super(GoalBank, self).save(*args, **kwargs)
+        invalidate_lookup_bank(GOALS)
 
     class Meta:
         managed = True
         db_table = 'goal_bank'
 
 
-class MentalHealthLog(models.Model):
+# Responses of write requests sent with an Idempotency-Key header, so a retried request gets the stored
+# response instead of writing again (see services/idempotency.py)
+# Keys are scoped per user; rows past `expires` are ignored and removed by `python manage.py purge_idempotency_keys`
+class IdempotencyKey(models.Model):
+    idempotency_id = models.AutoField(primary_key=True)
+    key = models.CharField(max_length=255)
+    user_id = models.IntegerField(default=0)  # 0 when the request names no user
+    request_hash = models.CharField(max_length=64)  # sha256 of method, path and body
+    status = models.SmallIntegerField(blank=True, null=True)  # null while the first request is still running
+    content_type = models.CharField(max_length=100, blank=True, default='')
+    response = models.BinaryField(blank=True, null=True)
+    created = models.DateTimeField(default=timezone.now)
+    expires = models.DateTimeField()
+
+    def __str__(self):
+        return f'{self.user_id} {self.key}'
+
+    class Meta:
+        managed = True
+        db_table = 'idempotency_key'
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'key'], name='idempotency_key_user_key')
+        ]
+        indexes = [models.Index(fields=['expires'])]
+
+
+class MentalHealthLog(SummarizedLogMixin, models.Model):
     mental_health_id = models.AutoField(primary_key=True)
     user = models.ForeignKey('User', models.DO_NOTHING)
     mood = models.CharField(max_length=7)
@@ -173,13 +378,21 @@ class MentalHealthLog(models.Model):
     def __str__(self):
         return self.mental_health_id
 
-    def save(self, *args, **kwargs):
+    def save(self, *args, update_summary=True, **kwargs):
+        created = self._state.adding
         self.last_update = timezone.now()
         super(MentalHealthLog, self).save(*args, **kwargs)
+        previous_day, self._summary_day = self._summary_day, (self.user_id, self.recorded_date)
+        if update_summary:
+            DailyHealthSummary.update_from_log(self, created, previous_day)
 
     class Meta:
         managed = True
         db_table = 'mental_health_log'
+        indexes = [
+            models.Index(fields=['user', 'recorded_date']),
+            models.Index(fields=['user', 'last_update']),
+        ]
 
 
 class MessageLog(models.Model):
@@ -195,12 +408,20 @@ class MessageLog(models.Model):
         return self.name
 
     def save(self, *args, **kwargs):
+        created = self._state.adding
         self.last_update = timezone.now()
         super(MessageLog, self).save(*args, **kwargs)
+        if created:
+            Conversation.record_message(self)
 
     class Meta:
         managed = True
         db_table = 'message_log'
+        indexes = [
+            models.Index(fields=['sender', 'recipient', 'sent_date']),
+            models.Index(fields=['sender', 'last_update']),
+            models.Index(fields=['recipient', 'last_update']),
+        ]
 
 
 class MuscleGroupBank(models.Model):
@@ -215,13 +436,14 @@ class MuscleGroupBank(models.Model):
     def save(self, *args, **kwargs):
         self.last_update = timezone.now()
         super(MuscleGroupBank, self).save(*args, **kwargs)
+        invalidate_lookup_bank(MUSCLE_GROUPS)
 
     class Meta:
         managed = True
         db_table = 'muscle_group_bank'
 
 
-class PhysicalHealthLog(models.Model):
+class PhysicalHealthLog(SummarizedLogMixin, models.Model):
     physical_health_id = models.AutoField(primary_key=True)
     user = models.ForeignKey('User', models.DO_NOTHING)
     weight = models.DecimalField(max_digits=5, decimal_places=2, blank=True, null=True)
@@ -233,13 +455,21 @@ class PhysicalHealthLog(models.Model):
     def __str__(self):
         return self.name
 
-    def save(self, *args, **kwargs):
+    def save(self, *args, update_summary=True, **kwargs):
+        created = self._state.adding
         self.last_update = timezone.now()
         super(PhysicalHealthLog, self).save(*args, **kwargs)
+        previous_day, self._summary_day = self._summary_day, (self.user_id, self.recorded_date)
+        if update_summary:
+            DailyHealthSummary.update_from_log(self, created, previous_day)
 
     class Meta:
         managed = True
         db_table = 'physical_health_log'
+        indexes = [
+            models.Index(fields=['user', 'recorded_date']),
+            models.Index(fields=['user', 'last_update']),
+        ]
 
 
 class User(models.Model):
@@ -255,6 +485,10 @@ class User(models.Model):
     created = models.DateTimeField(default=timezone.now)
     last_update = models.DateTimeField(default=timezone.now)
 
+    # Lets DRF permission classes treat an authenticated User like a django auth user
+    is_authenticated = True
+    is_anonymous = False
+
     # Changed the return to a string, this allows a properly functioning generic endpoint
     def __str__(self):
         # return self.name
@@ -287,7 +521,7 @@ class UserCredentials(models.Model):
         db_table = 'user_credentials'
 
 
-class WaterLog(models.Model):
+class WaterLog(SummarizedLogMixin, models.Model):
     water_id = models.AutoField(primary_key=True)
     user = models.ForeignKey(User, models.DO_NOTHING)
     amount = models.IntegerField()
@@ -298,19 +532,30 @@ class WaterLog(models.Model):
     def __str__(self):
         return self.water_id
 
-    def save(self, *args, **kwargs):
+    def save(self, *args, update_summary=True, **kwargs):
+        created = self._state.adding
         self.last_update = timezone.now()
         super(WaterLog, self).save(*args, **kwargs)
+        previous_day, self._summary_day = self._summary_day, (self.user_id, self.recorded_date)
+        if update_summary:
+            DailyHealthSummary.update_from_log(self, created, previous_day)
 
     class Meta:
         managed = True
         db_table = 'water_log'
+        indexes = [
+            models.Index(fields=['user', 'recorded_date']),
+            models.Index(fields=['user', 'last_update']),
+        ]
 
 
 class WorkoutLog(models.Model):
     workout_id = models.AutoField(primary_key=True)
     user = models.ForeignKey(User, models.DO_NOTHING)
     exercise_in_plan = models.ForeignKey(ExerciseInWorkoutPlan, models.DO_NOTHING)
+    # Copy of exercise_in_plan.plan, set on save (again whenever exercise_in_plan changes) so plan level queries
+    # skip the exercise_in_plan join. Rows written before it existed are filled in by the backfill_workout_log_plans command
+    plan = models.ForeignKey('WorkoutPlan', models.DO_NOTHING, blank=True, null=True, related_name='workout_logs')
     reps = models.IntegerField(blank=True, null=True)
     weight = models.IntegerField(blank=True, null=True)
     duration_minutes = models.IntegerField(blank=True, null=True)
@@ -321,13 +566,31 @@ class WorkoutLog(models.Model):
     def __str__(self):
         return self.name
 
+    _saved_exercise_in_plan_id = None  # As loaded or last saved, so a changed exercise_in_plan re-derives the plan
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_exercise_in_plan_id = instance.__dict__.get('exercise_in_plan_id')
+        return instance
+
     def save(self, *args, **kwargs):
         self.last_update = timezone.now()
+        if self.exercise_in_plan_id is not None and (
+                self.plan_id is None or self.exercise_in_plan_id != self._saved_exercise_in_plan_id):
+            self.plan_id = self.exercise_in_plan.plan_id
         super(WorkoutLog, self).save(*args, **kwargs)
+        self._saved_exercise_in_plan_id = self.exercise_in_plan_id
 
     class Meta:
         managed = True
         db_table = 'workout_log'
+        indexes = [
+            models.Index(fields=['user', 'created']),
+            models.Index(fields=['user', 'completed_date']),
+            models.Index(fields=['plan', 'completed_date']),
+            models.Index(fields=['user', 'last_update']),
+        ]
 
 
 class WorkoutPlan(models.Model):
@@ -349,6 +612,7 @@ class WorkoutPlan(models.Model):
     class Meta:
         managed = True
         db_table = 'workout_plan'
+        indexes = [models.Index(fields=['user', 'last_update'])]
 
 #Create a custom subclass of DRF Token to work with our custom User class
 #From https://stackoverflow.com/questions/66642029/django-rest-framework-generate-a-token-for-a-non-built-in-user-model-class
@@ -367,3 +631,26 @@ class AuthToken(Token):
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
         AuthToken.objects.create(user=instance)
+
+
+# Keep the token authentication cache in sync (see services/token_cache.py)
+@receiver(post_delete, sender=AuthToken)
+def uncache_auth_token(sender, instance=None, **kwargs):
+    revoke_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Coach)
+@receiver(post_save, sender=Admin)
+@receiver(post_delete, sender=Coach)
+@receiver(post_delete, sender=Admin)
+def uncache_user_token(sender, instance=None, **kwargs):
+    token_cache.invalidate_user(instance.user_id)
+
+
+@receiver(post_delete, sender=CalorieLog)
+@receiver(post_delete, sender=WaterLog)
+@receiver(post_delete, sender=MentalHealthLog)
+@receiver(post_delete, sender=PhysicalHealthLog)
+def refresh_daily_health_summary(sender, instance=None, **kwargs):
+    DailyHealthSummary.refresh_day(instance.user_id, instance.recorded_date)
@@ -3,16 +3,38 @@ from rest_framework import serializers
 from django.core.validators import EmailValidator
 from django.core.exceptions import ValidationError
 from rest_framework.validators import UniqueValidator
+from django.db import transaction
+from django.utils import timezone
 
 
 from .models import *
+from .services.lookup_cache import get_lookup_index, GOALS
+from .services.token_cache import token_cache
+from .services.progression import invalidate_progression
+from .services.workout_logs import plan_of_log
+
+
+class CachedGoalField(serializers.Field):
+    """
+    Read-only goal name, resolved from the cached goal bank instead of loading the related GoalBank row.
+    """
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        return instance.goal_id
+
+    def to_representation(self, value):
+        goal = get_lookup_index(GOALS).get(value)
+        return goal['goal_name'] if goal else None
 
 
 class UserSerializer(serializers.ModelSerializer):
     email = serializers.CharField(
         validators=[EmailValidator(message='Enter a valid email address')],
     )
-    goal = serializers.StringRelatedField(many=False)
+    goal = CachedGoalField()
 
     class Meta:
         model = User
@@ -41,7 +63,7 @@ class UserCredentialsSerializer(serializers.ModelSerializer):
 
 
 class CoachSerializer(serializers.ModelSerializer):
-    goal = serializers.StringRelatedField(many=False)
+    goal = CachedGoalField()
     first_name = serializers.CharField(read_only=True, source='user.first_name')
     last_name = serializers.CharField(read_only=True, source='user.last_name')
     gender = serializers.CharField(read_only=True, source='user.gender')
@@ -61,33 +83,86 @@ class CoachSerializer(serializers.ModelSerializer):
         return value
 
 
+class CoachSearchSerializer(CoachSerializer):
+    # Coaches from services.coach_search, annotated with their number of hired clients
+    client_count = serializers.IntegerField(read_only=True)
+
+    class Meta(CoachSerializer.Meta):
+        fields = CoachSerializer.Meta.fields + ['client_count']
+
+
 class GoalSerializer(serializers.ModelSerializer):
     class Meta:
         model = GoalBank
         fields = ['goal_id', 'goal_name']
 
 
-class CoachRequestSerializer(serializers.Serializer):
+class CoachClientSerializer(UserSerializer):
+    """
+    A coach's client, with their latest activity when the queryset is annotated with it (context['activity']).
+    """
+    latest_workout_date = serializers.DateField(read_only=True)
+    latest_weight = serializers.DecimalField(max_digits=5, decimal_places=2, read_only=True)
+
+    class Meta(UserSerializer.Meta):
+        fields = UserSerializer.Meta.fields + ['latest_workout_date', 'latest_weight']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not self.context.get('activity'):
+            self.fields.pop('latest_workout_date')
+            self.fields.pop('latest_weight')
+
+
+class ClientAdherenceSerializer(serializers.Serializer):
+    user_id = serializers.IntegerField()
+    first_name = serializers.CharField(allow_null=True)
+    last_name = serializers.CharField(allow_null=True)
+    workouts_7d = serializers.IntegerField()
+    workouts_30d = serializers.IntegerField()
+    last_workout_date = serializers.DateField(allow_null=True)
+    days_since_last_log = serializers.IntegerField(allow_null=True)
+    latest_weight = serializers.DecimalField(max_digits=5, decimal_places=2, allow_null=True)
+    avg_calories_30d = serializers.IntegerField(allow_null=True)
+
+
+class CoachClientSerializerMixin:
+    """
+    Loads the user named in the payload once and shares it between field validation and save().
+    """
+    def get_user_instance(self, pk):
+        try:
+            pk = int(pk)
+        except (ValueError, TypeError):
+            return None
+        if getattr(self, '_user_instance', None) is None or self._user_instance.pk != pk:
+            self._user_instance = User.objects.filter(pk=pk).first()
+        return self._user_instance
+
+    def save_user(self, has_coach, hired_coach_id):
+        user_instance = self.get_user_instance(self.validated_data['user'])
+        user_instance.has_coach = has_coach
+        user_instance.hired_coach_id = hired_coach_id
+        user_instance.save(update_fields=['has_coach', 'hired_coach', 'last_update'])
+
+
+class CoachRequestSerializer(CoachClientSerializerMixin, serializers.Serializer):
     user = serializers.IntegerField()
     coach = serializers.IntegerField()
 
     def save(self):
-        user_instance = User.objects.get(pk=self.validated_data['user'])
-        user_instance.has_coach = False
-        user_instance.hired_coach = Coach.objects.get(pk=self.validated_data['coach'])
-        user_instance.save()
+        self.save_user(False, self.validated_data['coach'])
 
     def validate_user(self, value):
-        try:
-            user_instance = User.objects.get(pk=value)
-        except User.DoesNotExist:
+        user_instance = self.get_user_instance(value)
+        if user_instance is None:
             print('User does not exist.')
             raise ValidationError('User does not exist.')
         if user_instance.has_coach:
             print('User already has a coach.')
             raise ValidationError('User already has a coach.')
 
-        if user_instance.hired_coach is not None:
+        if user_instance.hired_coach_id is not None:
             print('User has already requested a coach.')
             raise ValidationError('User has already requested a coach.')
         return value
@@ -99,20 +174,16 @@ class CoachRequestSerializer(serializers.Serializer):
         return value
 
 
-class CoachAcceptSerializer(serializers.Serializer):
+class CoachAcceptSerializer(CoachClientSerializerMixin, serializers.Serializer):
     user = serializers.IntegerField()
     coach = serializers.IntegerField()
 
     def save(self):
-        user_instance = User.objects.get(pk=self.validated_data['user'])
-        user_instance.has_coach = True
-        user_instance.hired_coach = Coach.objects.get(pk=self.validated_data['coach'])
-        user_instance.save()
+        self.save_user(True, self.validated_data['coach'])
 
     def validate_user(self, value):
-        try:
-            user_instance = User.objects.get(pk=value)
-        except User.DoesNotExist:
+        user_instance = self.get_user_instance(value)
+        if user_instance is None:
             print('User does not exist.')
             raise ValidationError('User does not exist.')
 
@@ -127,10 +198,7 @@ class CoachAcceptSerializer(serializers.Serializer):
             print('Coach does not exist.')
             raise ValidationError('Coach does not exist.')
 
-        try:
-            user_instance = User.objects.get(pk=self.initial_data['user'])
-        except User.DoesNotExist:
-            user_instance = None
+        user_instance = self.get_user_instance(self.initial_data.get('user'))
 
         if user_instance is not None and user_instance.hired_coach_id != value:
             print('Coach was not requested by user.')
@@ -139,6 +207,60 @@ class CoachAcceptSerializer(serializers.Serializer):
         return value
 
 
+class CoachTriageSerializer(serializers.Serializer):
+    """
+    Accepts and declines many pending client requests of one coach in one transaction.
+    The requests are checked and locked with one query, then each action is a single UPDATE over all of its users.
+    Either every listed user is triaged or, if any of them has no pending request for the coach, none are.
+    """
+    MAX_USERS = 500
+
+    coach = serializers.IntegerField()
+    accept = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    decline = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+
+    def validate_coach(self, value):
+        if not Coach.objects.filter(pk=value).exists():
+            raise ValidationError('Coach does not exist.')
+        return value
+
+    def validate(self, data):
+        accept, decline = set(data['accept']), set(data['decline'])
+        if not accept and not decline:
+            raise ValidationError('No users to accept or decline.')
+        if len(accept) + len(decline) > self.MAX_USERS:
+            raise ValidationError(f'Cannot triage more than {self.MAX_USERS} users at once.')
+        if accept & decline:
+            raise ValidationError(f'User(s) both accepted and declined: {sorted(accept & decline)}')
+        data['accept'], data['decline'] = sorted(accept), sorted(decline)
+        return data
+
+    def save(self):
+        coach_id = self.validated_data['coach']
+        accept, decline = self.validated_data['accept'], self.validated_data['decline']
+        now = timezone.now()
+        with transaction.atomic():
+            pending = set(User.objects.select_for_update().filter(
+                hired_coach_id=coach_id, has_coach=False, user_id__in=accept + decline
+            ).values_list('user_id', flat=True))
+            not_pending = sorted(set(accept + decline) - pending)
+            if not_pending:
+                raise serializers.ValidationError(
+                    {'users': f'User(s) have not requested this coach: {not_pending}'})
+
+            if accept:
+                User.objects.filter(hired_coach_id=coach_id, user_id__in=accept).update(
+                    has_coach=True, last_update=now)
+            if decline:
+                User.objects.filter(hired_coach_id=coach_id, user_id__in=decline).update(
+                    hired_coach=None, has_coach=False, last_update=now)
+
+            # Queryset updates skip the save() signals, so drop cached users explicitly
+            transaction.on_commit(lambda: [token_cache.invalidate_user(user_id) for user_id in pending])
+
+        return {'accepted': accept, 'declined': decline}
+
+
 class PhysicalHealthLogSerializer(serializers.ModelSerializer):
     class Meta:
         model = PhysicalHealthLog
@@ -206,11 +328,14 @@ class ExerciseInWorkoutPlanSerializer(serializers.ModelSerializer):
     class RelatedExerciseField(serializers.PrimaryKeyRelatedField):
         """
         Allows ExerciseInWorkoutPlanSerializer to take an exercise_id for the exercise instead of an instance. 
+        Serializes the related exercise instance directly, so exercises loaded with select_related
+        (see services/workout_plans.py) don't cost an extra query each.
         """
+        def use_pk_only_optimization(self):
+            return False
+
         def to_representation(self, value):
-            value = super().to_representation(value)
-            exercise = self.queryset.get(pk=value)
-            return ExerciseSerializer(exercise).data
+            return ExerciseSerializer(value).data
 
     exercise = RelatedExerciseField(queryset=ExerciseBank.objects.all())
     plan_id = serializers.PrimaryKeyRelatedField(queryset=WorkoutPlan.objects.all())
@@ -260,20 +385,53 @@ class WorkoutPlanSerializer(serializers.ModelSerializer):
     class Meta:
         model = WorkoutPlan
         fields = ['plan_id', 'user_id', 'plan_name', 'creation_date', 'exercises']
+    # Plans should be loaded through services.workout_plans.load_workout_plans,
+    # which prefetches only the active exercises (is_active=0 rows are filtered in SQL)
+
+class WorkoutPlanExerciseCreateSerializer(serializers.Serializer):
+    exercise = serializers.IntegerField()
+    sets = serializers.IntegerField(required=False, allow_null=True, min_value=1)
+    # 0 is valid for bodyweight (weight), timed (reps) and rep-only (durationMinutes) exercises
+    reps = serializers.IntegerField(required=False, allow_null=True, min_value=0)
+    weight = serializers.IntegerField(required=False, allow_null=True, min_value=0)
+    durationMinutes = serializers.IntegerField(source='duration_minutes', required=False, allow_null=True, min_value=0)
+
+
+class WorkoutPlanCreateSerializer(serializers.Serializer):
+    """
+    Validates the create_workout_plan payload and creates the plan and all of its exercises in one transaction.
+    Exercise ids are checked with a single query and the exercises are inserted with one bulk_create.
+    """
+    user = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
+    planName = serializers.CharField(source='plan_name', max_length=255)
+    creationDate = serializers.DateField(source='creation_date', required=False, allow_null=True)
+    exercises = WorkoutPlanExerciseCreateSerializer(many=True, required=False, allow_null=True)
+
+    def validate_exercises(self, value):
+        if not value:
+            return []
+        exercise_ids = {exercise['exercise'] for exercise in value}
+        found = set(ExerciseBank.objects.filter(exercise_id__in=exercise_ids, is_active=1)
+                    .values_list('exercise_id', flat=True))
+        missing = exercise_ids - found
+        if missing:
+            raise ValidationError(f'Exercise(s) do not exist: {sorted(missing)}')
+        return value
 
-    def to_representation(self, instance):
-        representation = super().to_representation(instance)
-
-        # Filter out exercises with is_active=0
-        active_exercises = [
-            exercise
-            for exercise in representation.get('exercises', [])
-            if exercise.get('is_active', 1) != 0
-        ]
-
-        representation['exercises'] = active_exercises
+    def create(self, validated_data):
+        exercises = validated_data.pop('exercises', None) or []
+        if validated_data.get('creation_date') is None:
+            validated_data.pop('creation_date', None)
+        now = timezone.now()
+        with transaction.atomic():
+            plan = WorkoutPlan.objects.create(**validated_data, created=now, last_update=now)
+            ExerciseInWorkoutPlan.objects.bulk_create([
+                ExerciseInWorkoutPlan(plan=plan, exercise_id=exercise.pop('exercise'), **exercise,
+                                      created=now, last_update=now)
+                for exercise in exercises
+            ])
+        return plan
 
-        return representation
 
 class ViewBecomeCoachRequestSerializer(serializers.ModelSerializer):
     name = serializers.SerializerMethodField()
@@ -324,10 +482,78 @@ class DailySurveySerializer(serializers.Serializer):
     weight = serializers.DecimalField(max_digits=5, decimal_places=2)
 
 
+class DailyHealthSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailyHealthSummary
+        fields = ['user', 'recorded_date', 'total_calories', 'total_water', 'last_mood', 'last_weight']
+
+
 class WorkoutLogSerializer(serializers.ModelSerializer):
     class Meta:
         model = WorkoutLog
         fields = '__all__'
+        read_only_fields = ['plan']  # Always copied from exercise_in_plan
+
+
+class WorkoutSetSerializer(serializers.Serializer):
+    exercise_in_plan = serializers.IntegerField()
+    reps = serializers.IntegerField(required=False, allow_null=True, min_value=0)
+    weight = serializers.IntegerField(required=False, allow_null=True, min_value=0)
+    duration_minutes = serializers.IntegerField(required=False, allow_null=True, min_value=0)
+
+
+class WorkoutSessionSerializer(serializers.Serializer):
+    """
+    Validates a workout session (the sets of one plan done by its user) and logs every set in one transaction.
+    User, plan and exercise_in_plan ids are all checked with a single query, and the logs are inserted with one bulk_create.
+    Sets must use active exercises of an active plan.
+    """
+    MAX_SETS = 200
+
+    user = serializers.IntegerField()
+    plan = serializers.IntegerField()
+    completed_date = serializers.DateField(required=False)
+    sets = WorkoutSetSerializer(many=True, allow_empty=False)
+
+    def validate_sets(self, value):
+        if len(value) > self.MAX_SETS:
+            raise ValidationError(f'Cannot log more than {self.MAX_SETS} sets at once.')
+        return value
+
+    def validate(self, data):
+        exercise_in_plan_ids = {workout_set['exercise_in_plan'] for workout_set in data['sets']}
+        rows = ExerciseInWorkoutPlan.objects.filter(exercise_in_plan_id__in=exercise_in_plan_ids).values_list(
+            'exercise_in_plan_id', 'plan_id', 'plan__user_id', 'is_active', 'plan__is_active')
+        in_plan, inactive = set(), set()
+        for exercise_in_plan_id, plan_id, user_id, is_active, plan_is_active in rows:
+            if plan_id == data['plan'] and user_id == data['user']:
+                in_plan.add(exercise_in_plan_id)
+                if not is_active or not plan_is_active:
+                    inactive.add(exercise_in_plan_id)
+        invalid = exercise_in_plan_ids - in_plan
+        if invalid:
+            raise ValidationError(f'Exercise(s) are not in this user\'s plan: {sorted(invalid)}')
+        if inactive:
+            raise ValidationError(f'Exercise(s) were removed from this plan: {sorted(inactive)}')
+        return data
+
+    def create(self, validated_data):
+        completed_date = validated_data.get('completed_date') or timezone.localdate()
+        now = timezone.now()
+        with transaction.atomic():
+            logs = WorkoutLog.objects.bulk_create([
+                WorkoutLog(user_id=validated_data['user'], plan_id=validated_data['plan'],
+                           exercise_in_plan_id=workout_set.pop('exercise_in_plan'),
+                           completed_date=completed_date, created=now, last_update=now, **workout_set)
+                for workout_set in validated_data['sets']
+            ])
+            if logs[0].pk is None:
+                # Backends that can't return ids from a bulk insert (MySQL): read the rows back, they share `created`
+                logs = list(WorkoutLog.objects.filter(
+                    user_id=validated_data['user'], plan_id=validated_data['plan'], created=now,
+                ).order_by('workout_id')[:len(logs)])
+            invalidate_progression(validated_data['user'])
+        return logs
 
 
 class WorkoutLogSerializerDom(serializers.ModelSerializer):
@@ -338,9 +564,8 @@ class WorkoutLogSerializerDom(serializers.ModelSerializer):
         fields = ['plan', 'exercise', 'reps', 'weight', 'duration_minutes', 'completed_date']
 
     def get_plan(self, obj):
-        if obj.exercise_in_plan and obj.exercise_in_plan.plan:
-            return obj.exercise_in_plan.plan.plan_name
-        return None
+        plan = plan_of_log(obj)
+        return plan.plan_name if plan else None
 
     def get_exercise(self, obj):
         if obj.exercise_in_plan:
@@ -348,32 +573,23 @@ class WorkoutLogSerializerDom(serializers.ModelSerializer):
         return None
 
 
-class CoachDeclineSerializer(serializers.Serializer):
+class CoachDeclineSerializer(CoachClientSerializerMixin, serializers.Serializer):
     user = serializers.IntegerField()
     coach = serializers.IntegerField()
 
     def save(self):
-        user_instance = User.objects.get(pk=self.validated_data['user'])
-        user_instance.hired_coach = None
-        user_instance.has_coach = 0
-        user_instance.save()
+        self.save_user(False, None)
 
     def validate(self, data):
-        user_id = data['user']
-        coach_id = data['coach']
-
-        try:
-            user_instance = User.objects.get(pk=user_id)
-        except User.DoesNotExist:
+        user_instance = self.get_user_instance(data['user'])
+        if user_instance is None:
             raise ValidationError('User does not exist.')
 
-        if user_instance.hired_coach_id != coach_id:
+        if user_instance.hired_coach_id != data['coach']:
             raise ValidationError('Invalid client request.')
 
         return data
 
-        return value
-
     def validate_coach(self, value):
         if not Coach.objects.filter(pk=value).exists():
             print('Coach does not exist.')
@@ -0,0 +1,53 @@
+from datetime import timedelta
+from django.db.models import Avg, Count, Max, Q
+from django.utils import timezone
+from ..models import WorkoutLog, DailyHealthSummary
+
+# Adherence of a page of a coach's clients (see coach_clients.py), used by CoachAdherence
+# Workouts in the last 7 and 30 days, days since the client last logged anything (a workout or a health log),
+# latest weight and the average daily calories over the last 30 days
+# Three queries per page whatever its size: the client page itself (with latest workout date and weight), one grouped
+# query over WorkoutLog and one over DailyHealthSummary (daily totals of the health logs)
+
+ADHERENCE_WINDOWS = (7, 30)
+
+
+def client_adherence(clients, today=None):
+    # clients is a page from client_queryset(..., with_activity=True)
+    today = today or timezone.localdate()
+    user_ids = [client.user_id for client in clients]
+    if not user_ids:
+        return []
+    start = {days: today - timedelta(days=days - 1) for days in ADHERENCE_WINDOWS}
+
+    workouts = {row['user_id']: row for row in WorkoutLog.objects.filter(
+        user_id__in=user_ids, completed_date__gte=start[max(ADHERENCE_WINDOWS)], completed_date__lte=today,
+    ).order_by().values('user_id').annotate(**{
+        f'workouts_{days}d': Count('workout_id', filter=Q(completed_date__gte=start[days]))
+        for days in ADHERENCE_WINDOWS
+    })}
+
+    health = {row['user_id']: row for row in DailyHealthSummary.objects.filter(
+        user_id__in=user_ids, recorded_date__lte=today,
+    ).order_by().values('user_id').annotate(
+        last_log_date=Max('recorded_date'),
+        avg_calories_30d=Avg('total_calories', filter=Q(recorded_date__gte=start[30], total_calories__gt=0)),
+    )}
+
+    result = []
+    for client in clients:
+        client_workouts = workouts.get(client.user_id, {})
+        client_health = health.get(client.user_id, {})
+        last_dates = [day for day in (client.latest_workout_date, client_health.get('last_log_date')) if day]
+        avg_calories = client_health.get('avg_calories_30d')
+        result.append({
+            'user_id': client.user_id,
+            'first_name': client.first_name,
+            'last_name': client.last_name,
+            **{f'workouts_{days}d': client_workouts.get(f'workouts_{days}d', 0) for days in ADHERENCE_WINDOWS},
+            'last_workout_date': client.latest_workout_date,
+            'days_since_last_log': (today - max(last_dates)).days if last_dates else None,
+            'latest_weight': client.latest_weight,
+            'avg_calories_30d': round(avg_calories) if avg_calories is not None else None,
+        })
+    return result
@@ -0,0 +1,56 @@
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from ..models import User, WorkoutLog, PhysicalHealthLog
+from .coach_search import encode_cursor, decode_cursor, InvalidSearch, DEFAULT_SEARCH_LIMIT
+
+# Clients (hired) or pending requests (not hired) of a coach, used by CoachClients
+# Ordered by user_id and paginated with an opaque keyset cursor, so every page is one bounded query
+# Each row carries the coach's total client and request counts as scalar subqueries, and optionally the
+# client's latest workout date and latest recorded weight (with_activity)
+
+
+def _count(coach_id, hired):
+    counted = User.objects.filter(hired_coach_id=coach_id, has_coach=hired).order_by() \
+        .values('hired_coach_id').annotate(total=Count('user_id')).values('total')
+    return Coalesce(Subquery(counted, output_field=IntegerField()), Value(0))
+
+
+def client_queryset(coach_id, hired, with_activity=False):
+    clients = User.objects.filter(hired_coach_id=coach_id, has_coach=hired).annotate(
+        client_count=_count(coach_id, True),
+        request_count=_count(coach_id, False),
+    ).order_by('user_id')
+
+    if with_activity:
+        latest_workout = WorkoutLog.objects.filter(user_id=OuterRef('user_id')).order_by('-completed_date')
+        latest_weight = PhysicalHealthLog.objects.filter(user_id=OuterRef('user_id'), weight__isnull=False) \
+            .order_by('-recorded_date', '-physical_health_id')
+        clients = clients.annotate(
+            latest_workout_date=Subquery(latest_workout.values('completed_date')[:1]),
+            latest_weight=Subquery(latest_weight.values('weight')[:1]),
+        )
+    return clients
+
+
+def client_counts(coach_id, page):
+    # Counts carried by the page's rows, or one aggregate query for an empty page
+    if page:
+        return {'client_count': page[0].client_count, 'request_count': page[0].request_count}
+    return User.objects.filter(hired_coach_id=coach_id).aggregate(
+        client_count=Count('user_id', filter=Q(has_coach=True)),
+        request_count=Count('user_id', filter=Q(has_coach=False)),
+    )
+
+
+def paginate_clients(clients, limit=DEFAULT_SEARCH_LIMIT, after=None):
+    # Returns (page of clients, cursor for the next page or None)
+    if after is not None:
+        sort_value, user_id = decode_cursor(after, None)
+        clients = clients.filter(user_id__gt=user_id)
+
+    page = list(clients[:limit + 1])
+    if len(page) <= limit:
+        return page, None
+    page = page[:limit]
+    return page, encode_cursor(None, page[-1].user_id)
+
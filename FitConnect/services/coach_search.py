@@ -0,0 +1,119 @@
+import base64
+import json
+from decimal import Decimal
+from django.db.models import Count, Q
+from ..models import Coach
+from .lookup_cache import get_lookup_bank, GOALS
+
+# Coach marketplace search used by CoachList and CoachSearch
+# Filters: goal, minimum experience, maximum cost
+# Sorting: cost, experience or clients (number of hired clients), prefix with '-' for descending; ties by coach_id
+# Cost and experience sort on the coach's own columns so their indexes serve the order and the cursor seek;
+# a coach without one sorts lowest (first ascending, last descending)
+# Pagination: limit/offset (no limit returns every coach), or keyset with the opaque `after` cursor returned as `next` (stays fast on deep pages)
+# Facets: coach counts per goal and per price bucket, computed in one aggregate query. Each facet ignores its
+# own filter (the goal facet shows every goal's count under the current cost/experience filters, and so on)
+
+PRICE_BUCKETS = [(Decimal(0), Decimal(25)), (Decimal(25), Decimal(50)), (Decimal(50), Decimal(100)), (Decimal(100), None)]
+
+SORT_FIELDS = {'cost': 'cost', 'experience': 'experience', 'clients': 'client_count'}
+SORT_VALUE_TYPES = {'cost': Decimal, 'experience': int, 'clients': int}
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+
+class InvalidSearch(ValueError):
+    pass
+
+
+def encode_cursor(sort_value, coach_id):
+    raw = json.dumps([str(sort_value) if sort_value is not None else None, coach_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor, sort_field):
+    try:
+        sort_value, coach_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if sort_field is not None and sort_value is not None:
+            sort_value = SORT_VALUE_TYPES[sort_field](sort_value)
+        return sort_value, int(coach_id)
+    except (ValueError, TypeError, ArithmeticError):
+        raise InvalidSearch('Invalid cursor')
+
+
+def _filters(goal, min_experience, max_cost):
+    goal_q = Q(goal_id=goal) if goal is not None else Q()
+    experience_q = Q(experience__gte=min_experience) if min_experience is not None else Q()
+    cost_q = Q(cost__lte=max_cost) if max_cost is not None else Q()
+    return goal_q, experience_q, cost_q
+
+
+def coach_queryset(goal=None, min_experience=None, max_cost=None, sort=None):
+    # Filtered and ordered coaches, annotated with client_count
+    goal_q, experience_q, cost_q = _filters(goal, min_experience, max_cost)
+    coaches = Coach.objects.filter(goal_q & experience_q & cost_q).select_related('user').annotate(
+        client_count=Count('user_hired_coach', filter=Q(user_hired_coach__has_coach=True)))
+
+    if sort is None:
+        return coaches.order_by('coach_id')
+    field = sort.lstrip('-')
+    if field not in SORT_FIELDS:
+        raise InvalidSearch(f"sort must be one of {', '.join(SORT_FIELDS)} (prefix with - for descending)")
+    if sort.startswith('-'):
+        return coaches.order_by(f'-{SORT_FIELDS[field]}', '-coach_id')
+    return coaches.order_by(SORT_FIELDS[field], 'coach_id')
+
+
+def _after(column, sort_value, coach_id, descending):
+    # Coaches after (sort_value, coach_id) in the sort order, NULL sorting lowest
+    if descending:
+        if sort_value is None:
+            return Q(**{f'{column}__isnull': True, 'coach_id__lt': coach_id})
+        return Q(**{f'{column}__lt': sort_value}) | Q(**{column: sort_value, 'coach_id__lt': coach_id}) \
+            | Q(**{f'{column}__isnull': True})
+    if sort_value is None:
+        return Q(**{f'{column}__isnull': True, 'coach_id__gt': coach_id}) | Q(**{f'{column}__isnull': False})
+    return Q(**{f'{column}__gt': sort_value}) | Q(**{column: sort_value, 'coach_id__gt': coach_id})
+
+
+def paginate(coaches, sort=None, limit=DEFAULT_SEARCH_LIMIT, offset=0, after=None):
+    # Returns (page of coaches, cursor for the next page or None)
+    field = sort.lstrip('-') if sort else None
+    if after is not None:
+        sort_value, coach_id = decode_cursor(after, field)
+        if field is None:
+            coaches = coaches.filter(coach_id__gt=coach_id)
+        else:
+            coaches = coaches.filter(_after(SORT_FIELDS[field], sort_value, coach_id, sort.startswith('-')))
+        offset = 0
+
+    if limit is None:
+        return list(coaches[offset:]), None
+    page = list(coaches[offset:offset + limit + 1])
+    if len(page) <= limit:
+        return page, None
+    page = page[:limit]
+    last = page[-1]
+    return page, encode_cursor(getattr(last, SORT_FIELDS[field]) if field else None, last.coach_id)
+
+
+def coach_facets(goal=None, min_experience=None, max_cost=None):
+    # Total, per goal and per price bucket counts in a single aggregate query
+    goal_q, experience_q, cost_q = _filters(goal, min_experience, max_cost)
+    version, goals = get_lookup_bank(GOALS)
+
+    counts = {'total': Count('coach_id', filter=goal_q & cost_q)}
+    for row in goals:
+        counts[f"goal_{row['goal_id']}"] = Count('coach_id', filter=cost_q & Q(goal_id=row['goal_id']))
+    for index, (low, high) in enumerate(PRICE_BUCKETS):
+        bucket_q = Q(cost__gte=low) & (Q(cost__lt=high) if high is not None else Q())
+        counts[f'price_{index}'] = Count('coach_id', filter=goal_q & bucket_q)
+    result = Coach.objects.filter(experience_q).aggregate(**counts)
+
+    return result['total'], {
+        'goal': [{'goal_id': row['goal_id'], 'goal_name': row['goal_name'], 'count': result[f"goal_{row['goal_id']}"]}
+                 for row in goals],
+        'price': [{'min': low, 'max': high, 'count': result[f'price_{index}']}
+                  for index, (low, high) in enumerate(PRICE_BUCKETS)],
+    }
@@ -0,0 +1,40 @@
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.functions import Least, Greatest
+from ..models import Conversation, MessageLog
+
+# Rebuilds the Conversation table from message_log
+# Messages are grouped by participant pair in SQL and the latest message of each pair becomes last_message
+# Unread counts can't be derived from message_log, so the existing counts are carried over
+# Outputs:
+# The number of conversations written
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def rebuild_conversations():
+    pairs = MessageLog.objects.annotate(
+        one=Least('sender_id', 'recipient_id'), two=Greatest('sender_id', 'recipient_id')
+    ).values('one', 'two').annotate(last_message_id=Max('message_id')).order_by()
+    pairs = list(pairs)
+    sent_dates = dict(MessageLog.objects.filter(message_id__in=[pair['last_message_id'] for pair in pairs])
+                      .values_list('message_id', 'sent_date'))
+
+    with transaction.atomic():
+        unread = {
+            (one, two): (one_unread, two_unread)
+            for one, two, one_unread, two_unread in Conversation.objects.values_list(
+                'user_one_id', 'user_two_id', 'user_one_unread', 'user_two_unread')
+        }
+        Conversation.objects.all().delete()
+        Conversation.objects.bulk_create([
+            Conversation(
+                user_one_id=pair['one'], user_two_id=pair['two'],
+                last_message_id=pair['last_message_id'], last_message_time=sent_dates[pair['last_message_id']],
+                user_one_unread=unread.get((pair['one'], pair['two']), (0, 0))[0],
+                user_two_unread=unread.get((pair['one'], pair['two']), (0, 0))[1],
+            )
+            for pair in pairs
+        ], batch_size=REBUILD_BATCH_SIZE)
+
+    return len(pairs)
@@ -0,0 +1,52 @@
+from django.db import transaction
+from django.db.models import Sum
+from ..models import DailyHealthSummary, CalorieLog, WaterLog, MentalHealthLog, PhysicalHealthLog
+
+# Rebuilds the DailyHealthSummary rollup from the raw log tables
+# Totals are aggregated in SQL per (user, recorded_date); the last mood and weight of each day
+# are taken from the most recently created log, streamed in created order
+# Parameters:
+# user_id - optional, only rebuild this user's rows
+# dates   - optional, only rebuild these days (used after bulk writes, which skip the log save() methods)
+# Outputs:
+# The number of summary rows written
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def rebuild_daily_health_summaries(user_id=None, dates=None):
+    def logs(model):
+        queryset = model.objects.all()
+        if user_id is not None:
+            queryset = queryset.filter(user_id=user_id)
+        if dates is not None:
+            queryset = queryset.filter(recorded_date__in=dates)
+        return queryset
+
+    summaries = {}
+
+    def summary_for(user, recorded_date):
+        key = (user, recorded_date)
+        if key not in summaries:
+            summaries[key] = DailyHealthSummary(user_id=user, recorded_date=recorded_date)
+        return summaries[key]
+
+    for row in logs(CalorieLog).values('user_id', 'recorded_date').annotate(total=Sum('amount')).order_by():
+        summary_for(row['user_id'], row['recorded_date']).total_calories = row['total'] or 0
+
+    for row in logs(WaterLog).values('user_id', 'recorded_date').annotate(total=Sum('amount')).order_by():
+        summary_for(row['user_id'], row['recorded_date']).total_water = row['total'] or 0
+
+    moods = logs(MentalHealthLog).order_by('created', 'mental_health_id')
+    for user, recorded_date, mood in moods.values_list('user_id', 'recorded_date', 'mood').iterator():
+        summary_for(user, recorded_date).last_mood = mood
+
+    weights = logs(PhysicalHealthLog).filter(weight__isnull=False).order_by('created', 'physical_health_id')
+    for user, recorded_date, weight in weights.values_list('user_id', 'recorded_date', 'weight').iterator():
+        summary_for(user, recorded_date).last_weight = weight
+
+    with transaction.atomic():
+        logs(DailyHealthSummary).delete()
+        DailyHealthSummary.objects.bulk_create(summaries.values(), batch_size=REBUILD_BATCH_SIZE)
+
+    return len(summaries)
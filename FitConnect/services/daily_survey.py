@@ -0,0 +1,61 @@
+from django.db import transaction
+from django.utils import timezone
+from ..models import DailyHealthSummary, CalorieLog, WaterLog, MentalHealthLog, PhysicalHealthLog
+from .daily_health_summary import rebuild_daily_health_summaries
+
+# Writes validated daily surveys (DailySurveySerializer data) for one user in a single transaction
+# Each log table is written with one bulk_create, so a failure never leaves a partial day behind
+# Parameters:
+# user_id - the user the surveys belong to (existence is checked by the caller)
+# days    - list of validated survey dicts
+# upsert  - if True, a day that already has a log of some type updates that log instead of adding another
+#           (the most recent one, if there are several); used by the batch import so re-syncing is safe
+# Outputs:
+# None
+
+# (model, log field, survey field)
+DAILY_SURVEY_LOGS = [
+    (CalorieLog, 'amount', 'calorie_amount'),
+    (WaterLog, 'amount', 'water_amount'),
+    (MentalHealthLog, 'mood', 'mood'),
+    (PhysicalHealthLog, 'weight', 'weight'),
+]
+
+
+def _upsert_logs(model, field, user_id, values_by_date):
+    now = timezone.now()
+    existing = model.objects.filter(user_id=user_id, recorded_date__in=values_by_date.keys()) \
+        .order_by('recorded_date', '-created', '-pk')
+
+    to_update = {}
+    for log in existing:
+        if log.recorded_date not in to_update:  # Most recent log of the day
+            setattr(log, field, values_by_date[log.recorded_date])
+            log.last_update = now
+            to_update[log.recorded_date] = log
+    model.objects.bulk_update(to_update.values(), [field, 'last_update'])
+
+    model.objects.bulk_create([
+        model(user_id=user_id, recorded_date=recorded_date, **{field: value})
+        for recorded_date, value in values_by_date.items() if recorded_date not in to_update
+    ])
+
+
+def save_daily_surveys(user_id, days, upsert=False):
+    with transaction.atomic():
+        if upsert:
+            # Later entries for the same date win
+            days = list({day['recorded_date']: day for day in days}.values())
+            for model, field, survey_field in DAILY_SURVEY_LOGS:
+                _upsert_logs(model, field, user_id, {day['recorded_date']: day[survey_field] for day in days})
+            rebuild_daily_health_summaries(user_id=user_id, dates=[day['recorded_date'] for day in days])
+            return
+
+        for model, field, survey_field in DAILY_SURVEY_LOGS:
+            model.objects.bulk_create([
+                model(user_id=user_id, recorded_date=day['recorded_date'], **{field: day[survey_field]})
+                for day in days
+            ])
+        for day in days:
+            DailyHealthSummary.add_day(user_id, day['recorded_date'], calories=day['calorie_amount'],
+                                       water=day['water_amount'], mood=day['mood'], weight=day['weight'])
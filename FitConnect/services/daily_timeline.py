@@ -0,0 +1,72 @@
+from django.db import connection
+from ..models import CalorieLog, WaterLog, MentalHealthLog, PhysicalHealthLog
+
+# Builds the merged per-day view of a user's daily survey logs in one round trip
+# The four log tables are combined with UNION ALL and grouped by recorded_date, so every
+# returned day lines up across calorie, water, mood and weight
+# Calories and water are the day's totals; mood and weight are the day's most recently created log,
+# picked per returned day by a correlated subquery on the (user, recorded_date) index
+# Parameters:
+# start / end - optional inclusive date range
+# before      - keyset cursor, only days strictly older than this date are returned
+# limit       - max number of days returned
+# Outputs:
+# A list of dicts (most recent day first) in the DailySurveySerializer format
+# To fetch the next page, pass the recorded_date of the last returned day as `before`
+
+DEFAULT_TIMELINE_LIMIT = 5
+MAX_TIMELINE_LIMIT = 100
+
+TIMELINE_COLUMNS = ['recorded_date', 'calorie_amount', 'water_amount', 'mood', 'weight']
+
+
+def _log_select(model, conditions, column=None, value=None):
+    # Each log table contributes one column (or just its days); the rest are NULL so the UNION lines up
+    # The date conditions are applied inside every branch, so each table is read through its (user, recorded_date) index
+    columns = ', '.join(
+        f'{value} AS {name}' if name == column else f'NULL AS {name}' for name in TIMELINE_COLUMNS[1:3]
+    )
+    where = ' AND '.join(['user_id = %s'] + conditions)
+    return f'SELECT recorded_date, {columns} FROM {model._meta.db_table} WHERE {where}'
+
+
+def _latest_of_day(model, column, order_by):
+    table = model._meta.db_table
+    return (
+        f'(SELECT {column} FROM {table} WHERE {table}.user_id = %s AND {table}.recorded_date = daily_logs.recorded_date '
+        f'AND {column} IS NOT NULL ORDER BY {order_by} LIMIT 1)'
+    )
+
+
+def get_daily_timeline(user_id, start=None, end=None, before=None, limit=DEFAULT_TIMELINE_LIMIT):
+    conditions, condition_params = [], []
+    if start is not None:
+        conditions.append('recorded_date >= %s')
+        condition_params.append(start)
+    if end is not None:
+        conditions.append('recorded_date <= %s')
+        condition_params.append(end)
+    if before is not None:
+        conditions.append('recorded_date < %s')
+        condition_params.append(before)
+
+    latest = [
+        _latest_of_day(MentalHealthLog, 'mood', 'created DESC, mental_health_id DESC'),
+        _latest_of_day(PhysicalHealthLog, 'weight', 'created DESC, physical_health_id DESC'),
+    ]
+    selects = [
+        _log_select(CalorieLog, conditions, 'calorie_amount', 'amount'),
+        _log_select(WaterLog, conditions, 'water_amount', 'amount'),
+        _log_select(MentalHealthLog, conditions),
+        _log_select(PhysicalHealthLog, conditions),
+    ]
+    params = [user_id] * len(latest) + ([user_id] + condition_params) * len(selects) + [limit]
+
+    sql = (
+        f"SELECT recorded_date, SUM(calorie_amount), SUM(water_amount), {', '.join(latest)} "
+        f"FROM ({' UNION ALL '.join(selects)}) daily_logs "
+        f'GROUP BY recorded_date ORDER BY recorded_date DESC LIMIT %s'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [dict(zip(TIMELINE_COLUMNS, row)) for row in cursor.fetchall()]
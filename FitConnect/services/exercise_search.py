@@ -0,0 +1,321 @@
+import heapq
+import logging
+import re
+import threading
+from bisect import bisect_right
+from itertools import chain, count
+from django.db import connection, DatabaseError
+
+# In-process inverted index over ExerciseBank.name and description for SearchExercises ?q=
+# Every query word matches index tokens it is a prefix of ("bench pr" finds "Bench Press"),
+# and an exercise must match all query words. Words shorter than MIN_PREFIX_LENGTH only match whole tokens
+# Ranking: each word scores by its best match in the exercise (name over description, whole word over prefix),
+# and exercises are ranked by the sum over the query words
+# Every token and every prefix of one is precomputed into its score levels: disjoint sets of exercise ids, best
+# level first, so a query word costs one dict lookup. A search walks the words' levels best total first,
+# intersecting as it goes, and stops as soon as the limit is filled by totals nothing left can beat
+# Searches read an immutable snapshot of the index and take no lock; updates build a new snapshot and swap it in
+# The index is built at startup (warm_exercise_search_index) and kept up to date by EditExerciseBankView.
+# It remembers the exercise bank version it reflects (services/lookup_cache.py), so changes made
+# through another process trigger a rebuild on the next search
+
+NAME_EXACT, NAME_PREFIX, DESCRIPTION_EXACT, DESCRIPTION_PREFIX = 6, 3, 2, 1
+MAX_QUERY_WORDS = 5
+MIN_PREFIX_LENGTH = 2
+# Levels with at least this many exercises also keep a bitmask of their exercise ids, so intersecting two
+# of them is an integer AND rather than a walk over thousands of set entries
+DENSE_LEVEL_SIZE = 512
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+EMPTY = frozenset()
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+def _prefixes(token):
+    # The keys a token is found under: itself and its prefixes long enough to match
+    return [token[:length] for length in range(MIN_PREFIX_LENGTH, len(token))] + [token]
+
+
+def _levels(tokens, sorted_tokens, word):
+    # ((score, exercise ids, bitmask or None), ...) for word, best level first
+    # Each exercise is only in the level of its best match
+    name_exact, description_exact = tokens.get(word, (EMPTY, EMPTY))
+    longer = []
+    if len(word) >= MIN_PREFIX_LENGTH:
+        for index in range(bisect_right(sorted_tokens, word), len(sorted_tokens)):
+            if not sorted_tokens[index].startswith(word):
+                break
+            longer.append(tokens[sorted_tokens[index]])
+
+    if not longer:
+        name_prefix = description_prefix = EMPTY
+    elif len(longer) == 1 and not name_exact and not description_exact:
+        # The prefix of a single token shares that token's postings
+        name_prefix, description_prefix = longer[0]
+    else:
+        name_prefix = EMPTY.union(*(name_ids for name_ids, description_ids in longer)) - name_exact
+        description_exact = description_exact - name_prefix
+        description_prefix = EMPTY.union(*(description_ids for name_ids, description_ids in longer)) \
+            - name_exact - name_prefix - description_exact
+
+    levels = [(NAME_EXACT, name_exact), (NAME_PREFIX, name_prefix),
+              (DESCRIPTION_EXACT, description_exact), (DESCRIPTION_PREFIX, description_prefix)]
+    return tuple((score, ids, _bitmask(ids) if len(ids) >= DENSE_LEVEL_SIZE else None)
+                 for score, ids in levels if ids)
+
+
+def _bitmask(ids):
+    # Bit n is set for exercise id n
+    bits = bytearray(b'0') * (max(ids) + 1)
+    for exercise_id in ids:
+        bits[exercise_id] = ord('1')
+    bits.reverse()
+    return int(bits, 2)
+
+
+class _Snapshot:
+    # Never modified once published
+    def __init__(self, tokens, documents, prefixes):
+        self.tokens = tokens  # token -> (ids with it in the name, ids with it in the description only)
+        self.sorted_tokens = sorted(tokens)
+        self.documents = documents  # exercise_id -> (name tokens, other description tokens), for updates
+        self.prefixes = prefixes  # token or prefix -> score levels
+
+
+class ExerciseSearchIndex:
+    def __init__(self):
+        self._lock = threading.Lock()  # serializes updates, searches don't take it
+        self._snapshot = _Snapshot({}, {}, {})
+        self.version = None
+
+    def __len__(self):
+        return len(self._snapshot.documents)
+
+    def build(self, exercises, version=None):
+        # exercises is an iterable of (exercise_id, name, description)
+        name_postings, description_postings = {}, {}
+        documents = {}
+        for exercise_id, name, description in exercises:
+            name_tokens = frozenset(tokenize(name))
+            description_tokens = frozenset(tokenize(description)) - name_tokens
+            documents[exercise_id] = (name_tokens, description_tokens)
+            for postings, document_tokens in [(name_postings, name_tokens), (description_postings, description_tokens)]:
+                for token in document_tokens:
+                    postings.setdefault(token, set()).add(exercise_id)
+
+        tokens = {
+            token: (frozenset(name_postings.get(token, EMPTY)), frozenset(description_postings.get(token, EMPTY)))
+            for token in name_postings.keys() | description_postings.keys()
+        }
+        snapshot = _Snapshot(tokens, documents, {})
+        keys = set(chain.from_iterable(_prefixes(token) for token in tokens))
+        snapshot.prefixes = {key: _levels(tokens, snapshot.sorted_tokens, key) for key in keys}
+        with self._lock:
+            self._snapshot = snapshot
+            self.version = version
+
+    def add(self, exercise_id, name, description):
+        name_tokens = frozenset(tokenize(name))
+        self._update(exercise_id, (name_tokens, frozenset(tokenize(description)) - name_tokens))
+
+    def remove(self, exercise_id):
+        self._update(exercise_id, None)
+
+    def _update(self, exercise_id, document):
+        # Copies the postings of the exercise's old and new tokens and recomputes the keys they are found under
+        with self._lock:
+            snapshot = self._snapshot
+            tokens = dict(snapshot.tokens)
+            documents = dict(snapshot.documents)
+            previous = documents.pop(exercise_id, None)
+            if previous is None and document is None:
+                return
+            if document is not None:
+                documents[exercise_id] = document
+
+            changed = set()
+            for field, document_tokens in enumerate(previous or ()):
+                for token in document_tokens:
+                    postings = list(tokens[token])
+                    postings[field] = postings[field] - {exercise_id}
+                    tokens[token] = tuple(postings)
+                    changed.add(token)
+            for field, document_tokens in enumerate(document or ()):
+                for token in document_tokens:
+                    postings = list(tokens.get(token, (EMPTY, EMPTY)))
+                    postings[field] = postings[field] | {exercise_id}
+                    tokens[token] = tuple(postings)
+                    changed.add(token)
+            for token in changed:
+                if not tokens[token][0] and not tokens[token][1]:
+                    del tokens[token]
+
+            updated = _Snapshot(tokens, documents, dict(snapshot.prefixes))
+            for key in set(chain.from_iterable(_prefixes(token) for token in changed)):
+                levels = _levels(tokens, updated.sorted_tokens, key)
+                if levels:
+                    updated.prefixes[key] = levels
+                else:
+                    updated.prefixes.pop(key, None)
+            self._snapshot = updated
+
+    def search(self, query, limit=None):
+        # Returns matching exercise ids, best match first (ties by exercise id)
+        words = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_WORDS]
+        prefixes = self._snapshot.prefixes
+        word_levels = [prefixes.get(word) for word in words]
+        if not word_levels or not all(word_levels):
+            return []
+        # Most selective word first, so the intersections shrink as early as possible
+        word_levels.sort(key=lambda levels: sum(len(level[1]) for level in levels))
+        best_rest = [0] * (len(word_levels) + 1)  # best total the words from index on can still add
+        for index in range(len(word_levels) - 1, -1, -1):
+            best_rest[index] = best_rest[index + 1] + word_levels[index][0][0]
+
+        # Best first search over the words' levels. Entries are (-best reachable total, tie, words done, total,
+        # exercises matching the words done, level of the last word), the last level is only intersected once popped
+        # Matching exercises are a set, or a bitmask while they come from dense levels only
+        # An entry with every word done is final, nothing popped after it can reach a higher total
+        tie = count()
+        heap = [(-best_rest[0], next(tie), 0, 0, None, None)]
+        results = []
+        group, group_total = [], None
+        while heap:
+            negative_bound, _, depth, total, ids, level = heapq.heappop(heap)
+            if level is not None:
+                ids = _intersect(ids, level)
+                if not ids:
+                    continue
+            if group and -negative_bound < group_total:
+                results.extend(_lowest(group, None if limit is None else limit - len(results)))
+                group = []
+                if limit is not None and len(results) >= limit:
+                    break
+            if depth == len(word_levels):
+                group.append(ids)
+                group_total = total
+                continue
+            for level in word_levels[depth]:
+                score = level[0]
+                heapq.heappush(heap, (-(total + score + best_rest[depth + 1]), next(tie), depth + 1, total + score,
+                                      ids, level))
+        if group:
+            results.extend(_lowest(group, None if limit is None else limit - len(results)))
+        return results
+
+
+def _intersect(matches, level):
+    score, ids, bitmask = level
+    if matches is None:
+        return ids if bitmask is None else bitmask
+    if not isinstance(matches, int):
+        return matches & ids
+    if bitmask is not None:
+        return matches & bitmask
+    data = matches.to_bytes((matches.bit_length() + 7) // 8, 'little')
+    return {exercise_id for exercise_id in ids
+            if exercise_id >> 3 < len(data) and data[exercise_id >> 3] >> (exercise_id & 7) & 1}
+
+
+def _lowest_ids(matches, limit):
+    if isinstance(matches, int):
+        # Read the bitmask a chunk at a time, lowest bits first, until the limit is filled
+        data = matches.to_bytes((matches.bit_length() + 7) // 8, 'little')
+        ids = []
+        for start in range(0, len(data), 512):
+            chunk = int.from_bytes(data[start:start + 512], 'little')
+            if not chunk:
+                continue
+            bits = bin(chunk)[:1:-1]
+            position = bits.find('1')
+            while position != -1:
+                ids.append(start * 8 + position)
+                if len(ids) == limit:
+                    return ids
+                position = bits.find('1', position + 1)
+        return ids
+    if limit is None or limit >= len(matches):
+        return sorted(matches)
+    return heapq.nsmallest(limit, matches)
+
+
+def _lowest(group, limit):
+    # The lowest ids of disjoint matches with the same total, in order
+    bitmask, ids = 0, set()
+    for matches in group:
+        if isinstance(matches, int):
+            bitmask |= matches
+        else:
+            ids |= matches
+    if not ids:
+        return _lowest_ids(bitmask, limit)
+    merged = list(heapq.merge(_lowest_ids(bitmask, limit), _lowest_ids(ids, limit)))
+    return merged if limit is None else merged[:limit]
+
+
+exercise_search_index = ExerciseSearchIndex()
+_build_lock = threading.Lock()
+
+
+def _active_exercises():
+    from ..models import ExerciseBank
+    return ExerciseBank.objects.filter(is_active=1).values_list('exercise_id', 'name', 'description').iterator()
+
+
+def build_exercise_search_index():
+    # Rebuilds the index unless it already reflects the exercise bank version, one build at a time
+    from .lookup_cache import get_bank_version, EXERCISES
+
+    with _build_lock:
+        version = get_bank_version(EXERCISES)
+        if exercise_search_index.version != version:
+            exercise_search_index.build(_active_exercises(), version)
+
+
+def warm_exercise_search_index():
+    # Builds the index in the background at startup (wsgi.py / asgi.py) so searches don't pay for it
+    # A search arriving before it is done waits for the build, and if the database can't be reached
+    # the index is left to be built by the first search
+    def warm():
+        try:
+            build_exercise_search_index()
+        except DatabaseError:
+            logger.warning('Exercise search index not built at startup', exc_info=True)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=warm, name='exercise-search-index', daemon=True)
+    thread.start()
+    return thread
+
+
+def search_exercises(query, limit=None):
+    from .lookup_cache import get_bank_version, EXERCISES
+
+    if exercise_search_index.version != get_bank_version(EXERCISES):
+        build_exercise_search_index()
+    return exercise_search_index.search(query, limit)
+
+
+def index_is_current():
+    from .lookup_cache import get_bank_version, EXERCISES
+    return exercise_search_index.version is not None and exercise_search_index.version == get_bank_version(EXERCISES)
+
+
+def index_exercise(exercise, was_current):
+    # Applies one added, edited or deactivated exercise to the index
+    # Call once the write is committed, with whether the index was current before the write;
+    # if it wasn't (another process changed the bank), the index is left to rebuild on the next search
+    from .lookup_cache import get_bank_version, EXERCISES
+
+    if exercise.is_active:
+        exercise_search_index.add(exercise.exercise_id, exercise.name, exercise.description)
+    else:
+        exercise_search_index.remove(exercise.exercise_id)
+    if was_current:
+        exercise_search_index.version = get_bank_version(EXERCISES)
@@ -0,0 +1,133 @@
+import functools
+import hashlib
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from ..models import IdempotencyKey, User
+
+# Idempotency-Key support for write endpoints
+# The first request with a key claims it (a row with no status yet), runs, and stores its response
+# A retry with the same key and the same request gets the stored response back, with an Idempotent-Replayed header,
+# without running the view again. Reusing a key for a different request is a 422, and a retry that arrives while
+# the first request is still running is a 409
+# Server errors (5xx or an exception) release the key so the request can be retried for real
+# A running request only holds its key for settings.IDEMPOTENCY_KEY_LEASE seconds, so a worker that dies before
+# storing its response doesn't lock the key: once the lease runs out the next retry takes it over
+# Stored responses expire after settings.IDEMPOTENCY_KEY_TTL seconds
+
+MAX_KEY_LENGTH = 255
+
+
+def _ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 60 * 60 * 24))
+
+
+def _lease():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_LEASE', 30))
+
+
+def _request_user_id(request, user_field, kwargs):
+    # The authenticated user, else the user named by user_field in the url or the body
+    if isinstance(getattr(request, 'user', None), User):
+        return request.user.pk
+    value = kwargs.get(user_field)
+    if value is None:
+        try:
+            body = json.loads(request.body)
+        except ValueError:
+            body = request.POST
+        if hasattr(body, 'get'):
+            value = body.get(user_field)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _claim(key, user_id, request_hash):
+    # Returns (record, created), record is None if the key keeps changing hands
+    for attempt in range(2):
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(key=key, user_id=user_id, request_hash=request_hash,
+                                                     created=now, expires=now + _lease()), True
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(user_id=user_id, key=key).first()
+            if record is not None and record.expires > now:
+                return record, False
+            # Expired, an abandoned claim whose lease ran out, or released in the meantime, try to claim it again
+            IdempotencyKey.objects.filter(user_id=user_id, key=key, expires__lte=now).delete()
+    return None, False
+
+
+def _release(record):
+    # Only while still in flight: if the lease ran out, the key may belong to a retry by now
+    IdempotencyKey.objects.filter(pk=record.pk, status__isnull=True).delete()
+
+
+def _store(record, response):
+    if isinstance(response, StreamingHttpResponse) or response.status_code >= 500:
+        _release(record)
+        return
+    if isinstance(response, Response):  # Not rendered yet inside an APIView
+        content, content_type = JSONRenderer().render(response.data), 'application/json'
+    else:
+        content, content_type = response.content, response.get('Content-Type', '')
+    # The stored response is kept for the full TTL. Updates nothing if the key was taken over in the meantime
+    IdempotencyKey.objects.filter(pk=record.pk, status__isnull=True).update(
+        status=response.status_code, content_type=content_type, response=content, expires=timezone.now() + _ttl())
+
+
+def _replay(record):
+    response = HttpResponse(bytes(record.response or b''), status=record.status, content_type=record.content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(user_field):
+    # Decorates a function view or an APIView method, user_field names the url kwarg or body field holding the user id
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            request = next(arg for arg in args if hasattr(arg, 'META'))
+            key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return JsonResponse({'error': f'Idempotency-Key cannot be longer than {MAX_KEY_LENGTH} characters'},
+                                    status=400)
+
+            body = request.body  # Read before the view so it can still parse it afterwards
+            request_hash = hashlib.sha256(b'\n'.join([request.method.encode(), request.path.encode(), body])).hexdigest()
+            record, created = _claim(key, _request_user_id(request, user_field, kwargs), request_hash)
+            if not created:
+                if record is not None and record.request_hash != request_hash:
+                    return JsonResponse({'error': 'Idempotency-Key was already used for a different request'},
+                                        status=422)
+                if record is None or record.status is None:
+                    response = JsonResponse({'error': 'A request with this Idempotency-Key is still in progress'},
+                                            status=409)
+                    if record is not None:
+                        response['Retry-After'] = max(1, int((record.expires - timezone.now()).total_seconds()) + 1)
+                    return response
+                return _replay(record)
+
+            try:
+                response = view(*args, **kwargs)
+            except BaseException:
+                _release(record)
+                raise
+            _store(record, response)
+            return response
+        return wrapper
+    return decorator
+
+
+def purge_expired_idempotency_keys():
+    return IdempotencyKey.objects.filter(expires__lte=timezone.now()).delete()[0]
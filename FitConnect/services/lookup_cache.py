@@ -0,0 +1,139 @@
+import gzip
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+# Versioned read-through cache for the lookup banks (exercises, muscle groups, equipment, goals)
+# Each bank has a version token stored in the cache; the serialized bank is stored under that version
+# Invalidating a bank just replaces its token, so stale entries are never read again and expire on their own
+# The token doubles as the ETag of the bank's list endpoint
+# The cache backend is settings.LOOKUP_CACHE_ALIAS (local memory by default, see CACHES in settings.py)
+# Besides the rows, each bank version has a snapshot: the list endpoint's JSON body, encoded once and stored
+# precompressed (gzip, and brotli if the brotli package is installed), so list requests just send bytes
+
+try:
+    import brotli
+except ImportError:  # Optional, snapshots are only gzipped without it
+    brotli = None
+
+EXERCISES = 'exercises'
+MUSCLE_GROUPS = 'muscle_groups'
+EQUIPMENT = 'equipment'
+GOALS = 'goals'
+
+# Banks whose cached data embeds another bank (exercises include muscle group and equipment names)
+DEPENDENT_BANKS = {
+    MUSCLE_GROUPS: [EXERCISES],
+    EQUIPMENT: [EXERCISES],
+}
+
+BANK_KEYS = {
+    EXERCISES: 'exercise_id',
+    MUSCLE_GROUPS: 'muscle_group_id',
+    EQUIPMENT: 'equipment_id',
+    GOALS: 'goal_id',
+}
+
+_indexes = {}  # bank -> (version, {key: row}), per process
+
+
+def _cache():
+    return caches[getattr(settings, 'LOOKUP_CACHE_ALIAS', 'default')]
+
+
+def _timeout():
+    return getattr(settings, 'LOOKUP_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def _load(bank):
+    from ..models import ExerciseBank, MuscleGroupBank, EquipmentBank, GoalBank
+    from ..serializers import ExerciseListSerializer, MuscleGroupBankSerializer, EquipmentBankSerializer, \
+        GoalSerializer
+
+    if bank == EXERCISES:
+        queryset = ExerciseBank.objects.filter(is_active=1).select_related('muscle_group', 'equipment')
+        data = ExerciseListSerializer(queryset.order_by('exercise_id'), many=True).data
+    elif bank == MUSCLE_GROUPS:
+        data = MuscleGroupBankSerializer(MuscleGroupBank.objects.order_by('muscle_group_id'), many=True).data
+    elif bank == EQUIPMENT:
+        data = EquipmentBankSerializer(EquipmentBank.objects.order_by('equipment_id'), many=True).data
+    elif bank == GOALS:
+        data = GoalSerializer(GoalBank.objects.order_by('goal_id'), many=True).data
+    else:
+        raise ValueError(f'Unknown lookup bank: {bank}')
+    return [dict(row) for row in data]
+
+
+def get_bank_version(bank):
+    cache = _cache()
+    version = cache.get(f'lookup:{bank}:version')
+    if version is None:
+        cache.add(f'lookup:{bank}:version', uuid.uuid4().hex, None)
+        version = cache.get(f'lookup:{bank}:version')
+    return version
+
+
+def get_lookup_bank(bank):
+    # Returns (version, rows), loading the bank from the database on a cache miss
+    cache = _cache()
+    version = get_bank_version(bank)
+    data = cache.get(f'lookup:{bank}:{version}')
+    if data is None:
+        data = _load(bank)
+        cache.set(f'lookup:{bank}:{version}', data, _timeout())
+    return version, data
+
+
+def _encode(data):
+    from rest_framework.renderers import JSONRenderer
+
+    raw = JSONRenderer().render(data)
+    snapshot = {'identity': raw}
+    compressed = gzip.compress(raw, compresslevel=9, mtime=0)
+    if len(compressed) < len(raw):
+        snapshot['gzip'] = compressed
+    if brotli is not None:
+        compressed = brotli.compress(raw)
+        if len(compressed) < len(raw):
+            snapshot['br'] = compressed
+    return snapshot
+
+
+def get_lookup_snapshot(bank):
+    # Returns (version, {encoding: bytes}) with the bank's JSON list body, 'identity' being uncompressed
+    cache = _cache()
+    version = get_bank_version(bank)
+    snapshot = cache.get(f'lookup:{bank}:{version}:snapshot')
+    if snapshot is None:
+        version, data = get_lookup_bank(bank)
+        snapshot = _encode(data)
+        cache.set(f'lookup:{bank}:{version}:snapshot', snapshot, _timeout())
+    return version, snapshot
+
+
+def get_lookup_index(bank):
+    # Returns the bank keyed by primary key, e.g. get_lookup_index(GOALS)[goal_id]['goal_name']
+    # Called once per serialized row, so while the version is unchanged only the version key is read
+    index_version, index = _indexes.get(bank, (None, None))
+    if index_version is not None and index_version == get_bank_version(bank):
+        return index
+    version, data = get_lookup_bank(bank)
+    index = {row[BANK_KEYS[bank]]: row for row in data}
+    _indexes[bank] = (version, index)
+    return index
+
+
+def _invalidate(banks):
+    cache = _cache()
+    for bank in banks:
+        cache.set(f'lookup:{bank}:version', uuid.uuid4().hex, None)
+
+
+def invalidate_lookup_bank(bank):
+    # Only replaces the version tokens, the new version is loaded and encoded by the first request that reads it,
+    # so saving many rows (in one transaction or one after the other) doesn't rebuild the bank for every row
+    banks = [bank] + DEPENDENT_BANKS.get(bank, [])
+    _invalidate(banks)
+    # Invalidate again once the write is committed, so a read racing the transaction can't cache stale rows
+    transaction.on_commit(lambda: _invalidate(banks))
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+from collections import defaultdict
+
+# In-process fan-out used by the stream_messages long-poll endpoint
+# Waiting requests subscribe to a conversation (the pair of user ids) and are woken up when
+# create_message publishes to it. Subscribers only receive a wake-up; they re-read message_log
+# themselves, so a missed notification (e.g. a message written by another worker process)
+# just means the client picks the message up on its next poll
+# publish() is thread safe, so sync views running in a worker thread can notify async waiters
+
+
+class MessageBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    @staticmethod
+    def conversation_key(user_id, other_user_id):
+        return tuple(sorted([int(user_id), int(other_user_id)]))
+
+    def subscribe(self, user_id, other_user_id):
+        # Must be called from the event loop the subscriber will wait on
+        subscription = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._subscribers[self.conversation_key(user_id, other_user_id)].add(subscription)
+        return subscription
+
+    def unsubscribe(self, user_id, other_user_id, subscription):
+        key = self.conversation_key(user_id, other_user_id)
+        with self._lock:
+            self._subscribers[key].discard(subscription)
+            if not self._subscribers[key]:
+                del self._subscribers[key]
+
+    def publish(self, user_id, other_user_id):
+        with self._lock:
+            subscriptions = list(self._subscribers.get(self.conversation_key(user_id, other_user_id), ()))
+        for loop, event in subscriptions:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:  # The waiting request's loop already closed
+                pass
+
+    def subscriber_count(self, user_id, other_user_id):
+        with self._lock:
+            return len(self._subscribers.get(self.conversation_key(user_id, other_user_id), ()))
+
+    async def wait(self, subscription, timeout):
+        # Returns True if the conversation was published to before the timeout
+        loop, event = subscription
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+message_broker = MessageBroker()
@@ -0,0 +1,77 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError, VerificationError, InvalidHashError
+from django.conf import settings
+
+# Argon2 hashing for UserCredentials.hashed_password
+# Cost parameters come from settings (ARGON2_TIME_COST, ARGON2_MEMORY_COST, ARGON2_PARALLELISM), and one hasher
+# is reused across requests instead of building a new PasswordHasher per login
+# verify_password reports when a stored hash was made with outdated parameters, so the login can
+# transparently store a rehash
+# If PASSWORD_VERIFY_POOL_SIZE is set, verifications run in a bounded thread pool: at most that many argon2
+# verifications (each using ARGON2_MEMORY_COST KiB) run at once, however many requests are logging in
+# (argon2 releases the GIL while hashing). Under ASGI, LoginView is a sync view and runs in a thread of its own,
+# so a verification never blocks the event loop
+
+_lock = threading.Lock()
+_hasher = None
+_pool = None
+_pool_size = 0
+
+
+def _hasher_settings():
+    return (
+        getattr(settings, 'ARGON2_TIME_COST', 3),
+        getattr(settings, 'ARGON2_MEMORY_COST', 65536),
+        getattr(settings, 'ARGON2_PARALLELISM', 4),
+    )
+
+
+def get_password_hasher():
+    global _hasher
+    time_cost, memory_cost, parallelism = _hasher_settings()
+    hasher = _hasher
+    if hasher is None or (hasher.time_cost, hasher.memory_cost, hasher.parallelism) != (time_cost, memory_cost, parallelism):
+        hasher = _hasher = PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+    return hasher
+
+
+def _get_pool():
+    global _pool, _pool_size
+    size = getattr(settings, 'PASSWORD_VERIFY_POOL_SIZE', 0)
+    if not size:
+        return None
+    with _lock:
+        if _pool is None or _pool_size != size:
+            if _pool is not None:  # Let running verifications finish, then free the old pool's threads
+                _pool.shutdown(wait=False)
+            _pool = ThreadPoolExecutor(max_workers=size, thread_name_prefix='password-verify')
+            _pool_size = size
+        return _pool
+
+
+def hash_password(password):
+    return get_password_hasher().hash(password)
+
+
+def _verify(hashed_password, password):
+    # Returns (matches, new hash if the stored one should be replaced, else None)
+    if not isinstance(password, str):
+        return False, None
+    hasher = get_password_hasher()
+    try:
+        hasher.verify(hashed_password, password)
+    except (VerifyMismatchError, VerificationError, InvalidHashError):
+        return False, None
+    if hasher.check_needs_rehash(hashed_password):
+        return True, hasher.hash(password)
+    return True, None
+
+
+def verify_password(hashed_password, password):
+    pool = _get_pool()
+    if pool is None:
+        return _verify(hashed_password, password)
+    return pool.submit(_verify, hashed_password, password).result()
+
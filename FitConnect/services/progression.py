@@ -0,0 +1,93 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Max, Q, Sum, When
+from ..models import WorkoutLog
+
+# Training progression of a user, per exercise, built from their workout logs
+# Each log is one set. For every day an exercise was trained:
+#   sets, reps, volume (reps x weight summed over the sets), top weight and estimated one rep max
+# Estimated 1RM uses the Epley formula, weight x (1 + reps / 30), taken as the weight itself for single reps
+# The per set math and the per day grouping run in the database as one aggregate query over the user's logs;
+# Python only walks the daily rows once to mark personal records (a new best weight, 1RM or volume)
+# Results are cached per user in settings.PROGRESSION_CACHE_ALIAS (for settings.PROGRESSION_CACHE_TIMEOUT) and dropped
+# whenever the user logs a workout
+
+_e1rm = Case(
+    When(reps=1, then=F('weight') * 1.0),
+    default=F('weight') * (1.0 + F('reps') / 30.0),
+    output_field=FloatField(),
+)
+
+RECORDS = ('top_weight', 'e1rm', 'volume')
+
+
+def _cache():
+    return caches[getattr(settings, 'PROGRESSION_CACHE_ALIAS', 'default')]
+
+
+def _key(user_id):
+    return f'progression:{user_id}'
+
+
+def _load(user_id):
+    lifted = Q(reps__gt=0, weight__gt=0)
+    days = WorkoutLog.objects.filter(user_id=user_id).values(
+        'exercise_in_plan__exercise_id', 'exercise_in_plan__exercise__name', 'completed_date',
+    ).annotate(
+        sets=Count('workout_id'),
+        total_reps=Sum('reps'),
+        volume=Sum(F('reps') * F('weight'), filter=lifted),
+        top_weight=Max('weight', filter=lifted),
+        e1rm=Max(_e1rm, filter=lifted),
+    ).order_by('exercise_in_plan__exercise_id', 'completed_date')
+
+    exercises = {}
+    for day in days:
+        exercise_id = day['exercise_in_plan__exercise_id']
+        exercise = exercises.get(exercise_id)
+        if exercise is None:
+            exercise = exercises[exercise_id] = {
+                'exercise_id': exercise_id,
+                'name': day['exercise_in_plan__exercise__name'],
+                'sessions': 0,
+                'total_volume': 0,
+                'personal_records': {record: None for record in RECORDS},
+                'history': [],
+            }
+        entry = {
+            'date': day['completed_date'],
+            'sets': day['sets'],
+            'reps': day['total_reps'] or 0,
+            'volume': day['volume'] or 0,
+            'top_weight': day['top_weight'],
+            'e1rm': round(day['e1rm'], 1) if day['e1rm'] is not None else None,
+            'records': [],
+        }
+        records = exercise['personal_records']
+        for record in RECORDS:
+            value = entry[record]
+            if value and (records[record] is None or value > records[record]['value']):
+                records[record] = {'value': value, 'date': entry['date']}
+                entry['records'].append(record)
+        exercise['sessions'] += 1
+        exercise['total_volume'] += entry['volume']
+        exercise['history'].append(entry)
+    return exercises
+
+
+def get_progression(user_id):
+    # Returns {exercise_id: progression}, from the cache when the user hasn't logged since it was built
+    cache = _cache()
+    progression = cache.get(_key(user_id))
+    if progression is None:
+        progression = _load(user_id)
+        cache.set(_key(user_id), progression, getattr(settings, 'PROGRESSION_CACHE_TIMEOUT', 60 * 60))
+    return progression
+
+
+def invalidate_progression(user_id):
+    cache = _cache()
+    cache.delete(_key(user_id))
+    # Again after commit, in case a read cached the progression before the new log was visible
+    transaction.on_commit(lambda: cache.delete(_key(user_id)))
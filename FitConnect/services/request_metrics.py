@@ -0,0 +1,163 @@
+import bisect
+import contextvars
+import threading
+import time
+
+# In-process request metrics recorded by FitConnect.middleware.RequestMetricsMiddleware
+# Per view: request count, histograms of latency and query count, and totals of db time, serializer time,
+# response size and query budget overruns. Served by RequestMetricsView, reset on restart
+
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+QUERY_BUCKETS = [0, 1, 2, 3, 5, 10, 20, 50]
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(queries):
+    # Declares the query budget of a function view, class based views set a `query_budget` attribute instead
+    # Either a number of queries or a dict of them per HTTP method, e.g. {'GET': 2, 'POST': 6}
+    def decorator(view):
+        view.query_budget = queries
+        return view
+    return decorator
+
+
+def get_view_name(view_func):
+    view_class = getattr(view_func, 'view_class', None)  # as_view() functions
+    return view_class.__name__ if view_class is not None else getattr(view_func, '__name__', str(view_func))
+
+
+def get_query_budget(view_func, method):
+    view_class = getattr(view_func, 'view_class', None)
+    budget = getattr(view_class, 'query_budget', getattr(view_func, 'query_budget', None))
+    if isinstance(budget, dict):
+        return budget.get(method)
+    return budget
+
+
+class RequestStats:
+    # Per request counters, filled in by the middleware's execute wrapper and the serializer timing below
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Called by count_queries
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+current_stats = contextvars.ContextVar('request_stats', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    # Execute wrapper left on the database connections, counts for the request being measured if there is one
+    # Found through the context variable, which sync_to_async carries over to the thread running a view under ASGI
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    return stats(execute, sql, params, many, context)
+
+
+def install_query_counter():
+    # Connections are per thread, so this is called from the thread the view runs on
+    from django.db import connections
+
+    for connection in connections.all():
+        if count_queries not in connection.execute_wrappers:
+            connection.execute_wrappers.append(count_queries)
+
+
+def instrument_serializers():
+    # Times Serializer.data / ListSerializer.data for the request being measured, once per process
+    from rest_framework import serializers
+
+    for cls in (serializers.Serializer, serializers.ListSerializer):
+        data = cls.__dict__['data']
+        if getattr(data.fget, 'instrumented', False):
+            continue
+
+        def timed(self, fget=data.fget):
+            stats = current_stats.get()
+            if stats is None:
+                return fget(self)
+            stats.serializer_depth += 1  # Nested .data calls are counted once, by the outermost serializer
+            start = time.perf_counter()
+            try:
+                return fget(self)
+            finally:
+                stats.serializer_depth -= 1
+                if stats.serializer_depth == 0:
+                    stats.serializer_time += time.perf_counter() - start
+
+        timed.instrumented = True
+        setattr(cls, 'data', property(timed))
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.count = 0
+        self.latency = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.queries = [0] * (len(QUERY_BUCKETS) + 1)
+        self.max_queries = 0
+        self.total_ms = 0.0
+        self.db_ms = 0.0
+        self.serializer_ms = 0.0
+        self.response_bytes = 0
+        self.over_budget = 0
+
+    def as_dict(self):
+        bucket = lambda edges, counts: [
+            {'le': edge, 'count': count} for edge, count in zip(edges + ['+Inf'], counts)
+        ]
+        return {
+            'count': self.count,
+            'over_budget': self.over_budget,
+            'max_queries': self.max_queries,
+            'avg_ms': round(self.total_ms / self.count, 2) if self.count else 0,
+            'avg_db_ms': round(self.db_ms / self.count, 2) if self.count else 0,
+            'avg_serializer_ms': round(self.serializer_ms / self.count, 2) if self.count else 0,
+            'avg_response_bytes': round(self.response_bytes / self.count) if self.count else 0,
+            'latency_ms': bucket(LATENCY_BUCKETS_MS, self.latency),
+            'queries': bucket(QUERY_BUCKETS, self.queries),
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def record(self, view_name, total_ms, stats, response_bytes, over_budget):
+        with self._lock:
+            metrics = self._views.get(view_name)
+            if metrics is None:
+                metrics = self._views[view_name] = ViewMetrics()
+            metrics.count += 1
+            metrics.latency[bisect.bisect_left(LATENCY_BUCKETS_MS, total_ms)] += 1
+            metrics.total_ms += total_ms
+            metrics.response_bytes += response_bytes
+            metrics.over_budget += over_budget
+            metrics.queries[bisect.bisect_left(QUERY_BUCKETS, stats.queries)] += 1
+            metrics.max_queries = max(metrics.max_queries, stats.queries)
+            metrics.db_ms += stats.db_time * 1000
+            metrics.serializer_ms += stats.serializer_time * 1000
+
+    def snapshot(self):
+        with self._lock:
+            return {view_name: metrics.as_dict() for view_name, metrics in sorted(self._views.items())}
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+
+request_metrics = MetricsRegistry()
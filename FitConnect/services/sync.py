@@ -0,0 +1,87 @@
+from datetime import timedelta
+from django.db.models import Q
+from django.utils import timezone
+from ..models import WorkoutPlan, ExerciseInWorkoutPlan, WorkoutLog, CalorieLog, WaterLog, MentalHealthLog, \
+    PhysicalHealthLog, MessageLog
+
+# Delta sync for offline-first clients: every row of a user's data with last_update after `since`
+# Each collection is one query on a (user, last_update) style index, read as flat rows
+# Soft-deleted rows (is_active=0) are sent as tombstones, just their ids under "deleted"; a full sync (no since)
+# leaves them out
+# The returned `next_since` lags the time the sync started by SYNC_OVERLAP, so a row written by a transaction that
+# was still running during the sync is picked up by the next one; clients upsert by id, so the overlap is harmless
+
+SYNC_OVERLAP = timedelta(seconds=60)
+
+
+def _plans(user_id):
+    return WorkoutPlan.objects.filter(user_id=user_id)
+
+
+# name -> (rows of the user, fields, primary key if the rows are soft-deletable)
+SYNC_COLLECTIONS = {
+    'workout_plans': (
+        _plans,
+        ['plan_id', 'plan_name', 'creation_date', 'last_update'],
+        'plan_id',
+    ),
+    'exercises_in_plan': (
+        lambda user_id: ExerciseInWorkoutPlan.objects.filter(plan__in=_plans(user_id).values('plan_id')),
+        ['exercise_in_plan_id', 'plan_id', 'exercise_id', 'sets', 'reps', 'weight', 'duration_minutes', 'last_update'],
+        'exercise_in_plan_id',
+    ),
+    'workout_logs': (
+        lambda user_id: WorkoutLog.objects.filter(user_id=user_id),
+        ['workout_id', 'plan_id', 'exercise_in_plan_id', 'reps', 'weight', 'duration_minutes', 'completed_date',
+         'last_update'],
+        None,
+    ),
+    'calorie_logs': (
+        lambda user_id: CalorieLog.objects.filter(user_id=user_id),
+        ['calorie_id', 'amount', 'recorded_date', 'last_update'],
+        None,
+    ),
+    'water_logs': (
+        lambda user_id: WaterLog.objects.filter(user_id=user_id),
+        ['water_id', 'amount', 'recorded_date', 'last_update'],
+        None,
+    ),
+    'mental_health_logs': (
+        lambda user_id: MentalHealthLog.objects.filter(user_id=user_id),
+        ['mental_health_id', 'mood', 'recorded_date', 'last_update'],
+        None,
+    ),
+    'physical_health_logs': (
+        lambda user_id: PhysicalHealthLog.objects.filter(user_id=user_id),
+        ['physical_health_id', 'weight', 'height', 'recorded_date', 'last_update'],
+        None,
+    ),
+    'messages': (
+        lambda user_id: MessageLog.objects.filter(Q(sender_id=user_id) | Q(recipient_id=user_id)),
+        ['message_id', 'sender_id', 'recipient_id', 'message_text', 'sent_date', 'last_update'],
+        None,
+    ),
+}
+
+
+def get_changes(user_id, since=None):
+    # Returns {'next_since', 'changes': {collection: [rows]}, 'deleted': {collection: [ids]}}
+    started = timezone.now()
+    changes, deleted = {}, {}
+    for name, (rows_of, fields, soft_delete_key) in SYNC_COLLECTIONS.items():
+        rows = rows_of(user_id)
+        if since is not None:
+            rows = rows.filter(last_update__gt=since)
+        rows = rows.order_by('last_update')
+
+        if soft_delete_key is None:
+            changes[name] = list(rows.values(*fields))
+            continue
+        changes[name], deleted[name] = [], []
+        for row in rows.values('is_active', *fields):
+            if row.pop('is_active'):
+                changes[name].append(row)
+            elif since is not None:
+                deleted[name].append(row[soft_delete_key])
+
+    return {'next_since': started - SYNC_OVERLAP, 'changes': changes, 'deleted': deleted}
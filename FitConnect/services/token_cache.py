@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+
+# Per-process LRU + TTL cache of auth token key -> (user, user_type), used by FitConnect/authentication.py
+# Entries are dropped when the token is deleted (logout) or the user, or their coach/admin role, is saved
+# (see the signal receivers at the bottom of models.py)
+# Deleted tokens are also marked as revoked in the shared cache (settings.TOKEN_REVOCATION_CACHE_ALIAS) for
+# TOKEN_CACHE_TTL, and a hit on a revoked token is treated as a miss, so a logout applies to every process at once.
+# User and role changes reach other processes once their own entry expires, bounded by TOKEN_CACHE_TTL
+# Requests are handed a copy of the cached user, never the cached instance itself
+
+
+class TokenCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires, user, user_type), least recently used first
+        self._keys_by_user = {}  # user_id -> key
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, key):
+        # Returns (user, user_type) or None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, user, user_type = entry
+            if expires <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return user, user_type
+
+    def set(self, key, user, user_type):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            old_key = self._keys_by_user.get(user.pk)
+            if old_key is not None and old_key != key:
+                self._remove(old_key)
+            self._entries[key] = (time.monotonic() + self.ttl, user, user_type)
+            self._entries.move_to_end(key)
+            self._keys_by_user[user.pk] = key
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            key = self._keys_by_user.get(user_id)
+            if key is not None:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+            self.hits = self.misses = self.expirations = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and self._keys_by_user.get(entry[1].pk) == key:
+            del self._keys_by_user[entry[1].pk]
+
+
+token_cache = TokenCache(
+    getattr(settings, 'TOKEN_CACHE_SIZE', 10000),
+    getattr(settings, 'TOKEN_CACHE_TTL', 300),
+)
+
+
+def _revocations():
+    return caches[getattr(settings, 'TOKEN_REVOCATION_CACHE_ALIAS', 'default')]
+
+
+def revoke(key):
+    # Called when a token is deleted; the mark outlives any entry cached for it in another process
+    token_cache.invalidate(key)
+    _revocations().set(f'token:revoked:{key}', True, token_cache.ttl)
+
+
+def is_revoked(key):
+    return _revocations().get(f'token:revoked:{key}', False)
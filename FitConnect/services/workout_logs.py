@@ -0,0 +1,37 @@
+from django.db.models import OuterRef, Q, Subquery
+from ..models import WorkoutLog, ExerciseInWorkoutPlan
+
+# Workout log queries
+# WorkoutLog.plan duplicates exercise_in_plan.plan so plan level lookups filter workout_log directly,
+# using the (plan, completed_date) index; per user lookups use (user, created) and (user, completed_date)
+# Logs written before WorkoutLog.plan existed have it NULL until backfill_workout_log_plans has run; they are
+# matched through exercise_in_plan instead, so nothing goes missing in between
+
+
+def backfill_workout_log_plans():
+    # Fills in the plan of logs written before WorkoutLog.plan existed, in one UPDATE
+    plan_of_exercise = ExerciseInWorkoutPlan.objects.filter(pk=OuterRef('exercise_in_plan_id')).values('plan_id')[:1]
+    return WorkoutLog.objects.filter(plan__isnull=True).update(plan_id=Subquery(plan_of_exercise))
+
+
+def logs_of_plan(plan_id):
+    return WorkoutLog.objects.filter(Q(plan_id=plan_id) | Q(plan__isnull=True, exercise_in_plan__plan_id=plan_id))
+
+
+def plan_of_log(log):
+    # Needs plan and exercise_in_plan__plan selected to avoid a query
+    return log.plan if log.plan_id is not None else log.exercise_in_plan.plan
+
+
+def most_recent_workout(user_id):
+    # Logs of the user's most recently logged plan on the day of that log, or None if they never logged a workout
+    # Two queries: the latest log with its plan, then that plan's logs for the day with their exercises
+    latest_log = WorkoutLog.objects.filter(user_id=user_id).select_related('plan', 'exercise_in_plan__plan') \
+        .order_by('-created', '-workout_id').first()
+    if latest_log is None:
+        return None
+    plan = plan_of_log(latest_log)
+    logs = logs_of_plan(plan.plan_id).filter(
+        user_id=user_id, completed_date=latest_log.completed_date
+    ).select_related('plan', 'exercise_in_plan__plan', 'exercise_in_plan__exercise').order_by('workout_id')
+    return plan, logs
@@ -0,0 +1,22 @@
+from django.db.models import Prefetch
+from ..models import WorkoutPlan, ExerciseInWorkoutPlan
+
+# Loads workout plans for WorkoutPlanSerializer in a constant number of queries
+# Queries:
+# 1. The workout plans themselves
+# 2. Their active exercises, joined with exercise_bank, muscle_group_bank and equipment_bank
+# Inactive exercises (is_active=0) are filtered out in SQL so the serializer never sees them
+# Outputs:
+# A queryset of WorkoutPlan whose `exercises` relation is already populated
+
+
+def active_exercises_queryset():
+    return ExerciseInWorkoutPlan.objects.filter(is_active=1).select_related(
+        'exercise__muscle_group', 'exercise__equipment'
+    ).order_by('exercise_in_plan_id')
+
+
+def load_workout_plans(plans=None):
+    if plans is None:
+        plans = WorkoutPlan.objects.all()
+    return plans.prefetch_related(Prefetch('exercises', queryset=active_exercises_queryset()))
@@ -1,6 +1,35 @@
-from django.test import TestCase, RequestFactory
-from .models import User, Coach, CalorieLog, WaterLog, PhysicalHealthLog, MentalHealthLog, GoalBank, MuscleGroupBank, ExerciseBank, EquipmentBank, WorkoutPlan, ExerciseInWorkoutPlan
-from .views import CoachList, FireCoach, WorkoutPlanList, WorkoutPlanDetail, DailySurveyView, InitialSurveyView, SearchExercises, ExerciseInWorkoutPlanView, DeclineClient, EditExerciseBankView
+import gzip
+import json
+import random
+import time
+from io import StringIO
+from datetime import date, timedelta
+from django.utils import timezone
+import asyncio
+from rest_framework import exceptions
+from asgiref.sync import sync_to_async
+from django.test import TestCase, RequestFactory, AsyncRequestFactory, override_settings
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection, DatabaseError
+from django.test.utils import CaptureQueriesContext
+from .services.message_stream import message_broker
+from .services import lookup_cache
+from .services.lookup_cache import invalidate_lookup_bank, GOALS
+from .serializers import UserSerializer
+from .services.exercise_search import index_is_current, ExerciseSearchIndex, tokenize, warm_exercise_search_index, NAME_EXACT, NAME_PREFIX, DESCRIPTION_EXACT, DESCRIPTION_PREFIX
+from .management.commands.benchmark_exercise_search import WORDS
+from .services import passwords
+from .services.passwords import get_password_hasher
+from .services.token_cache import TokenCache, token_cache
+from .services.sync import SYNC_COLLECTIONS
+from .services.request_metrics import request_metrics, QueryBudgetExceeded
+from unittest import mock
+from .authentication import CachedTokenAuthentication
+from argon2 import PasswordHasher
+from .models import WorkoutLog, User, Coach, CalorieLog, WaterLog, PhysicalHealthLog, MentalHealthLog, GoalBank, MuscleGroupBank, ExerciseBank, EquipmentBank, WorkoutPlan, ExerciseInWorkoutPlan, DailyHealthSummary, MessageLog, Conversation, UserCredentials, IdempotencyKey, AuthToken, Admin
+from .views import MAX_MESSAGES_PAGE_SIZE, DailyHealthSummaryView, SyncView, WorkoutSessionCreateView, ProgressionView, WorkoutLogCreateView, MostRecentWorkoutPlanView, WorkoutLogView, CoachClients, CoachAdherence, LoginView, LogoutView, RequestCoach, AcceptClient, TriageClients, CoachSearch, ExerciseList, MuscleGroupList, stream_messages, create_message, ContactHistoryView, ConversationReadView, get_messages, create_workout_plan, DailySurveyBatchView, CoachList, FireCoach, WorkoutPlanList, WorkoutPlanDetail, DailySurveyView, InitialSurveyView, SearchExercises, ExerciseInWorkoutPlanView, DeclineClient, EditExerciseBankView
 
 
 # RUNNING TESTS AND GENERATING htmlcov SUBDIRECTORY:
@@ -116,18 +145,112 @@ class TestDailySurveyEndpoint(TestCase):
         response = DailySurveyView.as_view()(request, user_id=2)
         self.assertEquals(response.status_code, 400)
 
-    
+
+    def test_daily_survey_view_get_merges_days(self):
+        # Logs of each type on the same day come back as one entry
+        request = self.factory.get('/fitConnect/daily_survey/')
+        response = DailySurveyView.as_view()(request, user_id=self.test_user.user_id)
+        self.assertEquals(len(response.data), 1)
+        day = response.data[0]
+        self.assertEquals(day['recorded_date'], '2023-12-10')
+        self.assertEquals(day['calorie_amount'], self.cal_amount)
+        self.assertEquals(day['water_amount'], self.water_amount)
+        self.assertEquals(day['mood'], self.mood)
+        self.assertEquals(day['weight'], '150.00')
+
+    def test_daily_survey_view_get_totals_and_latest(self):
+        # Amounts add up over the day, mood and weight are the day's latest
+        CalorieLog.objects.create(user=self.test_user, amount=400, recorded_date='2023-12-10')
+        WaterLog.objects.create(user=self.test_user, amount=20, recorded_date='2023-12-10')
+        MentalHealthLog.objects.create(user=self.test_user, mood='Angry', recorded_date='2023-12-10')
+        PhysicalHealthLog.objects.create(user=self.test_user, weight=149, recorded_date='2023-12-10')
+        request = self.factory.get('/fitConnect/daily_survey/')
+        day = DailySurveyView.as_view()(request, user_id=self.test_user.user_id).data[0]
+        self.assertEquals(day['calorie_amount'], self.cal_amount + 400)
+        self.assertEquals(day['water_amount'], self.water_amount + 20)
+        self.assertEquals(day['mood'], 'Angry')
+        self.assertEquals(day['weight'], '149.00')
+
+    def test_daily_survey_view_get_pagination(self):
+        for day in range(1, 8):
+            CalorieLog.objects.create(user=self.test_user, amount=day, recorded_date=f'2023-11-0{day}')
+
+        # First page only holds the most recent days, within the requested range
+        request = self.factory.get('/fitConnect/daily_survey/', {'from': '2023-11-01', 'to': '2023-11-30', 'limit': 3})
+        with self.assertNumQueries(2) as queries:  # user check + timeline
+            response = DailySurveyView.as_view()(request, user_id=self.test_user.user_id)
+        self.assertEquals([day['recorded_date'] for day in response.data], ['2023-11-07', '2023-11-06', '2023-11-05'])
+        # The range is applied by each log table, not after combining the user's whole history
+        self.assertEquals(queries.captured_queries[1]['sql'].count("recorded_date >= '2023-11-01'"), 4)
+
+        # Next page continues from the last day received
+        request = self.factory.get('/fitConnect/daily_survey/', {'before': '2023-11-05', 'limit': 3})
+        response = DailySurveyView.as_view()(request, user_id=self.test_user.user_id)
+        self.assertEquals([day['recorded_date'] for day in response.data], ['2023-11-04', '2023-11-03', '2023-11-02'])
+
+        # Invalid params
+        request = self.factory.get('/fitConnect/daily_survey/', {'from': 'yesterday'})
+        response = DailySurveyView.as_view()(request, user_id=self.test_user.user_id)
+        self.assertEquals(response.status_code, 400)
+        request = self.factory.get('/fitConnect/daily_survey/', {'limit': 0})
+        response = DailySurveyView.as_view()(request, user_id=self.test_user.user_id)
+        self.assertEquals(response.status_code, 400)
+
     def test_daily_survey_view_post(self):
         # Assert Post request response is 201
         request = self.factory.post('/fitConnect/daily_survey/', {"recorded_date": "2023-12-10", "calorie_amount": 1000, "water_amount": 500, "mood": "Sad", "weight": 150.0})
         response = DailySurveyView.as_view()(request, user_id=self.test_user.user_id)
         self.assertEquals(response.status_code, 201)
 
+        # Assert the day's summary now includes both surveys
+        summary = DailyHealthSummary.objects.get(user=self.test_user, recorded_date='2023-12-10')
+        self.assertEquals(summary.total_calories, self.cal_amount + 1000)
+        self.assertEquals(summary.total_water, self.water_amount + 500)
+        self.assertEquals(summary.last_mood, 'Sad')
+
         # Assert Post request for invalid user is 400
         response = DailySurveyView.as_view()(request, user_id=2)
         self.assertEquals(response.status_code, 400)
 
 
+class TestDailySurveyBatchEndpoint(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.test_user = User.objects.create(first_name='Test', last_name='User')
+
+    def post_days(self, days, user_id=None):
+        request = self.factory.post('/fitConnect/daily_survey/batch/', {'days': days}, content_type='application/json')
+        return DailySurveyBatchView.as_view()(request, user_id=user_id or self.test_user.user_id)
+
+    def survey(self, day, calories):
+        return {"recorded_date": f"2023-12-0{day}", "calorie_amount": calories, "water_amount": 500, "mood": "Happy", "weight": 150.0}
+
+    def test_batch_import(self):
+        response = self.post_days([self.survey(day, 1000) for day in range(1, 8)])
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(CalorieLog.objects.filter(user=self.test_user).count(), 7)
+        self.assertEquals(PhysicalHealthLog.objects.filter(user=self.test_user).count(), 7)
+        self.assertEquals(DailyHealthSummary.objects.filter(user=self.test_user).count(), 7)
+
+        # Re-syncing updates days that were already logged instead of duplicating them
+        response = self.post_days([self.survey(7, 2000), self.survey(8, 1000)])
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(CalorieLog.objects.filter(user=self.test_user).count(), 8)
+        self.assertEquals(CalorieLog.objects.get(user=self.test_user, recorded_date='2023-12-07').amount, 2000)
+        summary = DailyHealthSummary.objects.get(user=self.test_user, recorded_date='2023-12-07')
+        self.assertEquals(summary.total_calories, 2000)
+
+    def test_batch_import_invalid(self):
+        # Invalid user
+        response = self.post_days([self.survey(1, 1000)], user_id=999)
+        self.assertEquals(response.status_code, 400)
+
+        # One invalid day rejects the whole batch
+        response = self.post_days([self.survey(1, 1000), {"recorded_date": "2023-12-02"}])
+        self.assertEquals(response.status_code, 400)
+        self.assertFalse(CalorieLog.objects.filter(user=self.test_user).exists())
+
+
 class TestInitialSurveyEndpoint(TestCase):
     def setUp(self):
         self.factory = RequestFactory()
@@ -255,6 +378,363 @@ class TestDeclineClientView(TestCase):
         self.assertEquals(response.status_code, 400)
 
 
+
+class TestTriageClients(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.test_coach_user = User.objects.create(first_name='Coach', last_name='Person', email='coach@mail.com')
+        self.test_coach = Coach.objects.create(user=self.test_coach_user)
+        self.clients = [
+            User.objects.create(first_name='Client', last_name=str(i), email=f'client{i}@mail.com', hired_coach=self.test_coach)
+            for i in range(4)
+        ]
+
+    def triage(self, accept=(), decline=()):
+        data = {'coach': self.test_coach.coach_id, 'accept': list(accept), 'decline': list(decline)}
+        request = self.factory.patch('/fitConnect/triageClients/', data, content_type='application/json')
+        return TriageClients.as_view()(request)
+
+    def test_triage_clients(self):
+        accept = [self.clients[0].user_id, self.clients[1].user_id]
+        decline = [self.clients[2].user_id]
+        with self.assertNumQueries(6):  # coach check + savepoint + locking select + one update per action + release
+            response = self.triage(accept, decline)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data, {'accepted': accept, 'declined': decline})
+
+        self.assertEquals(set(User.objects.filter(has_coach=True).values_list('user_id', flat=True)), set(accept))
+        declined = User.objects.get(pk=self.clients[2].user_id)
+        self.assertIsNone(declined.hired_coach_id)
+        self.assertEquals(User.objects.get(pk=self.clients[3].user_id).hired_coach_id, self.test_coach.coach_id)
+
+    def test_triage_is_all_or_nothing(self):
+        # Already accepted clients no longer have a pending request
+        self.triage(accept=[self.clients[0].user_id])
+        response = self.triage(accept=[self.clients[0].user_id, self.clients[1].user_id])
+        self.assertEquals(response.status_code, 400)
+        self.assertFalse(User.objects.get(pk=self.clients[1].user_id).has_coach)
+
+        response = self.triage(accept=[self.clients[1].user_id], decline=[self.clients[1].user_id])
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(self.triage().status_code, 400)
+
+    def test_single_accept_loads_user_once(self):
+        request = self.factory.patch('/fitConnect/acceptClient/', {'user': self.clients[0].user_id, 'coach': self.test_coach.coach_id}, content_type='application/json')
+        with self.assertNumQueries(3):  # user + coach check + update
+            response = AcceptClient.as_view()(request)
+        self.assertEquals(response.status_code, 200)
+        self.assertTrue(User.objects.get(pk=self.clients[0].user_id).has_coach)
+
+    def test_single_request_coach(self):
+        user = User.objects.create(first_name='New', last_name='Client', email='new@mail.com')
+        data = {'user': user.user_id, 'coach': self.test_coach.coach_id}
+        request = self.factory.patch('/fitConnect/requestCoach/', data, content_type='application/json')
+        with self.assertNumQueries(3):
+            response = RequestCoach.as_view()(request)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(User.objects.get(pk=user.user_id).hired_coach_id, self.test_coach.coach_id)
+
+        # A second request is rejected
+        request = self.factory.patch('/fitConnect/requestCoach/', data, content_type='application/json')
+        response = RequestCoach.as_view()(request)
+        self.assertEquals(response.status_code, 400)
+
+
+class TestCoachClients(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        cache.clear()
+        self.test_coach_user = User.objects.create(first_name='Coach', last_name='Person', email='coach@mail.com')
+        self.test_coach = Coach.objects.create(user=self.test_coach_user)
+        self.clients = [
+            User.objects.create(first_name='Client', last_name=str(i), email=f'client{i}@mail.com', hired_coach=self.test_coach, has_coach=True)
+            for i in range(5)
+        ]
+        User.objects.create(first_name='Pending', last_name='Client', email='pending@mail.com', hired_coach=self.test_coach)
+
+        # Activity for the first client
+        self.plan = WorkoutPlan.objects.create(user=self.clients[0], plan_name='Plan')
+        exercise = ExerciseBank.objects.create(name='Squat', muscle_group=MuscleGroupBank.objects.create(name='Legs'),
+                                               equipment=EquipmentBank.objects.create(name='Barbell'))
+        exercise_in_plan = ExerciseInWorkoutPlan.objects.create(plan=self.plan, exercise=exercise)
+        WorkoutLog.objects.create(user=self.clients[0], exercise_in_plan=exercise_in_plan, completed_date=date(2024, 3, 1))
+        WorkoutLog.objects.create(user=self.clients[0], exercise_in_plan=exercise_in_plan, completed_date=date(2024, 3, 5))
+        PhysicalHealthLog.objects.create(user=self.clients[0], weight=80, recorded_date=date(2024, 3, 1))
+        PhysicalHealthLog.objects.create(user=self.clients[0], weight=79.5, recorded_date=date(2024, 3, 4))
+
+    def get(self, hired=True, **params):
+        request = self.factory.get('/fitConnect/coaches/clients', params)
+        return CoachClients.as_view(hired=hired)(request, pk=self.test_coach.coach_id)
+
+    def test_coach_clients(self):
+        response = self.get()
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals([client['user_id'] for client in response.data], [client.user_id for client in self.clients])
+        self.assertNotIn('latest_weight', response.data[0])
+        self.assertEquals(response['X-Client-Count'], '5')
+        self.assertEquals(response['X-Request-Count'], '1')
+
+        response = self.get(hired=False)
+        self.assertEquals(len(response.data), 1)
+        self.assertEquals(response.data[0]['first_name'], 'Pending')
+
+    def test_coach_clients_pages(self):
+        get_user_ids = lambda response: [client['user_id'] for client in response.data]
+        with self.assertNumQueries(1):
+            response = self.get(limit=2, activity='true')
+        user_ids = get_user_ids(response)
+        self.assertEquals(response.data[0]['latest_workout_date'], '2024-03-05')
+        self.assertEquals(response.data[0]['latest_weight'], '79.50')
+        self.assertIsNone(response.data[1]['latest_workout_date'])
+
+        while 'X-Next-Cursor' in response:
+            response = self.get(limit=2, after=response['X-Next-Cursor'])
+            user_ids += get_user_ids(response)
+        self.assertEquals(user_ids, [client.user_id for client in self.clients])
+        self.assertEquals(response['X-Client-Count'], '5')
+
+        self.assertEquals(self.get(limit=0).status_code, 400)
+        self.assertEquals(self.get(after='bad').status_code, 400)
+
+    def test_coach_clients_default_page_size(self):
+        # Without ?limit= a page is still bounded, and the rest of the roster is reached with the cursor
+        with mock.patch.object(CoachClients, 'default_limit', 3):
+            response = self.get()
+            self.assertEquals([client['user_id'] for client in response.data], [client.user_id for client in self.clients[:3]])
+            response = self.get(after=response['X-Next-Cursor'])
+            self.assertEquals([client['user_id'] for client in response.data], [client.user_id for client in self.clients[3:]])
+            self.assertNotIn('X-Next-Cursor', response)
+
+            request = self.factory.get('/fitConnect/coaches/adherence')
+            response = CoachAdherence.as_view()(request, pk=self.test_coach.coach_id)
+            self.assertEquals(len(response.data), 3)
+            self.assertIn('X-Next-Cursor', response)
+
+    def test_coach_adherence(self):
+        today = timezone.localdate()
+        exercise_in_plan = ExerciseInWorkoutPlan.objects.get(plan=self.plan)
+        for days_ago in (0, 3, 10, 40):
+            WorkoutLog.objects.create(user=self.clients[1], exercise_in_plan=exercise_in_plan, completed_date=today - timedelta(days=days_ago))
+        CalorieLog.objects.create(user=self.clients[1], amount=2000, recorded_date=today - timedelta(days=1))
+        CalorieLog.objects.create(user=self.clients[1], amount=2500, recorded_date=today - timedelta(days=2))
+        CalorieLog.objects.create(user=self.clients[2], amount=1800, recorded_date=today - timedelta(days=4))
+
+        request = self.factory.get('/fitConnect/coaches/adherence')
+        with self.assertNumQueries(3):  # client page + grouped workouts + grouped daily summaries
+            response = CoachAdherence.as_view()(request, pk=self.test_coach.coach_id)
+        self.assertEquals(response.status_code, 200)
+        adherence = {client['user_id']: client for client in response.data}
+        self.assertEquals(len(adherence), 5)
+
+        client = adherence[self.clients[1].user_id]
+        self.assertEquals((client['workouts_7d'], client['workouts_30d']), (2, 3))
+        self.assertEquals(client['days_since_last_log'], 0)
+        self.assertEquals(client['avg_calories_30d'], 2250)
+
+        client = adherence[self.clients[2].user_id]
+        self.assertEquals((client['workouts_7d'], client['workouts_30d']), (0, 0))
+        self.assertEquals(client['days_since_last_log'], 4)
+        self.assertIsNone(client['last_workout_date'])
+
+        client = adherence[self.clients[0].user_id]
+        self.assertEquals(client['latest_weight'], '79.50')
+        self.assertEquals(client['last_workout_date'], '2024-03-05')
+
+        self.assertIsNone(adherence[self.clients[3].user_id]['days_since_last_log'])
+
+
+class TestWorkoutLogView(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.test_user = User.objects.create(first_name='Test', last_name='User', email='client@mail.com')
+        self.plan = WorkoutPlan.objects.create(user=self.test_user, plan_name='Plan')
+        exercise = ExerciseBank.objects.create(name='Squat', muscle_group=MuscleGroupBank.objects.create(name='Legs'),
+                                               equipment=EquipmentBank.objects.create(name='Barbell'))
+        self.exercise_in_plan = ExerciseInWorkoutPlan.objects.create(plan=self.plan, exercise=exercise)
+        self.today = timezone.localdate()
+
+    def log(self, days_ago, reps=10):
+        WorkoutLog.objects.create(user=self.test_user, exercise_in_plan=self.exercise_in_plan, reps=reps,
+                                  completed_date=self.today - timedelta(days=days_ago))
+
+    def get(self, **params):
+        request = self.factory.get('/fitConnect/view_workout_logs/', params)
+        return WorkoutLogView.as_view()(request, plan_id=self.plan.plan_id)
+
+    def test_recent_logs(self):
+        for days_ago in (0, 2, 4, 5, 9):
+            self.log(days_ago)
+        with self.assertNumQueries(1):
+            response = self.get()
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals([log['completed_date'] for log in response.data],
+                          [str(self.today - timedelta(days=days_ago)) for days_ago in (0, 2, 4)])
+        self.assertEquals(response.data[0]['plan'], 'Plan')
+        self.assertEquals(response.data[0]['exercise'], 'Squat')
+
+        self.assertEquals(len(self.get(days=10).data), 5)
+        self.assertEquals(self.get(days=0).status_code, 400)
+
+    def test_last_logged_day(self):
+        self.log(20, reps=8)
+        self.log(20, reps=12)
+        self.log(30)
+        with self.assertNumQueries(1):
+            response = self.get()
+        self.assertEquals(sorted(log['reps'] for log in response.data), [8, 12])
+
+    def test_no_logs(self):
+        response = self.get()
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data, [])
+
+    def test_pagination(self):
+        for days_ago in range(4):
+            self.log(days_ago)
+        response = self.get(limit=3)
+        self.assertEquals(response.data['count'], 4)
+        self.assertEquals(len(response.data['results']), 3)
+
+    def test_most_recent_workout_plan(self):
+        self.log(3)
+        self.log(1, reps=8)
+        self.log(1, reps=12)
+        request = self.factory.get('/fitConnect/mostRecentWorkoutPlanView/')
+        with self.assertNumQueries(2):
+            response = MostRecentWorkoutPlanView.as_view()(request, user_id=self.test_user.user_id)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['plan_id'], self.plan.plan_id)
+        self.assertEquals([log['reps'] for log in response.data['logs']], [8, 12])
+
+        other_user = User.objects.create(first_name='Other', last_name='User', email='other@mail.com')
+        response = MostRecentWorkoutPlanView.as_view()(request, user_id=other_user.user_id)
+        self.assertEquals(response.data, {'error': 'No workout logs found.'})
+        response = MostRecentWorkoutPlanView.as_view()(request, user_id=0)
+        self.assertEquals(response.data, {'error': 'User not found.'})
+
+    def test_progression(self):
+        cache.clear()
+        for days_ago, reps, weight in ((10, 10, 100), (10, 5, 120), (3, 8, 110), (3, 8, 110), (1, 1, 125)):
+            WorkoutLog.objects.create(user=self.test_user, exercise_in_plan=self.exercise_in_plan, reps=reps, weight=weight,
+                                      completed_date=self.today - timedelta(days=days_ago))
+        request = self.factory.get('/fitConnect/progression/')
+        with self.assertNumQueries(1):
+            response = ProgressionView.as_view()(request, user_id=self.test_user.user_id)
+        squat = response.data['exercises'][0]
+        self.assertEquals(squat['name'], 'Squat')
+        self.assertEquals(squat['sessions'], 3)
+        self.assertEquals(squat['total_volume'], 1600 + 1760 + 125)
+        self.assertEquals([day['volume'] for day in squat['history']], [1600, 1760, 125])
+        self.assertEquals([day['e1rm'] for day in squat['history']], [140.0, 139.3, 125.0])
+        self.assertEquals(squat['history'][1]['records'], ['volume'])
+        self.assertEquals(squat['history'][2]['records'], ['top_weight'])
+        self.assertEquals(squat['personal_records']['e1rm']['value'], 140.0)
+
+        # Cached until the user logs another workout
+        with self.assertNumQueries(0):
+            ProgressionView.as_view()(request, user_id=self.test_user.user_id, exercise_id=squat['exercise_id'])
+        data = {'user': self.test_user.user_id, 'exercise_in_plan': self.exercise_in_plan.exercise_in_plan_id,
+                'reps': 3, 'weight': 150, 'completed_date': str(self.today)}
+        response = WorkoutLogCreateView.as_view()(self.factory.post('/fitConnect/create_workout_log/', data))
+        self.assertEquals(response.status_code, 201)
+        response = ProgressionView.as_view()(request, user_id=self.test_user.user_id, exercise_id=squat['exercise_id'])
+        self.assertEquals(response.data['personal_records']['top_weight']['value'], 150)
+
+        response = ProgressionView.as_view()(request, user_id=self.test_user.user_id, exercise_id=0)
+        self.assertEquals(response.status_code, 404)
+
+    def test_log_workout_session(self):
+        other_exercise = ExerciseInWorkoutPlan.objects.create(plan=self.plan, exercise=self.exercise_in_plan.exercise)
+        data = {'user': self.test_user.user_id, 'plan': self.plan.plan_id, 'sets': [
+            {'exercise_in_plan': self.exercise_in_plan.exercise_in_plan_id, 'reps': 10, 'weight': 100},
+            {'exercise_in_plan': self.exercise_in_plan.exercise_in_plan_id, 'reps': 8, 'weight': 110},
+            {'exercise_in_plan': other_exercise.exercise_in_plan_id, 'duration_minutes': 20},
+        ]}
+        request = self.factory.post('/fitConnect/create_workout_session/', data, content_type='application/json')
+        with self.assertNumQueries(4):  # validation + savepoint + bulk insert + release
+            response = WorkoutSessionCreateView.as_view()(request)
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals(response.data['count'], 3)
+        logs = WorkoutLog.objects.order_by('workout_id')
+        self.assertEquals([log.reps for log in logs], [10, 8, None])
+        self.assertTrue(all(log.plan_id == self.plan.plan_id and log.completed_date == self.today for log in logs))
+
+        # Exercises of another user's plan are rejected and nothing is written
+        other_user = User.objects.create(first_name='Other', last_name='User', email='other@mail.com')
+        other_plan = WorkoutPlan.objects.create(user=other_user, plan_name='Other plan')
+        foreign_exercise = ExerciseInWorkoutPlan.objects.create(plan=other_plan, exercise=self.exercise_in_plan.exercise)
+        data['sets'].append({'exercise_in_plan': foreign_exercise.exercise_in_plan_id, 'reps': 5})
+        request = self.factory.post('/fitConnect/create_workout_session/', data, content_type='application/json')
+        response = WorkoutSessionCreateView.as_view()(request)
+        self.assertEquals(response.status_code, 400)
+        self.assertEquals(WorkoutLog.objects.count(), 3)
+
+        # So are exercises removed from the plan
+        other_exercise.is_active = 0
+        other_exercise.save()
+        data['sets'].pop()
+        request = self.factory.post('/fitConnect/create_workout_session/', data, content_type='application/json')
+        response = WorkoutSessionCreateView.as_view()(request)
+        self.assertEquals(response.status_code, 400)
+        self.assertIn('removed', str(response.data))
+        self.assertEquals(WorkoutLog.objects.count(), 3)
+
+    def test_workout_session_ids_without_bulk_returning(self):
+        data = {'user': self.test_user.user_id, 'plan': self.plan.plan_id, 'sets': [
+            {'exercise_in_plan': self.exercise_in_plan.exercise_in_plan_id, 'reps': 10},
+            {'exercise_in_plan': self.exercise_in_plan.exercise_in_plan_id, 'reps': 8},
+        ]}
+        request = self.factory.post('/fitConnect/create_workout_session/', data, content_type='application/json')
+        # Like MySQL, where bulk_create leaves the primary keys unset
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False):
+            response = WorkoutSessionCreateView.as_view()(request)
+        self.assertEquals(response.status_code, 201)
+        self.assertEquals([log['workout_id'] for log in response.data['logs']],
+                          list(WorkoutLog.objects.order_by('workout_id').values_list('workout_id', flat=True)))
+        self.assertEquals([log['reps'] for log in response.data['logs']], [10, 8])
+
+    def test_logs_without_plan(self):
+        # Logged before WorkoutLog.plan existed and not backfilled yet
+        self.log(0, reps=8)
+        self.log(0, reps=12)
+        WorkoutLog.objects.update(plan=None)
+
+        response = self.get()
+        self.assertEquals(sorted(log['reps'] for log in response.data), [8, 12])
+        self.assertEquals(response.data[0]['plan'], 'Plan')
+
+        request = self.factory.get('/fitConnect/mostRecentWorkoutPlanView/')
+        with self.assertNumQueries(2):
+            response = MostRecentWorkoutPlanView.as_view()(request, user_id=self.test_user.user_id)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['plan_name'], 'Plan')
+        self.assertEquals([log['reps'] for log in response.data['logs']], [8, 12])
+
+    def test_backfill_workout_log_plans(self):
+        self.log(0)
+        self.assertEquals(WorkoutLog.objects.get().plan_id, self.plan.plan_id)
+        WorkoutLog.objects.update(plan=None)
+        out = StringIO()
+        call_command('backfill_workout_log_plans', stdout=out)
+        self.assertIn('Backfilled 1 workout logs', out.getvalue())
+        self.assertEquals(WorkoutLog.objects.get().plan_id, self.plan.plan_id)
+
+    def test_log_moved_to_another_plan(self):
+        self.log(0)
+        other_plan = WorkoutPlan.objects.create(user=self.test_user, plan_name='Other plan')
+        other_exercise = ExerciseInWorkoutPlan.objects.create(plan=other_plan, exercise=self.exercise_in_plan.exercise)
+
+        log = WorkoutLog.objects.get()
+        log.exercise_in_plan_id = other_exercise.exercise_in_plan_id
+        log.save()
+        self.assertEquals(WorkoutLog.objects.get().plan_id, other_plan.plan_id)
+
+        # Saving without changing the exercise doesn't look the plan up again
+        log = WorkoutLog.objects.get()
+        log.reps = 3
+        with self.assertNumQueries(1):
+            log.save()
+
 class TestEditExerciseBankView(TestCase):
     def setUp(self):
         self.factory = RequestFactory()
@@ -327,3 +807,956 @@ class TestCoachListView(TestCase):
         response = CoachList.as_view()(request)
         self.assertEquals(response.status_code, 200)
 
+
+class TestWorkoutPlanListQueryCount(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+        # Create Test User
+        self.test_user = User.objects.create(first_name='Test', last_name='User')
+
+        # Create Test Exercise
+        self.muscle_group = MuscleGroupBank.objects.create(name='Biceps')
+        self.equipment = EquipmentBank.objects.create(name='Flat Bench')
+        self.exercise = ExerciseBank.objects.create(name='Bench Press', muscle_group=self.muscle_group, equipment=self.equipment)
+
+    def create_plans(self, count):
+        plans = WorkoutPlan.objects.bulk_create(
+            [WorkoutPlan(user=self.test_user, plan_name=f'Plan {i}') for i in range(count)])
+        exercises = []
+        for plan in plans:
+            exercises.append(ExerciseInWorkoutPlan(plan=plan, exercise=self.exercise, sets=3, reps=10))
+            exercises.append(ExerciseInWorkoutPlan(plan=plan, exercise=self.exercise, sets=3, reps=10, is_active=0))
+        ExerciseInWorkoutPlan.objects.bulk_create(exercises)
+
+    def get_plans(self):
+        request = self.factory.get('/fitConnect/plans')
+        response = WorkoutPlanList.as_view()(request)
+        self.assertEquals(response.status_code, 200)
+        return response.data
+
+    def test_query_count_is_constant(self):
+        # One query for the plans, one for their active exercises (joined with exercise, muscle group and equipment)
+        self.create_plans(5)
+        with self.assertNumQueries(2):
+            self.get_plans()
+
+        self.create_plans(495)
+        with self.assertNumQueries(2):
+            data = self.get_plans()
+        self.assertEquals(len(data), 500)
+
+    def test_inactive_exercises_are_excluded(self):
+        self.create_plans(1)
+        data = self.get_plans()
+        self.assertEquals(len(data[0]['exercises']), 1)
+        self.assertEquals(data[0]['exercises'][0]['exercise']['muscle_group_name'], 'Biceps')
+
+
+class TestDailyHealthSummary(TestCase):
+    def setUp(self):
+        self.test_user = User.objects.create(first_name='Test', last_name='User')
+        CalorieLog.objects.create(user=self.test_user, amount=100, recorded_date='2023-12-10')
+        CalorieLog.objects.create(user=self.test_user, amount=250, recorded_date='2023-12-10')
+        WaterLog.objects.create(user=self.test_user, amount=50, recorded_date='2023-12-11')
+        MentalHealthLog.objects.create(user=self.test_user, mood='Happy', recorded_date='2023-12-10')
+        self.weight_log = PhysicalHealthLog.objects.create(user=self.test_user, weight=150, recorded_date='2023-12-10')
+
+    def test_summary_is_updated_on_save(self):
+        summary = DailyHealthSummary.objects.get(user=self.test_user, recorded_date='2023-12-10')
+        self.assertEquals(summary.total_calories, 350)
+        self.assertEquals(summary.last_mood, 'Happy')
+        self.assertEquals(summary.last_weight, 150)
+
+        # Editing an existing log recomputes the day
+        self.weight_log.weight = 148
+        self.weight_log.save()
+        summary.refresh_from_db()
+        self.assertEquals(summary.last_weight, 148)
+
+    def test_summary_follows_moved_and_deleted_logs(self):
+        calorie_log = CalorieLog.objects.get(amount=250)
+        calorie_log.recorded_date = date(2023, 12, 11)
+        calorie_log.save()
+        self.assertEquals(DailyHealthSummary.objects.get(recorded_date='2023-12-10').total_calories, 100)
+        self.assertEquals(DailyHealthSummary.objects.get(recorded_date='2023-12-11').total_calories, 250)
+
+        calorie_log.delete()
+        self.assertEquals(DailyHealthSummary.objects.get(recorded_date='2023-12-11').total_calories, 0)
+        WaterLog.objects.filter(recorded_date='2023-12-11').delete()
+        # No logs left that day
+        self.assertFalse(DailyHealthSummary.objects.filter(recorded_date='2023-12-11').exists())
+
+        self.weight_log.delete()
+        self.assertIsNone(DailyHealthSummary.objects.get(recorded_date='2023-12-10').last_weight)
+
+    def test_summary_view(self):
+        factory = RequestFactory()
+
+        def get(**params):
+            request = factory.get('/fitConnect/daily_summary/', params)
+            return DailyHealthSummaryView.as_view()(request, user_id=self.test_user.user_id)
+
+        response = get()
+        self.assertEquals([day['recorded_date'] for day in response.data], ['2023-12-11', '2023-12-10'])
+        self.assertEquals([day['recorded_date'] for day in get(limit=1).data], ['2023-12-11'])
+        self.assertEquals([day['recorded_date'] for day in get(before='2023-12-11').data], ['2023-12-10'])
+        self.assertEquals(get(**{'from': 'yesterday'}).status_code, 400)
+        self.assertEquals(get(to='2023-13-01').status_code, 400)
+        self.assertEquals(get(limit=1000).status_code, 400)
+
+    def test_rebuild_command(self):
+        expected = list(DailyHealthSummary.objects.order_by('recorded_date').values(
+            'recorded_date', 'total_calories', 'total_water', 'last_mood', 'last_weight'))
+        DailyHealthSummary.objects.all().delete()
+
+        call_command('rebuild_daily_health_summary', stdout=StringIO())
+        rebuilt = list(DailyHealthSummary.objects.order_by('recorded_date').values(
+            'recorded_date', 'total_calories', 'total_water', 'last_mood', 'last_weight'))
+        self.assertEquals(rebuilt, expected)
+        self.assertEquals(len(rebuilt), 2)
+
+
+class TestCreateWorkoutPlan(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.test_user = User.objects.create(first_name='Test', last_name='User')
+        self.exercises = ExerciseBank.objects.bulk_create([ExerciseBank(name=f'Exercise {i}') for i in range(50)])
+        self.exercise_ids = list(ExerciseBank.objects.values_list('exercise_id', flat=True))
+
+    def post_plan(self, exercise_ids):
+        data = {"user": self.test_user.user_id, "planName": "Test Plan", "creationDate": "2023-12-10",
+                "exercises": [{"exercise": exercise_id, "sets": 3, "reps": 10, "weight": 100, "durationMinutes": 20}
+                              for exercise_id in exercise_ids]}
+        request = self.factory.post('/fitConnect/create_workout_plan', data, content_type='application/json')
+        with CaptureQueriesContext(connection) as queries:
+            response = create_workout_plan(request)
+        return response, len(queries)
+
+    def test_create_workout_plan(self):
+        response, single_exercise_queries = self.post_plan(self.exercise_ids[:1])
+        self.assertEquals(response.status_code, 200)
+
+        # A 50 exercise plan costs the same number of queries as a 1 exercise plan
+        response, fifty_exercise_queries = self.post_plan(self.exercise_ids)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(fifty_exercise_queries, single_exercise_queries)
+
+        plan = json.loads(response.content)['plan']
+        self.assertTrue(WorkoutPlan.objects.filter(plan_id=plan['plan_id']).exists())
+        self.assertEquals(len(plan['exercises']), 50)
+        self.assertTrue(all(exercise['exercise_in_plan_id'] for exercise in plan['exercises']))
+
+    def test_create_workout_plan_invalid(self):
+        # Unknown exercise rejects the whole plan
+        response, _ = self.post_plan(self.exercise_ids[:3] + [999])
+        self.assertEquals(response.status_code, 400)
+        self.assertFalse(WorkoutPlan.objects.exists())
+
+        # Invalid sets
+        data = {"user": self.test_user.user_id, "planName": "Test Plan", "exercises": [{"exercise": self.exercise_ids[0], "sets": 0}]}
+        request = self.factory.post('/fitConnect/create_workout_plan', data, content_type='application/json')
+        self.assertEquals(create_workout_plan(request).status_code, 400)
+
+    def test_bodyweight_exercise(self):
+        data = {"user": self.test_user.user_id, "planName": "Test Plan", "exercises": [
+            {"exercise": self.exercise_ids[0], "sets": 3, "reps": 15, "weight": 0, "durationMinutes": 0}]}
+        request = self.factory.post('/fitConnect/create_workout_plan', data, content_type='application/json')
+        self.assertEquals(create_workout_plan(request).status_code, 200)
+        self.assertEquals(ExerciseInWorkoutPlan.objects.get().weight, 0)
+
+
+class TestGetMessages(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.coach_user = User.objects.create(first_name='Coach', last_name='Person', email='coach@mail.com')
+        self.client_user = User.objects.create(first_name='Test', last_name='User', email='client@mail.com')
+        MessageLog.objects.bulk_create([
+            MessageLog(sender=self.client_user if i % 2 else self.coach_user,
+                       recipient=self.coach_user if i % 2 else self.client_user, message_text=f'Message {i}')
+            for i in range(120)
+        ])
+
+    def get_page(self, params):
+        request = self.factory.get('/fitConnect/get_messages/', params)
+        response = get_messages(request, self.client_user.user_id, self.coach_user.user_id)
+        return json.loads(response.content)
+
+    def test_get_messages_pagination(self):
+        # Latest page, oldest message first, in one query
+        with self.assertNumQueries(1):
+            page = self.get_page({'limit': 50})
+        texts = [msg['text'] for msg in page['messages']]
+        self.assertEquals(texts, [f'Message {i}' for i in range(70, 120)])
+        self.assertEquals(page['messages'][-1]['sender_name'], 'Test User')
+
+        page = self.get_page({'limit': 50, 'before': page['next_before']})
+        self.assertEquals(page['messages'][0]['text'], 'Message 20')
+
+        page = self.get_page({'limit': 50, 'before': page['next_before']})
+        self.assertEquals(len(page['messages']), 20)
+        self.assertIsNone(page['next_before'])
+
+    def test_get_messages_invalid_params(self):
+        request = self.factory.get('/fitConnect/get_messages/', {'limit': 'all'})
+        response = get_messages(request, self.client_user.user_id, self.coach_user.user_id)
+        self.assertEquals(response.status_code, 400)
+
+
+class TestContactHistoryView(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.test_user = User.objects.create(first_name='Test', last_name='User', email='client@mail.com')
+        self.coach_user = User.objects.create(first_name='Coach', last_name='Person', email='coach@mail.com')
+        self.other_user = User.objects.create(first_name='Other', last_name='Person', email='other@mail.com')
+
+    def send(self, sender, recipient, text):
+        data = {'sender_id': sender.user_id, 'recipient_id': recipient.user_id, 'message_text': text}
+        request = self.factory.post('/fitConnect/create_message/', data, content_type='application/json')
+        self.assertEquals(create_message(request).status_code, 200)
+
+    def get_contacts(self):
+        request = self.factory.get('/fitConnect/contactHistory/')
+        with self.assertNumQueries(1):
+            response = ContactHistoryView.as_view()(request, user_id=self.test_user.user_id)
+        self.assertEquals(response.status_code, 200)
+        return response.data
+
+    def test_contact_history(self):
+        self.send(self.test_user, self.other_user, 'Hi')
+        self.send(self.test_user, self.coach_user, 'Hello coach')
+        self.send(self.coach_user, self.test_user, 'Hello client')
+        self.send(self.coach_user, self.test_user, 'How was the workout?')
+
+        # Most recent conversation first
+        contacts = self.get_contacts()
+        self.assertEquals([contact['user_id'] for contact in contacts], [self.coach_user.user_id, self.other_user.user_id])
+        self.assertEquals(contacts[0]['name'], 'Coach Person')
+        self.assertEquals(contacts[0]['last_message'], 'How was the workout?')
+        self.assertEquals(contacts[0]['unread_count'], 2)
+        self.assertEquals(contacts[1]['unread_count'], 0)
+
+        # Reading the conversation clears the unread count
+        request = self.factory.post('/fitConnect/contactHistory/read/')
+        response = ConversationReadView.as_view()(request, user_id=self.test_user.user_id, other_user_id=self.coach_user.user_id)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(self.get_contacts()[0]['unread_count'], 0)
+
+    def test_rebuild_conversations(self):
+        self.send(self.test_user, self.coach_user, 'Hello coach')
+        MessageLog.objects.bulk_create([MessageLog(sender=self.other_user, recipient=self.test_user, message_text='Hi')])
+        self.assertEquals(len(self.get_contacts()), 1)
+
+        call_command('rebuild_conversations', stdout=StringIO())
+        contacts = self.get_contacts()
+        self.assertEquals(contacts[0]['user_id'], self.other_user.user_id)
+        self.assertEquals(contacts[1]['unread_count'], 0)
+        self.assertEquals(Conversation.objects.get(user_one=self.test_user, user_two=self.coach_user).user_two_unread, 1)
+
+
+class TestStreamMessages(TestCase):
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        self.test_user = User.objects.create(first_name='Test', last_name='User', email='client@mail.com')
+        self.coach_user = User.objects.create(first_name='Coach', last_name='Person', email='coach@mail.com')
+        self.message = MessageLog.objects.create(sender=self.test_user, recipient=self.coach_user, message_text='Hello coach')
+
+    def stream(self, params):
+        request = self.factory.get('/fitConnect/stream_messages/', params)
+        return stream_messages(request, self.coach_user.user_id, self.test_user.user_id)
+
+    async def test_returns_existing_messages_immediately(self):
+        response = await self.stream({'since': 0})
+        self.assertEquals([msg['text'] for msg in json.loads(response.content)['messages']], ['Hello coach'])
+
+    async def test_times_out_without_new_messages(self):
+        response = await self.stream({'since': self.message.message_id, 'timeout': 0.05})
+        self.assertEquals(json.loads(response.content)['messages'], [])
+        self.assertEquals(message_broker.subscriber_count(self.test_user.user_id, self.coach_user.user_id), 0)
+
+    async def test_wakes_up_on_new_message(self):
+        waiting = asyncio.ensure_future(self.stream({'since': self.message.message_id, 'timeout': 5}))
+        while not message_broker.subscriber_count(self.test_user.user_id, self.coach_user.user_id):
+            await asyncio.sleep(0.01)
+
+        await sync_to_async(MessageLog.objects.create)(sender=self.coach_user, recipient=self.test_user, message_text='Hello client')
+        # Published from a worker thread, like create_message does
+        await sync_to_async(message_broker.publish, thread_sensitive=False)(self.coach_user.user_id, self.test_user.user_id)
+
+        response = await asyncio.wait_for(waiting, 2)
+        self.assertEquals([msg['text'] for msg in json.loads(response.content)['messages']], ['Hello client'])
+
+    async def test_without_since_waits_for_new_messages(self):
+        response = await self.stream({'timeout': 0.05})
+        data = json.loads(response.content)
+        self.assertEquals(data['messages'], [])
+        self.assertEquals(data['next_since'], self.message.message_id)
+
+    async def test_batches_are_capped(self):
+        await sync_to_async(MessageLog.objects.bulk_create)([
+            MessageLog(sender=self.coach_user, recipient=self.test_user, message_text=f'Message {number}')
+            for number in range(MAX_MESSAGES_PAGE_SIZE + 5)
+        ])
+        data = json.loads((await self.stream({'since': 0})).content)
+        self.assertEquals(len(data['messages']), MAX_MESSAGES_PAGE_SIZE)
+        self.assertTrue(data['has_more'])
+
+        data = json.loads((await self.stream({'since': data['next_since']})).content)
+        self.assertEquals([msg['text'] for msg in data['messages']], [f'Message {number}' for number in range(199, 205)])
+        self.assertFalse(data['has_more'])
+
+    async def test_served_through_asgi(self):
+        response = await self.async_client.get(
+            f'/fitConnect/stream_messages/{self.coach_user.user_id}/{self.test_user.user_id}/', {'since': 0})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals([msg['text'] for msg in json.loads(response.content)['messages']], ['Hello coach'])
+        self.assertIn('desc="queries=1"', response['Server-Timing'])
+
+
+class TestCachedLookupLists(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.muscle_group = MuscleGroupBank.objects.create(name='Biceps')
+        self.equipment = EquipmentBank.objects.create(name='Flat Bench')
+        self.exercise = ExerciseBank.objects.create(name='Bench Press', muscle_group=self.muscle_group, equipment=self.equipment)
+
+    def get_exercises(self, etag=None, **headers):
+        if etag:
+            headers['HTTP_IF_NONE_MATCH'] = etag
+        request = self.factory.get('/fitConnect/exercises', **headers)
+        return ExerciseList.as_view()(request)
+
+    def test_exercise_list_is_cached(self):
+        response = self.get_exercises()
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(json.loads(response.content)[0]['muscle_group_name'], 'Biceps')
+        etag = response['ETag']
+
+        # Served from the cache, and not modified for a client that already has it
+        with self.assertNumQueries(0):
+            self.assertEquals(self.get_exercises().status_code, 200)
+            self.assertEquals(self.get_exercises(etag).status_code, 304)
+
+        # Renaming a muscle group invalidates the exercise list as well
+        self.muscle_group.name = 'Triceps'
+        self.muscle_group.save()
+        response = self.get_exercises(etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertNotEquals(response['ETag'], etag)
+        self.assertEquals(json.loads(response.content)[0]['muscle_group_name'], 'Triceps')
+
+    def test_bank_saves_do_not_rebuild_the_list(self):
+        # Saving many rows only invalidates, the list is built once by the next request
+        self.get_exercises()
+        with self.captureOnCommitCallbacks(execute=True), \
+                mock.patch('FitConnect.services.lookup_cache._load', wraps=lookup_cache._load) as load:
+            for i in range(10):
+                ExerciseBank.objects.create(name=f'Exercise {i}', muscle_group=self.muscle_group)
+        self.assertEquals(load.call_count, 0)
+
+        with mock.patch('FitConnect.services.lookup_cache._load', wraps=lookup_cache._load) as load:
+            self.assertEquals(len(json.loads(self.get_exercises().content)), 11)
+            self.assertEquals(len(json.loads(self.get_exercises().content)), 11)
+        self.assertEquals(load.call_count, 1)
+
+    def test_exercise_list_precompressed(self):
+        ExerciseBank.objects.bulk_create([ExerciseBank(name=f'Exercise {i}', muscle_group=self.muscle_group) for i in range(50)])
+        cache.clear()
+        plain = self.get_exercises()
+        self.assertFalse(plain.has_header('Content-Encoding'))
+
+        compressed = self.get_exercises(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEquals(compressed['Content-Encoding'], 'gzip')
+        self.assertEquals(gzip.decompress(compressed.content), plain.content)
+        self.assertEquals(len(json.loads(plain.content)), 51)
+
+        # gzip refused by the client
+        self.assertFalse(self.get_exercises(HTTP_ACCEPT_ENCODING='gzip;q=0').has_header('Content-Encoding'))
+
+        # Each coding has its own ETag, revalidating one doesn't validate the other
+        self.assertNotEquals(compressed['ETag'], plain['ETag'])
+        self.assertEquals(self.get_exercises(compressed['ETag'], HTTP_ACCEPT_ENCODING='gzip').status_code, 304)
+        self.assertEquals(self.get_exercises(compressed['ETag']).status_code, 200)
+        self.assertEquals(self.get_exercises(plain['ETag'], HTTP_ACCEPT_ENCODING='gzip').status_code, 200)
+
+    def test_deactivated_exercise_is_removed(self):
+        self.get_exercises()
+        request = self.factory.put('/fitConnect/edit_exercise_bank', {'exercise_id': self.exercise.exercise_id}, content_type='application/json')
+        self.assertEquals(EditExerciseBankView.as_view()(request).status_code, 200)
+        self.assertEquals(json.loads(self.get_exercises().content), [])
+
+    def test_muscle_group_list(self):
+        request = self.factory.get('/fitConnect/muscle_groups')
+        response = MuscleGroupList.as_view()(request)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(json.loads(response.content)[0]['name'], 'Biceps')
+
+    def test_goal_index_reads_only_the_version(self):
+        goal = GoalBank.objects.create(goal_name='Lose Weight')
+        users = [User.objects.create(first_name='Test', last_name=f'User {number}', email=f'user{number}@mail.com', goal=goal)
+                 for number in range(5)]
+        self.assertEquals(UserSerializer(users[:1], many=True).data[0]['goal'], 'Lose Weight')
+
+        lookup_cache = caches[settings.LOOKUP_CACHE_ALIAS]
+        with mock.patch.object(lookup_cache, 'get', wraps=lookup_cache.get) as cache_get:
+            self.assertEquals([user['goal'] for user in UserSerializer(users, many=True).data], ['Lose Weight'] * 5)
+        self.assertEquals({call.args[0] for call in cache_get.call_args_list}, {'lookup:goals:version'})
+
+        # A new version is picked up
+        GoalBank.objects.filter(pk=goal.pk).update(goal_name='Build Muscle')
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_lookup_bank(GOALS)
+        self.assertEquals(UserSerializer(users[:1], many=True).data[0]['goal'], 'Build Muscle')
+
+
+class TestSearchExercisesFullText(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.muscle_group = MuscleGroupBank.objects.create(name='Chest')
+        self.bench_press = ExerciseBank.objects.create(name='Bench Press', description='Press the bar from your chest', muscle_group=self.muscle_group)
+        self.incline_press = ExerciseBank.objects.create(name='Incline Dumbbell Press', description='Bench set to an incline')
+        self.squat = ExerciseBank.objects.create(name='Squat', description='Stand up with the bar on your back')
+
+    def search(self, params):
+        request = self.factory.get('/fitConnect/exercises/search/', params)
+        response = SearchExercises.as_view()(request)
+        self.assertEquals(response.status_code, 200)
+        return [exercise['name'] for exercise in response.data]
+
+    def test_search_ranking(self):
+        # Name matches rank above description matches
+        self.assertEquals(self.search({'q': 'bench'}), ['Bench Press', 'Incline Dumbbell Press'])
+        # Prefixes match, all words must match
+        self.assertEquals(self.search({'q': 'incl pre'}), ['Incline Dumbbell Press'])
+        self.assertEquals(self.search({'q': 'bar'}), ['Bench Press', 'Squat'])
+        self.assertEquals(self.search({'q': 'deadlift'}), [])
+        # Combined with the exact filters
+        self.assertEquals(self.search({'q': 'press', 'muscle_group_id': self.muscle_group.muscle_group_id}), ['Bench Press'])
+
+    def test_index_follows_exercise_bank_edits(self):
+        self.assertEquals(self.search({'q': 'squat'}), ['Squat'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            request = self.factory.post('/fitConnect/edit_exercise_bank', {'name': 'Front Squat', 'description': 'Bar on the front of your shoulders'})
+            self.assertEquals(EditExerciseBankView.as_view()(request).status_code, 201)
+        with self.captureOnCommitCallbacks(execute=True):
+            request = self.factory.put('/fitConnect/edit_exercise_bank', {'exercise_id': self.squat.exercise_id}, content_type='application/json')
+            self.assertEquals(EditExerciseBankView.as_view()(request).status_code, 200)
+
+        # Applied incrementally, without needing a rebuild
+        self.assertTrue(index_is_current())
+        self.assertEquals(self.search({'q': 'squat'}), ['Front Squat'])
+
+    def test_index_built_at_startup(self):
+        with mock.patch('FitConnect.services.exercise_search.build_exercise_search_index') as build:
+            warm_exercise_search_index().join()
+        build.assert_called_once_with()
+
+        # A database that can't be reached leaves the build to the first search
+        with mock.patch('FitConnect.services.exercise_search.build_exercise_search_index', side_effect=DatabaseError), \
+                self.assertLogs('FitConnect.services.exercise_search', 'WARNING'):
+            warm_exercise_search_index().join()
+
+    def test_short_prefix_queries(self):
+        rng = random.Random(0)
+        catalog = [
+            (exercise_id, ' '.join(rng.sample(WORDS, 3)), ' '.join(rng.choices(WORDS, k=12)))
+            for exercise_id in range(1, 20001)
+        ]
+        index = ExerciseSearchIndex()
+        index.build(catalog)
+
+        # Two letter words match most of the catalog, the query must still be cheap
+        start = time.perf_counter()
+        results = index.search('se ca pu de ro', limit=50)
+        self.assertLess(time.perf_counter() - start, 0.05)
+        self.assertEquals(len(results), 50)
+        # Single letters are too short to be prefixes
+        self.assertEquals(index.search('s c p d r', limit=50), [])
+
+        # Same ranking as scoring every exercise one by one
+        def score(word, name, description):
+            name, description = tokenize(name), tokenize(description)
+            prefix = len(word) > 1
+            levels = [(NAME_EXACT, word in name), (NAME_PREFIX, prefix and any(token.startswith(word) for token in name)),
+                      (DESCRIPTION_EXACT, word in description), (DESCRIPTION_PREFIX, prefix and any(token.startswith(word) for token in description))]
+            return next((level for level, matches in levels if matches), 0)
+
+        def ranked(query, limit):
+            scored = []
+            for exercise_id, name, description in catalog:
+                scores = [score(word, name, description) for word in query.split()]
+                if all(scores):
+                    scored.append((-sum(scores), exercise_id))
+            return [exercise_id for total, exercise_id in sorted(scored)][:limit]
+
+        for query, limit in [('se ca pu de ro', 50), ('bench pr', 50), ('hammer', 50), ('pull pr', 1000), ('kettlebell swing single', None)]:
+            self.assertEquals(index.search(query, limit=limit), ranked(query, limit))
+
+        # Incremental updates give the same results as a rebuild
+        index.add(20001, 'Bench Press Hammer', 'pull')
+        index.add(5, 'Pull Over', 'hammer press')
+        index.remove(7)
+        catalog = [exercise for exercise in catalog if exercise[0] not in (5, 7)] + [(5, 'Pull Over', 'hammer press'), (20001, 'Bench Press Hammer', 'pull')]
+        for query in ['bench pr', 'hammer', 'pull pr', 'over']:
+            self.assertEquals(index.search(query, limit=100), ranked(query, 100))
+
+
+class TestCoachSearchView(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.lose_weight = GoalBank.objects.create(goal_name='Lose Weight')
+        self.build_muscle = GoalBank.objects.create(goal_name='Build Muscle')
+
+        # (goal, cost, experience, number of clients)
+        coaches = [(self.lose_weight, 20, 1, 0), (self.lose_weight, 40, 3, 2), (self.lose_weight, 75, 2, 1),
+                   (self.build_muscle, 30, 2, 3), (self.build_muscle, 150, 3, 0)]
+        self.coaches = []
+        for index, (goal, cost, experience, clients) in enumerate(coaches):
+            user = User.objects.create(first_name='Coach', last_name=str(index), email=f'coach{index}@mail.com')
+            coach = Coach.objects.create(user=user, goal=goal, cost=cost, experience=experience)
+            for client in range(clients):
+                User.objects.create(first_name='Client', last_name=str(client), email=f'client{index}-{client}@mail.com',
+                                    has_coach=True, hired_coach=coach)
+            self.coaches.append(coach)
+
+    def get(self, view, params):
+        request = self.factory.get('/fitConnect/coaches', params)
+        response = view.as_view()(request)
+        self.assertEquals(response.status_code, 200)
+        return response
+
+    def test_coach_list_sorting_and_pagination(self):
+        # One query for the page, regardless of the number of coaches (goal names come from the goal bank cache)
+        self.get(CoachList, {})
+        with self.assertNumQueries(1):
+            response = self.get(CoachList, {'sort': '-clients', 'limit': 2})
+        self.assertEquals([coach['client_count'] for coach in response.data], [3, 2])
+
+        response = self.get(CoachList, {'sort': '-clients', 'limit': 2, 'after': response['X-Next-Cursor']})
+        self.assertEquals([coach['client_count'] for coach in response.data], [1, 0])
+        response = self.get(CoachList, {'sort': '-clients', 'limit': 2, 'after': response['X-Next-Cursor']})
+        self.assertEquals([coach['coach_id'] for coach in response.data], [self.coaches[0].coach_id])
+        self.assertFalse(response.has_header('X-Next-Cursor'))
+
+        response = self.get(CoachList, {'sort': 'cost', 'offset': 1, 'limit': 2})
+        self.assertEquals([coach['cost'] for coach in response.data], ['30.00', '40.00'])
+
+        request = self.factory.get('/fitConnect/coaches', {'sort': 'name'})
+        self.assertEquals(CoachList.as_view()(request).status_code, 400)
+
+    def test_coach_list_cursor_over_missing_values(self):
+        # Coaches without a cost sort lowest, and the cursor walks past them in both directions
+        user = User.objects.create(first_name='Coach', last_name='New', email='coach-new@mail.com')
+        Coach.objects.create(user=user, goal=self.lose_weight, experience=1)
+        user = User.objects.create(first_name='Coach', last_name='Newer', email='coach-newer@mail.com')
+        Coach.objects.create(user=user, goal=self.lose_weight, experience=1)
+
+        for sort, expected in [('cost', [None, None, '20.00', '30.00', '40.00', '75.00', '150.00']),
+                               ('-cost', ['150.00', '75.00', '40.00', '30.00', '20.00', None, None])]:
+            response = self.get(CoachList, {'sort': sort, 'limit': 1})
+            costs = [coach['cost'] for coach in response.data]
+            while 'X-Next-Cursor' in response:
+                response = self.get(CoachList, {'sort': sort, 'limit': 1, 'after': response['X-Next-Cursor']})
+                costs += [coach['cost'] for coach in response.data]
+            self.assertEquals(costs, expected)
+
+        # Ordered by the indexed column itself
+        with CaptureQueriesContext(connection) as queries:
+            self.get(CoachList, {'sort': 'cost', 'limit': 2})
+        self.assertIn('ORDER BY "coach"."cost" ASC, "coach"."coach_id" ASC', queries.captured_queries[0]['sql'])
+
+    def test_coach_search_facets(self):
+        self.get(CoachSearch, {})
+        with self.assertNumQueries(2):  # Page + one aggregate query for the count and all facets
+            response = self.get(CoachSearch, {'goal': self.lose_weight.goal_id, 'cost': 50})
+        self.assertEquals(response.data['count'], 2)
+        self.assertEquals(len(response.data['results']), 2)
+        # The goal facet ignores the goal filter, the price facet ignores the cost filter
+        self.assertEquals([goal['count'] for goal in response.data['facets']['goal']], [2, 1])
+        self.assertEquals([bucket['count'] for bucket in response.data['facets']['price']], [1, 1, 1, 0])
+
+
+# Cheap argon2 parameters to keep the tests fast
+@override_settings(ARGON2_TIME_COST=2, ARGON2_MEMORY_COST=1024, ARGON2_PARALLELISM=1)
+class TestLoginView(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.password = 'password1!'
+        self.test_user = User.objects.create(first_name='Test', last_name='User', email='client@mail.com')
+        # Stored with older, weaker parameters
+        old_hasher = PasswordHasher(time_cost=1, memory_cost=1024, parallelism=1)
+        UserCredentials.objects.create(user=self.test_user, hashed_password=old_hasher.hash(self.password))
+
+    def login(self, password):
+        request = self.factory.post('/fitConnect/login', {'email': self.test_user.email, 'password': password}, content_type='application/json')
+        return LoginView.as_view()(request)
+
+    def test_login(self):
+        response = self.login(self.password)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['user_type'], 'user')
+        self.assertEquals(response.data['user_id'], self.test_user.user_id)
+
+        response = self.login('wrong-password1!')
+        self.assertEquals(response.status_code, 400)
+
+    def test_login_rehashes_outdated_hash(self):
+        self.login(self.password)
+        hashed_password = UserCredentials.objects.get(user=self.test_user).hashed_password
+        self.assertFalse(get_password_hasher().check_needs_rehash(hashed_password))
+
+        # Still valid with the new hash
+        self.assertEquals(self.login(self.password).status_code, 200)
+
+    @override_settings(PASSWORD_VERIFY_POOL_SIZE=2)
+    def test_login_with_verification_pool(self):
+        self.assertEquals(self.login(self.password).status_code, 200)
+        self.assertEquals(self.login('wrong-password1!').status_code, 400)
+
+    def test_verification_pool_resized(self):
+        with override_settings(PASSWORD_VERIFY_POOL_SIZE=2):
+            pool = passwords._get_pool()
+            self.assertIs(passwords._get_pool(), pool)
+        with override_settings(PASSWORD_VERIFY_POOL_SIZE=3):
+            self.assertEquals(self.login(self.password).status_code, 200)
+            self.assertIsNot(passwords._get_pool(), pool)
+        # The replaced pool is shut down instead of keeping its threads
+        with self.assertRaises(RuntimeError):
+            pool.submit(int)
+
+    def test_login_query_count(self):
+        self.login(self.password)  # Rehash outdated credentials and warm the goal cache
+        with self.assertNumQueries(1):
+            response = self.login(self.password)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['token'], AuthToken.objects.get(user=self.test_user).key)
+
+    def test_login_user_type(self):
+        Coach.objects.create(user=self.test_user)
+        self.assertEquals(self.login(self.password).data['user_type'], 'coach')
+        Admin.objects.create(user=self.test_user)
+        self.assertEquals(self.login(self.password).data['user_type'], 'admin')
+
+    def test_login_after_logout(self):
+        AuthToken.objects.filter(user=self.test_user).delete()
+        response = self.login(self.password)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.data['token'], AuthToken.objects.get(user=self.test_user).key)
+
+
+class TestTokenAuthentication(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        token_cache.clear()
+        self.test_user = User.objects.create(first_name='Test', last_name='User', email='client@mail.com')
+        self.token = AuthToken.objects.get(user=self.test_user)
+
+    def authenticate(self, key):
+        request = self.factory.get('/', HTTP_AUTHORIZATION='Token ' + key)
+        return CachedTokenAuthentication().authenticate(request)
+
+    def test_authenticate_from_cache(self):
+        with self.assertNumQueries(1):
+            user, token = self.authenticate(self.token.key)
+        self.assertEquals(user.user_id, self.test_user.user_id)
+        self.assertEquals(token.user_type, 'user')
+
+        with self.assertNumQueries(0):
+            user, token = self.authenticate(self.token.key)
+        self.assertEquals(user.user_id, self.test_user.user_id)
+        self.assertEquals(token_cache.stats()['hits'], 1)
+        self.assertEquals(token_cache.stats()['misses'], 1)
+
+    def test_cached_user_not_shared(self):
+        first, token = self.authenticate(self.token.key)
+        first.first_name = 'Changed'
+        first.unsaved_attribute = True
+        second, token = self.authenticate(self.token.key)
+        self.assertIsNot(first, second)
+        self.assertEquals(second.first_name, 'Test')
+        self.assertFalse(hasattr(second, 'unsaved_attribute'))
+
+    def test_invalid_token(self):
+        # Anonymous, like a request without a token
+        self.assertIsNone(self.authenticate('not-a-token'))
+        self.assertIsNone(self.authenticate('two words'))
+        response = self.client.get('/fitConnect/goals', HTTP_AUTHORIZATION='Token not-a-token')
+        self.assertEquals(response.status_code, 200)
+
+    def test_logout_invalidates_token(self):
+        self.authenticate(self.token.key)
+        request = self.factory.post('/fitConnect/logout', {'user_id': self.test_user.user_id}, content_type='application/json')
+        self.assertEquals(LogoutView.as_view()(request).status_code, 200)
+        self.assertIsNone(self.authenticate(self.token.key))
+
+    def test_logout_in_another_process(self):
+        cache.clear()
+        key = self.token.key
+        self.authenticate(key)
+        # Another worker deletes the token: this process' entry is still there, only the shared cache knows
+        with mock.patch.object(token_cache, 'invalidate'):
+            self.token.delete()
+        self.assertIsNotNone(token_cache.get(key))
+        self.assertIsNone(self.authenticate(key))
+
+    def test_role_change_invalidates_token(self):
+        self.authenticate(self.token.key)
+        Coach.objects.create(user=self.test_user)
+        user, token = self.authenticate(self.token.key)
+        self.assertEquals(token.user_type, 'coach')
+
+    def test_user_update_invalidates_token(self):
+        self.authenticate(self.token.key)
+        self.test_user.first_name = 'Updated'
+        self.test_user.save()
+        user, token = self.authenticate(self.token.key)
+        self.assertEquals(user.first_name, 'Updated')
+
+    def test_cache_bounds(self):
+        cache = TokenCache(max_size=1, ttl=60)
+        other_user = User.objects.create(first_name='Other', last_name='User', email='other@mail.com')
+        cache.set('a', self.test_user, 'user')
+        cache.set('b', other_user, 'user')
+        self.assertIsNone(cache.get('a'))
+        self.assertEquals(cache.get('b'), (other_user, 'user'))
+        self.assertEquals(cache.stats()['evictions'], 1)
+
+        cache = TokenCache(max_size=1, ttl=0)
+        cache.set('a', self.test_user, 'user')
+        self.assertIsNone(cache.get('a'))
+        self.assertEquals(cache.stats()['expirations'], 1)
+
+
+class TestIdempotencyKeys(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.sender = User.objects.create(first_name='Sender', last_name='User', email='sender@mail.com')
+        self.recipient = User.objects.create(first_name='Recipient', last_name='User', email='recipient@mail.com')
+
+    def send(self, text, key='retry-1'):
+        data = {'sender_id': self.sender.user_id, 'recipient_id': self.recipient.user_id, 'message_text': text}
+        request = self.factory.post('/fitConnect/create_message/', data, content_type='application/json',
+                                    HTTP_IDEMPOTENCY_KEY=key)
+        return create_message(request)
+
+    def test_retry_returns_stored_response(self):
+        response = self.send('Hello')
+        self.assertEquals(response.status_code, 200)
+        replayed = self.send('Hello')
+        self.assertEquals(replayed.status_code, 200)
+        self.assertEquals(replayed.content, response.content)
+        self.assertEquals(replayed['Idempotent-Replayed'], 'true')
+        self.assertEquals(MessageLog.objects.count(), 1)
+
+        # A new key is a new request
+        self.send('Hello', key='retry-2')
+        self.assertEquals(MessageLog.objects.count(), 2)
+
+    def test_key_reused_for_different_request(self):
+        self.send('Hello')
+        self.assertEquals(self.send('Something else').status_code, 422)
+        self.assertEquals(MessageLog.objects.count(), 1)
+
+    def test_request_in_progress(self):
+        self.send('Hello')
+        IdempotencyKey.objects.update(status=None, response=None)  # As if the first request were still running
+        self.assertEquals(self.send('Hello').status_code, 409)
+        self.assertEquals(MessageLog.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY_KEY_LEASE=30, IDEMPOTENCY_KEY_TTL=60 * 60 * 24)
+    def test_abandoned_claim_is_taken_over(self):
+        self.send('Hello')
+        record = IdempotencyKey.objects.get()
+        self.assertGreater(record.expires, timezone.now() + timedelta(hours=23))  # Stored responses get the full TTL
+
+        # A worker that died after claiming the key only holds it for the lease
+        now = timezone.now()
+        IdempotencyKey.objects.update(status=None, response=None, expires=now + timedelta(seconds=30))
+        response = self.send('Hello')
+        self.assertEquals(response.status_code, 409)
+        self.assertIn(response['Retry-After'], ['30', '31'])
+
+        IdempotencyKey.objects.update(expires=now - timedelta(seconds=1))
+        self.assertEquals(self.send('Hello').status_code, 200)
+        self.assertEquals(MessageLog.objects.count(), 2)
+        self.assertIsNotNone(IdempotencyKey.objects.get().status)
+
+    def test_expired_key_is_reclaimed(self):
+        self.send('Hello')
+        IdempotencyKey.objects.update(expires=timezone.now() - timedelta(seconds=1))
+        self.assertEquals(self.send('Hello').status_code, 200)
+        self.assertEquals(MessageLog.objects.count(), 2)
+
+        IdempotencyKey.objects.update(expires=timezone.now() - timedelta(seconds=1))
+        out = StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn('Purged 1 idempotency keys', out.getvalue())
+
+    def test_drf_view_retry(self):
+        plan = WorkoutPlan.objects.create(user=self.sender, plan_name='Plan')
+        exercise = ExerciseBank.objects.create(name='Squat', muscle_group=MuscleGroupBank.objects.create(name='Legs'),
+                                               equipment=EquipmentBank.objects.create(name='Barbell'))
+        exercise_in_plan = ExerciseInWorkoutPlan.objects.create(plan=plan, exercise=exercise)
+        data = {'user': self.sender.user_id, 'exercise_in_plan': exercise_in_plan.exercise_in_plan_id, 'reps': 5, 'weight': 100,
+                'completed_date': '2024-03-05'}
+
+        responses = []
+        for attempt in range(2):
+            request = self.factory.post('/fitConnect/create_workout_log/', data, content_type='application/json',
+                                        HTTP_IDEMPOTENCY_KEY='log-1')
+            response = WorkoutLogCreateView.as_view()(request)
+            if hasattr(response, 'render'):  # The replay is already rendered
+                response.render()
+            responses.append(response)
+        self.assertEquals([response.status_code for response in responses], [201, 201])
+        self.assertEquals(json.loads(responses[1].content), json.loads(responses[0].content))
+        self.assertEquals(WorkoutLog.objects.count(), 1)
+
+    def test_server_error_releases_key(self):
+        data = {'sender_id': self.sender.user_id, 'recipient_id': self.recipient.user_id, 'message_text': None}
+        request = self.factory.post('/fitConnect/create_message/', data, content_type='application/json',
+                                    HTTP_IDEMPOTENCY_KEY='retry-1')
+        self.assertEquals(create_message(request).status_code, 500)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class TestSyncView(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.test_user = User.objects.create(first_name='Test', last_name='User', email='client@mail.com')
+        self.other_user = User.objects.create(first_name='Other', last_name='User', email='other@mail.com')
+        self.plan = WorkoutPlan.objects.create(user=self.test_user, plan_name='Plan')
+        exercise = ExerciseBank.objects.create(name='Squat', muscle_group=MuscleGroupBank.objects.create(name='Legs'),
+                                               equipment=EquipmentBank.objects.create(name='Barbell'))
+        self.exercise_in_plan = ExerciseInWorkoutPlan.objects.create(plan=self.plan, exercise=exercise)
+        CalorieLog.objects.create(user=self.test_user, amount=500)
+        CalorieLog.objects.create(user=self.other_user, amount=700)
+
+    def sync(self, **params):
+        request = self.factory.get('/fitConnect/sync', {'user_id': self.test_user.user_id, **params})
+        return SyncView.as_view()(request)
+
+    def test_full_sync(self):
+        with self.assertNumQueries(len(SYNC_COLLECTIONS)):
+            response = self.sync()
+        self.assertEquals(response.status_code, 200)
+        changes = response.data['changes']
+        self.assertEquals([plan['plan_id'] for plan in changes['workout_plans']], [self.plan.plan_id])
+        self.assertEquals(len(changes['exercises_in_plan']), 1)
+        self.assertEquals([log['amount'] for log in changes['calorie_logs']], [500])
+
+    def test_delta_sync(self):
+        since = (timezone.now() + timedelta(seconds=1)).isoformat()
+        WorkoutPlan.objects.filter(pk=self.plan.pk).update(last_update=timezone.now() - timedelta(days=1))
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(seconds=2)):
+            self.exercise_in_plan.is_active = False
+            self.exercise_in_plan.save()
+            MessageLog.objects.create(sender=self.other_user, recipient=self.test_user, message_text='Hi')
+
+        response = self.sync(since=since)
+        self.assertEquals(response.data['changes']['workout_plans'], [])
+        self.assertEquals(response.data['changes']['calorie_logs'], [])
+        self.assertEquals(response.data['changes']['exercises_in_plan'], [])
+        self.assertEquals(response.data['deleted']['exercises_in_plan'], [self.exercise_in_plan.exercise_in_plan_id])
+        self.assertEquals([message['message_text'] for message in response.data['changes']['messages']], ['Hi'])
+
+    def test_invalid_params(self):
+        self.assertEquals(self.sync(since='yesterday').status_code, 400)
+        request = self.factory.get('/fitConnect/sync')
+        self.assertEquals(SyncView.as_view()(request).status_code, 400)
+
+
+# Requests through the full middleware stack, so views going over their query budget fail the test
+class TestQueryBudgets(TestCase):
+    def setUp(self):
+        cache.clear()
+        request_metrics.clear()
+        self.coach_user = User.objects.create(first_name='Coach', last_name='Person', email='coach@mail.com')
+        self.coach = Coach.objects.create(user=self.coach_user, cost=30, experience=5)
+        self.test_user = User.objects.create(first_name='Test', last_name='User', email='client@mail.com',
+                                             hired_coach=self.coach, has_coach=True)
+        self.plan = WorkoutPlan.objects.create(user=self.test_user, plan_name='Plan')
+        exercise = ExerciseBank.objects.create(name='Squat', muscle_group=MuscleGroupBank.objects.create(name='Legs'),
+                                               equipment=EquipmentBank.objects.create(name='Barbell'))
+        exercise_in_plan = ExerciseInWorkoutPlan.objects.create(plan=self.plan, exercise=exercise)
+        for days_ago in range(3):
+            WorkoutLog.objects.create(user=self.test_user, exercise_in_plan=exercise_in_plan, reps=5, weight=100,
+                                      completed_date=timezone.localdate() - timedelta(days=days_ago))
+        MessageLog.objects.create(sender=self.coach_user, recipient=self.test_user, message_text='Hi')
+
+    def test_views_within_budget(self):
+        user_id, coach_id = self.test_user.user_id, self.coach.coach_id
+        urls = [
+            '/fitConnect/coaches', '/fitConnect/coaches/search', f'/fitConnect/coaches/{coach_id}/clients',
+            f'/fitConnect/coaches/{coach_id}/adherence', f'/fitConnect/users/{user_id}/plans', f'/fitConnect/plans/{self.plan.plan_id}',
+            f'/fitConnect/view_workout_logs/{self.plan.plan_id}/', f'/fitConnect/mostRecentWorkoutPlanView/{user_id}/',
+            f'/fitConnect/progression/{user_id}/', f'/fitConnect/sync?user_id={user_id}', f'/fitConnect/daily_survey/{user_id}/',
+            f'/fitConnect/contactHistory/{user_id}/', f'/fitConnect/get_messages/{self.coach_user.user_id}/{user_id}/',
+            '/fitConnect/exercises', '/fitConnect/goals',
+        ]
+        for url in urls:
+            response = self.client.get(url)
+            self.assertEquals(response.status_code, 200, url)
+            self.assertIn('db;dur=', response['Server-Timing'])
+
+        data = {'sender_id': user_id, 'recipient_id': self.coach_user.user_id, 'message_text': 'Hello'}
+        response = self.client.post('/fitConnect/create_message/', data, content_type='application/json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEquals(response.status_code, 200)
+
+        metrics = request_metrics.snapshot()
+        self.assertEquals(metrics['create_message']['count'], 1)
+        self.assertEquals(sum(view['over_budget'] for view in metrics.values()), 0)
+
+    async def test_budgets_under_asgi(self):
+        # The async client goes through the ASGI handler, where the whole middleware chain runs async
+        url = f'/fitConnect/users/{self.test_user.user_id}/plans'
+        response = await self.async_client.get(url)
+        self.assertEquals(response.status_code, 200)
+        self.assertIn('desc="queries=2"', response['Server-Timing'])
+
+        with mock.patch.object(WorkoutPlanList, 'query_budget', {'GET': 1}):
+            with self.assertRaises(QueryBudgetExceeded):
+                await self.async_client.get(url)
+
+    def test_over_budget_fails(self):
+        with mock.patch.object(WorkoutPlanList, 'query_budget', {'GET': 1}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(f'/fitConnect/users/{self.test_user.user_id}/plans')
+
+        # Outside of tests it is only logged
+        with override_settings(QUERY_BUDGET_STRICT=False), self.assertLogs('FitConnect.middleware', 'WARNING'):
+            with mock.patch.object(WorkoutPlanList, 'query_budget', {'GET': 1}):
+                self.assertEquals(self.client.get('/fitConnect/plans').status_code, 200)
+        self.assertEquals(request_metrics.snapshot()['WorkoutPlanList']['over_budget'], 2)
+
+    def test_metrics_endpoint(self):
+        self.client.get('/fitConnect/goals')
+        self.assertEquals(self.client.get('/fitConnect/metrics').status_code, 403)
+
+        admin_user = User.objects.create(first_name='Admin', last_name='Person', email='admin@mail.com')
+        Admin.objects.create(user=admin_user)
+        token = AuthToken.objects.get(user=admin_user)
+        response = self.client.get('/fitConnect/metrics', HTTP_AUTHORIZATION='Token ' + token.key)
+        self.assertEquals(response.status_code, 200)
+        goals = response.json()['GoalList']
+        self.assertEquals(goals['count'], 1)
+        self.assertEquals(sum(bucket['count'] for bucket in goals['latency_ms']), 1)
+
+    def test_token_cache_metrics_endpoint(self):
+        token_cache.clear()
+        self.assertEquals(self.client.get('/fitConnect/metrics/token_cache').status_code, 403)
+
+        admin_user = User.objects.create(first_name='Admin', last_name='Person', email='admin@mail.com')
+        Admin.objects.create(user=admin_user)
+        token = AuthToken.objects.get(user=admin_user)
+        self.client.get('/fitConnect/goals', HTTP_AUTHORIZATION='Token ' + token.key)
+        response = self.client.get('/fitConnect/metrics/token_cache', HTTP_AUTHORIZATION='Token ' + token.key)
+        self.assertEquals(response.status_code, 200)
+        # The first request missed and loaded the token, the metrics request itself hit
+        self.assertEquals(response.json()['misses'], 1)
+        self.assertEquals(response.json()['hits'], 1)
+        self.assertEquals(response.json()['hit_rate'], 0.5)
@@ -5,25 +5,32 @@ urlpatterns = [
     path('fitConnect/create_user', CreateUserView.as_view(), name='create-user'),
     path('fitConnect/login', LoginView.as_view(), name='login'),
     path('fitConnect/coaches', CoachList.as_view(), name='coach'),
+    path('fitConnect/coaches/search', CoachSearch.as_view(), name='coach-search'),
     path('fitConnect/coaches/<int:pk>', CoachDetail.as_view()),
     path('fitConnect/coaches/<int:pk>/requests', CoachClients.as_view(hired=False)),
     path('fitConnect/coaches/<int:pk>/clients', CoachClients.as_view(hired=True)),
+    path('fitConnect/coaches/<int:pk>/adherence', CoachAdherence.as_view()),
     path('fitConnect/requestCoach/', RequestCoach.as_view()),
     path('fitConnect/acceptClient/', AcceptClient.as_view()),
+    path('fitConnect/triageClients/', TriageClients.as_view()),
     path('fitConnect/fireCoach/<int:pk>', FireCoach.as_view()),
     path('fitConnect/initial_survey', InitialSurveyView.as_view(), name='initial-survey'),
     path('fitConnect/create_workout_plan', create_workout_plan, name='create_workout_plan'),
     path('fitConnect/daily_survey/<int:user_id>/', DailySurveyView.as_view(), name='daily_survey'),
+    path('fitConnect/daily_survey/<int:user_id>/batch/', DailySurveyBatchView.as_view(), name='daily_survey_batch'),
+    path('fitConnect/daily_summary/<int:user_id>/', DailyHealthSummaryView.as_view(), name='daily_summary'),
 
     path('fitConnect/exercises', ExerciseList.as_view()),
     path('fitConnect/exercises/<int:pk>', ExerciseListId.as_view()),
     path('fitConnect/muscle_groups', MuscleGroupList.as_view()),
     path('fitConnect/equipment', EquipmentList.as_view()),
+    path('fitConnect/goals', GoalList.as_view()),
     path('fitConnect/exercises/search/', SearchExercises.as_view()),
 
     path('fitConnect/become_coach', BecomeCoachRequestView.as_view(), name='become-coach-request'),
     path('fitConnect/create_message/', create_message, name='create_message'),
     path('fitConnect/get_messages/<int:sender_id>/<int:recipient_id>/', get_messages, name='get_messages'),
+    path('fitConnect/stream_messages/<int:sender_id>/<int:recipient_id>/', stream_messages, name='stream_messages'),
     path('fitConnect/users/<int:user_id>/plans', WorkoutPlanList.as_view()),
     path('fitConnect/plans', WorkoutPlanList.as_view()),
     path('fitConnect/plans/<int:pk>', WorkoutPlanDetail.as_view()),
@@ -36,11 +43,18 @@ urlpatterns = [
     path('fitConnect/logout/', LogoutView.as_view(), name='logout'),
 
     path('fitConnect/create_workout_log/', WorkoutLogCreateView.as_view(), name='create_workout_log'),
+    path('fitConnect/create_workout_session/', WorkoutSessionCreateView.as_view(), name='create_workout_session'),
+    path('fitConnect/progression/<int:user_id>/', ProgressionView.as_view(), name='progression'),
+    path('fitConnect/progression/<int:user_id>/<int:exercise_id>/', ProgressionView.as_view(), name='exercise_progression'),
 
     path('fitConnect/view_workout_logs/<int:plan_id>/', WorkoutLogView.as_view(), name='view-workout-log'),
     path('fitConnect/declineClient/', DeclineClient.as_view(), name='decline_client'),
     path('fitConnect/contactHistory/<int:user_id>/', ContactHistoryView.as_view(), name='contact-history'),
+    path('fitConnect/contactHistory/<int:user_id>/<int:other_user_id>/read/', ConversationReadView.as_view(), name='conversation-read'),
 
     path('fitConnect/mostRecentWorkoutPlanView/<int:user_id>/', MostRecentWorkoutPlanView.as_view(), name='most_recent_logged_workout_plan'),
     path('fitConnect/serverTimeView', ServerTimeView.as_view(), name='server-time'),
+    path('fitConnect/sync', SyncView.as_view(), name='sync'),
+    path('fitConnect/metrics', RequestMetricsView.as_view(), name='request-metrics'),
+    path('fitConnect/metrics/token_cache', TokenCacheMetricsView.as_view(), name='token-cache-metrics'),
 ]
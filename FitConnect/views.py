@@ -1,23 +1,46 @@
 from datetime import timedelta
-from django.http import HttpRequest
+from django.http import HttpRequest, HttpResponse
 from django.core.exceptions import ValidationError
 from rest_framework.generics import get_object_or_404, ListAPIView
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, generics
-from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError
 from django.views.decorators.csrf import csrf_exempt
 from .services.physical_health import add_physical_health_log
+from .services.passwords import hash_password, verify_password
+from .services.idempotency import idempotent
+from .authentication import annotate_user_type, get_user_type
 from .services.goals import update_user_goal
 from .services.initial_survey_eligibility import check_initial_survey_eligibility
+from .services.workout_plans import load_workout_plans
+from .services.workout_logs import most_recent_workout, logs_of_plan
+from .services.progression import get_progression, invalidate_progression
+from .services.sync import get_changes, SYNC_COLLECTIONS
+from .services.request_metrics import query_budget, request_metrics
+from .services.token_cache import token_cache
+from .services.message_stream import message_broker
+from .services.exercise_search import search_exercises, index_exercise, index_is_current
+from .services.coach_search import coach_queryset, coach_facets, paginate, InvalidSearch, \
+    DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT
+from .services.coach_clients import client_queryset, client_counts, paginate_clients
+from .services.coach_adherence import client_adherence
+from .services.lookup_cache import get_lookup_snapshot, EXERCISES, MUSCLE_GROUPS, EQUIPMENT, GOALS
+from .services.daily_survey import save_daily_surveys
+from .services.daily_timeline import get_daily_timeline, DEFAULT_TIMELINE_LIMIT, MAX_TIMELINE_LIMIT
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import parse_etags
 from django.http import JsonResponse, Http404
 import django, json
 from django.shortcuts import render, get_object_or_404
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Q
+from django.db import transaction, IntegrityError
+from django.db.models import Q, Subquery, Max, Value, DateField
+from django.db.models.functions import Least
+from rest_framework.pagination import LimitOffsetPagination
 
 from .serializers import *
 from .models import *
@@ -36,6 +59,8 @@ def validate_password(password):
 
 
 class CreateUserView(APIView):
+    authentication_classes = []
+
     def post(self, request, format=None):
         password = request.data.pop("password")
         serializer = UserSerializer(data=request.data)
@@ -48,8 +73,7 @@ class CreateUserView(APIView):
                 return Response(err, status=status.HTTP_400_BAD_REQUEST)
 
             serializer.save()
-            ph = PasswordHasher()
-            hashed_password = ph.hash(password)
+            hashed_password = hash_password(password)
             credentials_serializer = UserCredentialsSerializer(
                 data={'user': serializer.data['user_id'], 'hashed_password': hashed_password})
 
@@ -67,40 +91,47 @@ class CreateUserView(APIView):
 
 
 class LoginView(APIView):
-    def check_password(self, user_id, password):  # Checks that provided password matches the stored hash
-        ph = PasswordHasher()
-        user_credentials = UserCredentials.objects.get(pk=user_id)
-        hash = getattr(user_credentials, 'hashed_password')
+    authentication_classes = []  # A stale token from a previous session must not block logging in
+    query_budget = 3  # User with credentials, token and role, a new token after logout, a rehashed password
+
+    # Credentials, token and role are resolved with the user in a single query
+    def get_user(self, email):
+        return annotate_user_type(User.objects.select_related('usercredentials', 'auth_token')).get(email=email)
+
+    def check_password(self, user_credentials, password):  # Checks that provided password matches the stored hash
+        matches, new_hash = verify_password(user_credentials.hashed_password, password)
+        if new_hash is not None:  # Stored hash uses outdated argon2 parameters
+            user_credentials.hashed_password = new_hash
+            user_credentials.save()
+        return matches
+
+    def get_token(self, user):
+        try:
+            return user.auth_token
+        except AuthToken.DoesNotExist:  # Token is deleted on logout
+            pass
         try:
-            ph.verify(hash, password)
-            return True
-        except VerifyMismatchError as e:
-            return False
+            return AuthToken.objects.create(user=user)
+        except IntegrityError:  # Created by a concurrent login
+            return AuthToken.objects.get(user=user)
 
     def post(self, request):
         email = request.data.get("email")
         try:
             django.core.validators.validate_email(email)  # Check that email is valid before hitting db
-            user = User.objects.get(email=email)  # Will throw exception if user does not exist
+            user = self.get_user(email)  # Will throw exception if user does not exist
+            user_credentials = user.usercredentials
         except:
             return Response({'Error': 'Invalid Email or Password'}, status=status.HTTP_400_BAD_REQUEST)
 
-        user_id = getattr(user, 'user_id')
         password = request.data.get("password")
 
-        if self.check_password(user_id, password):  # Verify that the password was correct
+        if self.check_password(user_credentials, password):  # Verify that the password was correct
             user_serializer = UserSerializer(user)
 
-            token, created = AuthToken.objects.get_or_create(user=user)
-
-            response = {'token': token.key, 'user_type': 'user'}
-
-            if Coach.objects.filter(user_id=user_id).exists():
-                response['user_type'] = 'coach'
-
-            if Admin.objects.filter(user_id=user_id).exists():
-                response['user_type'] = 'admin'
+            token = self.get_token(user)
 
+            response = {'token': token.key, 'user_type': get_user_type(user)}
             response.update(user_serializer.data)
             return Response(response, status=status.HTTP_200_OK)
         else:
@@ -115,7 +146,13 @@ class LogoutView(APIView):
         return Response(status=status.HTTP_200_OK)
 
   
+# Optional query params:
+# ?goal=<goal_id>&experience=<min experience>&cost=<max cost> to filter
+# ?sort=cost|experience|clients (prefix with - for descending)
+# ?limit=&offset= or ?after=<cursor> to paginate, the cursor for the next page is sent in the X-Next-Cursor header
 class CoachList(APIView):
+    query_budget = 2  # Page, goal bank on a cold cache
+
     def validate_search_params(self, params):
         # Validate query. Maybe make this a serializer later idk
         goal = params.get('goal')
@@ -135,24 +172,63 @@ class CoachList(APIView):
 
         return [goal, experience, cost]
 
-    def get(self, request):
+    def validate_page_params(self, params, default_limit=None):
+        try:
+            limit = params.get('limit', default_limit)
+            limit = int(limit) if limit is not None else None
+            offset = int(params.get('offset', 0))
+        except ValueError:
+            raise ValidationError('limit and offset must be numbers')
+        if limit is not None and (limit < 1 or limit > MAX_SEARCH_LIMIT):
+            raise ValidationError(f'limit must be between 1 and {MAX_SEARCH_LIMIT}')
+        if offset < 0:
+            raise ValidationError('offset cannot be negative')
+        return [params.get('sort'), limit, offset, params.get('after')]
+
+    def search(self, request, default_limit=None):
         try:
             goal, min_experience, cost = self.validate_search_params(request.query_params)
+        except ValueError:
+            raise ValidationError('experience and cost must be numbers')
+        sort, limit, offset, after = self.validate_page_params(request.query_params, default_limit)
+        try:
+            coaches = coach_queryset(goal, min_experience, cost, sort)
+            page, next_cursor = paginate(coaches, sort, limit, offset, after)
+        except InvalidSearch as err:
+            raise ValidationError(str(err))
+        return [goal, min_experience, cost], page, next_cursor
+
+    def get(self, request):
+        try:
+            filters, coaches, next_cursor = self.search(request)
         except ValidationError as err:
             return Response(err, status=status.HTTP_400_BAD_REQUEST)
 
-        # If search criteria is passed, filter the queryset
-        # Consider allowing filtering for multiple goals; max and min cost; max and min experience
-        coaches = Coach.objects.all()
-        if cost is not None:
-            coaches = coaches.filter(cost__lte=cost)
-        if goal is not None:
-            coaches = coaches.filter(goal__goal_id=goal)
-        if min_experience is not None:
-            coaches = coaches.filter(experience__gte=min_experience)
+        serializer = CoachSearchSerializer(coaches, many=True)
+        headers = {'X-Next-Cursor': next_cursor} if next_cursor else {}
+        return Response(serializer.data, status=status.HTTP_200_OK, headers=headers)
 
-        serializer = CoachSerializer(coaches, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+
+# Same search as CoachList, wrapped with the total count, facets and next page cursor:
+# { "count": 12, "next": "<cursor>", "results": [...],
+#   "facets": { "goal": [{"goal_id": 1, "goal_name": "Lose Weight", "count": 5}, ...],
+#               "price": [{"min": 0, "max": 25, "count": 3}, ...] } }
+class CoachSearch(CoachList):
+    query_budget = 3  # Page, facets, goal bank on a cold cache
+
+    def get(self, request):
+        try:
+            filters, coaches, next_cursor = self.search(request, default_limit=DEFAULT_SEARCH_LIMIT)
+        except ValidationError as err:
+            return Response(err, status=status.HTTP_400_BAD_REQUEST)
+
+        total, facets = coach_facets(*filters)
+        return Response({
+            'count': total,
+            'next': next_cursor,
+            'results': CoachSearchSerializer(coaches, many=True).data,
+            'facets': facets,
+        }, status=status.HTTP_200_OK)
 
 
 class CoachDetail(generics.RetrieveUpdateDestroyAPIView):
@@ -182,6 +258,17 @@ class AcceptClient(APIView):
             return Response(request.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+# Accept and decline many client requests at once
+# expecting {'coach' : coach_id, 'accept' : [user_id, ...], 'decline' : [user_id, ...]}
+class TriageClients(APIView):
+    def patch(self, request):
+        serializer = CoachTriageSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        result = serializer.save()  # Raises a 400 if any user has no pending request for the coach
+        return Response(result, status=status.HTTP_200_OK)
+
+
 class FireCoach(APIView):
     def get_object(self, pk):
         try:
@@ -204,14 +291,61 @@ class FireCoach(APIView):
             return Response(user_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+# Paginated, the cursor for the next page is sent in the X-Next-Cursor header (pass it as ?after=)
+# Optional query params:
+# ?limit=<page size>, 20 by default and at most 100
+# ?activity=true to include each client's latest_workout_date and latest_weight
+# The coach's total clients and requests are sent in the X-Client-Count and X-Request-Count headers
 class CoachClients(APIView):
     hired = None
+    default_limit = DEFAULT_SEARCH_LIMIT
+    query_budget = 3  # Page, counts for an empty page, goal bank on a cold cache
+
+    def get_page(self, request, pk, activity):
+        params = request.query_params
+        try:
+            limit = int(params.get('limit', self.default_limit))
+        except ValueError:
+            raise ValidationError('limit must be a number')
+        if limit < 1 or limit > MAX_SEARCH_LIMIT:
+            raise ValidationError(f'limit must be between 1 and {MAX_SEARCH_LIMIT}')
+        try:
+            clients, next_cursor = paginate_clients(client_queryset(pk, self.hired, activity), limit, params.get('after'))
+        except InvalidSearch as err:
+            raise ValidationError(str(err))
+
+        counts = client_counts(pk, clients)
+        headers = {'X-Client-Count': counts['client_count'], 'X-Request-Count': counts['request_count']}
+        if next_cursor:
+            headers['X-Next-Cursor'] = next_cursor
+        return clients, headers
 
     def get(self, request, pk):
-        clients = User.objects.filter(has_coach=self.hired, hired_coach__coach_id=pk)
-        print(clients)
-        clients_serializer = UserSerializer(clients, many=True)
-        return Response(clients_serializer.data, status=status.HTTP_200_OK)
+        activity = request.query_params.get('activity', '').lower() in ('1', 'true')
+        try:
+            clients, headers = self.get_page(request, pk, activity)
+        except ValidationError as err:
+            return Response(err, status=status.HTTP_400_BAD_REQUEST)
+
+        clients_serializer = CoachClientSerializer(clients, many=True, context={'activity': activity})
+        return Response(clients_serializer.data, status=status.HTTP_200_OK, headers=headers)
+
+
+# Adherence of a coach's hired clients, paginated like CoachClients:
+# [{ "user_id": 3, "first_name": "...", "last_name": "...", "workouts_7d": 2, "workouts_30d": 9,
+#    "last_workout_date": "2024-03-05", "days_since_last_log": 1, "latest_weight": "79.50", "avg_calories_30d": 2150 }, ...]
+class CoachAdherence(CoachClients):
+    hired = True
+    query_budget = 3  # Page, grouped workouts, grouped daily summaries
+
+    def get(self, request, pk):
+        try:
+            clients, headers = self.get_page(request, pk, activity=True)
+        except ValidationError as err:
+            return Response(err, status=status.HTTP_400_BAD_REQUEST)
+
+        adherence_serializer = ClientAdherenceSerializer(client_adherence(clients), many=True)
+        return Response(adherence_serializer.data, status=status.HTTP_200_OK, headers=headers)
 
 
 # Requirements:
@@ -312,7 +446,9 @@ class EditExerciseBankView(APIView):
     def post(self, request, *args, **kwargs):
         serializer = DomExerciseSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            index_was_current = index_is_current()
+            exercise = serializer.save()
+            transaction.on_commit(lambda: index_exercise(exercise, index_was_current))
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -324,53 +460,39 @@ class EditExerciseBankView(APIView):
             exercise = ExerciseBank.objects.get(exercise_id=exercise_id)
         except ExerciseBank.DoesNotExist:
             return Response({"detail": "Exercise not found."}, status=status.HTTP_404_NOT_FOUND)
+        index_was_current = index_is_current()
         exercise.is_active = False
         exercise.save()
+        transaction.on_commit(lambda: index_exercise(exercise, index_was_current))
         return Response({"detail": "Exercise disabled successfully."}, status=status.HTTP_200_OK)
 
+# Example create plan
+# { "user": 1, "planName": "Push Day", "creationDate": "2023-11-29",
+#   "exercises": [ { "exercise": 1, "sets": 3, "reps": 10, "weight": 100, "durationMinutes": 20 } ] }
+# Responds with the created plan, including the ids of the plan and its exercises
 @csrf_exempt
+@idempotent('user')
 def create_workout_plan(request):
     if request.method == 'POST':
+        try:
+            data = json.loads(request.body.decode('utf-8'))
+        except json.JSONDecodeError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
 
-        data = json.loads(request.body.decode('utf-8'))
-
-        # find the workout plan data
-        user_id = data.get('user')
-        plan_name = data.get('planName')
-        creation_date = data.get('creationDate')
-
-        # create workout plan
-        workout_plan = WorkoutPlan.objects.create(
-            user_id=user_id,
-            plan_name=plan_name,
-            creation_date=creation_date,
-            created=timezone.now(),
-            last_update=timezone.now()
-        )
+        serializer = WorkoutPlanCreateSerializer(data=data)
+        if not serializer.is_valid():
+            return JsonResponse({'status': 'error', 'message': serializer.errors}, status=400)
 
-        # find exercise data
-        exercises_data = data.get('exercises', None)
-
-        # Create ExerciseInWorkoutPlan objects
-        if exercises_data is not None:
-            for exercise_data in exercises_data:
-                ExerciseInWorkoutPlan.objects.create(
-                    plan=workout_plan,
-                    exercise_id=exercise_data.get('exercise'),
-                    sets=exercise_data.get('sets'),
-                    reps=exercise_data.get('reps'),
-                    weight=exercise_data.get('weight'),
-                    duration_minutes=exercise_data.get('durationMinutes'),
-                    created=timezone.now(),
-                    last_update=timezone.now()
-                )
-
-        return JsonResponse({'status': 'success'})
+        workout_plan = serializer.save()
+        plan_data = WorkoutPlanSerializer(load_workout_plans().get(pk=workout_plan.pk)).data
+        return JsonResponse({'status': 'success', 'plan': plan_data})
 
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'})
 
 
 @csrf_exempt
+@query_budget(11)  # Including 4 for Idempotency-Key bookkeeping
+@idempotent('sender_id')
 def create_message(request):
     if request.method == 'POST':
         try:
@@ -382,8 +504,12 @@ def create_message(request):
             sender = User.objects.get(user_id=sender_id)
             recipient = User.objects.get(user_id=recipient_id)
 
-            message = MessageLog(sender=sender, recipient=recipient, message_text=message_text)
-            message.save()
+            # Saving the message also updates the pair's Conversation row
+            with transaction.atomic():
+                message = MessageLog(sender=sender, recipient=recipient, message_text=message_text)
+                message.save()
+                # Wake up clients waiting on stream_messages once the message is visible
+                transaction.on_commit(lambda: message_broker.publish(sender.user_id, recipient.user_id))
 
             return JsonResponse({'status': 'success'})
 
@@ -395,20 +521,112 @@ def create_message(request):
             return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
 
-@csrf_exempt
-def get_messages(request, sender_id, recipient_id): # Add first and last name as name
-    messages = MessageLog.objects.filter(
+MESSAGE_FIELDS = ['message_id', 'sender_id', 'sender__first_name', 'sender__last_name',
+                  'recipient_id', 'recipient__first_name', 'recipient__last_name', 'message_text', 'sent_date']
+
+
+def conversation_messages(sender_id, recipient_id):
+    return MessageLog.objects.filter(
         (Q(sender_id=sender_id) & Q(recipient_id=recipient_id)) |
         (Q(sender_id=recipient_id) & Q(recipient_id=sender_id))
-    ).order_by('sent_date')
+    )
+
+
+def serialize_message(msg):  # msg is a .values(*MESSAGE_FIELDS) row
+    return {'message_id': msg['message_id'], 'sent_date': msg['sent_date'],
+            'sender': msg['sender_id'], 'sender_name': f"{msg['sender__first_name']} {msg['sender__last_name']}",
+            'recipient': msg['recipient_id'], 'recipient_name': f"{msg['recipient__first_name']} {msg['recipient__last_name']}",
+            'text': msg['message_text']}
 
-    data = [{'sender': msg.sender.user_id, 'sender_name': f"{msg.sender.first_name} {msg.sender.last_name}",
-             'recipient': msg.recipient.user_id, 'recipient_name': f"{msg.recipient.first_name} {msg.recipient.last_name}",
-             'text': msg.message_text} for msg in messages]
 
-    return JsonResponse({'messages': data})
+MESSAGES_PAGE_SIZE = 50
+MAX_MESSAGES_PAGE_SIZE = 200
+
+
+# Returns the latest page of the conversation, oldest message first
+# Optional query params:
+# ?limit=N for the page size (default 50)
+# ?before=<message_id> for the page of messages sent before that message
+# "next_before" in the response is the cursor for the next (older) page, null when there are no more
+@csrf_exempt
+@query_budget(1)
+def get_messages(request, sender_id, recipient_id): # Add first and last name as name
+    try:
+        limit = int(request.GET.get('limit', MESSAGES_PAGE_SIZE))
+        before = request.GET.get('before')
+        before = int(before) if before is not None else None
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'limit and before must be numbers'}, status=400)
+    if limit < 1 or limit > MAX_MESSAGES_PAGE_SIZE:
+        return JsonResponse({'status': 'error', 'message': f'limit must be between 1 and {MAX_MESSAGES_PAGE_SIZE}'},
+                            status=400)
+
+    messages = conversation_messages(sender_id, recipient_id)
+    if before is not None:
+        before_sent_date = Subquery(MessageLog.objects.filter(pk=before).values('sent_date')[:1])
+        messages = messages.filter(
+            Q(sent_date__lt=before_sent_date) | (Q(sent_date=before_sent_date) & Q(message_id__lt=before))
+        )
+
+    page = list(messages.order_by('-sent_date', '-message_id').values(*MESSAGE_FIELDS)[:limit + 1])
+    has_more = len(page) > limit
+    data = [serialize_message(msg) for msg in page[:limit][::-1]]
+
+    next_before = data[0]['message_id'] if has_more else None
+    return JsonResponse({'messages': data, 'next_before': next_before})
+
+STREAM_TIMEOUT = 25
+MAX_STREAM_TIMEOUT = 55
+
+
+def messages_since(sender_id, recipient_id, since):
+    # Up to MAX_MESSAGES_PAGE_SIZE messages after `since`, oldest first, and whether there are more
+    messages = conversation_messages(sender_id, recipient_id).filter(message_id__gt=since)
+    batch = [serialize_message(msg) for msg in
+             messages.order_by('message_id').values(*MESSAGE_FIELDS)[:MAX_MESSAGES_PAGE_SIZE + 1]]
+    return batch[:MAX_MESSAGES_PAGE_SIZE], len(batch) > MAX_MESSAGES_PAGE_SIZE
+
+
+def latest_message_id(sender_id, recipient_id):
+    return conversation_messages(sender_id, recipient_id).aggregate(latest=Max('message_id'))['latest'] or 0
+
+
+# Long-poll for new messages in a conversation, meant to be served through the ASGI application
+# ?since=<message_id> is the last message the client has; the request returns as soon as newer messages exist,
+# or with an empty list after ?timeout= seconds (default 25), after which the client polls again
+# Without since it waits for messages newer than the latest one; older ones are loaded with get_messages
+# At most MAX_MESSAGES_PAGE_SIZE messages are returned at once; "next_since" is the since of the next poll and
+# "has_more" says there are more messages after it already
+# Waiting requests hold no database connection or thread, they are woken up by create_message
+# Not decorated with csrf_exempt, which turns async views into sync ones on Django 4.2; CSRF doesn't apply to GET
+@query_budget(3)
+async def stream_messages(request, sender_id, recipient_id):
+    try:
+        since = request.GET.get('since')
+        since = int(since) if since is not None else None
+        timeout = float(request.GET.get('timeout', STREAM_TIMEOUT))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'since and timeout must be numbers'}, status=400)
+    timeout = min(max(timeout, 0), MAX_STREAM_TIMEOUT)
+
+    # Subscribe before checking the database so a message written in between still wakes us up
+    subscription = message_broker.subscribe(sender_id, recipient_id)
+    try:
+        if since is None:
+            since = await sync_to_async(latest_message_id)(sender_id, recipient_id)
+        data, has_more = await sync_to_async(messages_since)(sender_id, recipient_id, since)
+        if not data and await message_broker.wait(subscription, timeout):
+            data, has_more = await sync_to_async(messages_since)(sender_id, recipient_id, since)
+    finally:
+        message_broker.unsubscribe(sender_id, recipient_id, subscription)
+
+    next_since = data[-1]['message_id'] if data else since
+    return JsonResponse({'messages': data, 'next_since': next_since, 'has_more': has_more})
+
 
 class WorkoutPlanList(APIView):
+    query_budget = {'GET': 2}
+
     def get(self, request, user_id=None):
         plans = WorkoutPlan.objects.filter(is_active=1)
         plan_name = request.query_params.get("name")
@@ -416,20 +634,22 @@ class WorkoutPlanList(APIView):
             plans = plans.filter(user__user_id=user_id)
         if plan_name:   
             plans = plans.filter(plan_name__icontains=plan_name)
-        serializer = WorkoutPlanSerializer(plans, many=True)
+        serializer = WorkoutPlanSerializer(load_workout_plans(plans), many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def post(self, request):
         return create_workout_plan(request)
 
 class WorkoutPlanDetail(APIView):
+    query_budget = {'GET': 2}
+
     def get(self, request, pk):
-        plan = get_object_or_404(WorkoutPlan.objects.filter(is_active=1), pk=pk)
+        plan = get_object_or_404(load_workout_plans(WorkoutPlan.objects.filter(is_active=1)), pk=pk)
         serializer = WorkoutPlanSerializer(plan)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def put(self, request, pk):
-        plan = get_object_or_404(WorkoutPlan, pk=pk)
+        plan = get_object_or_404(load_workout_plans(), pk=pk)
         serializer = WorkoutPlanSerializer(plan, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
@@ -446,7 +666,7 @@ class WorkoutPlanDetail(APIView):
 class ExerciseInWorkoutPlanView(APIView):
     def get(self, request, pk=None):
         if pk is None:
-            queryset = ExerciseInWorkoutPlan.objects.all()
+            queryset = ExerciseInWorkoutPlan.objects.select_related('exercise__muscle_group', 'exercise__equipment')
             serializer = ExerciseInWorkoutPlanSerializer(queryset, many=True)
         else:
             exercise_in_plan = get_object_or_404(ExerciseInWorkoutPlan, pk=pk)
@@ -479,33 +699,104 @@ class ExerciseInWorkoutPlanView(APIView):
         exercise_in_plan.save()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+def accepted_encodings(header):
+    # Content codings from an Accept-Encoding header, skipping the ones explicitly refused with q=0
+    encodings = set()
+    for coding in header.split(','):
+        name, _, params = coding.strip().partition(';')
+        try:
+            quality = float(params.strip()[2:]) if params.strip().startswith('q=') else 1.0
+        except ValueError:
+            quality = 1.0
+        if name and quality > 0:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+class CachedLookupListMixin:
+    """
+    Serves a lookup bank list from the versioned cache (services/lookup_cache.py).
+    The body is a pre-encoded (and precompressed) JSON snapshot, so no serialization happens per request.
+    The bank version is sent as the ETag, so clients revalidating with If-None-Match get a 304 until the bank changes.
+    Each content-coding is a different representation, so compressed bodies get the coding appended to their ETag.
+    """
+    lookup_bank = None
+    query_budget = 1  # Loading the bank on a cold cache
+
+    def list(self, request, *args, **kwargs):
+        version, snapshot = get_lookup_snapshot(self.lookup_bank)
+        accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        encoding = next((encoding for encoding in ['br', 'gzip'] if encoding in snapshot and encoding in accepted), None)
+        etag = f'"{self.lookup_bank}-{version}-{encoding}"' if encoding else f'"{self.lookup_bank}-{version}"'
+
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(snapshot[encoding or 'identity'], content_type='application/json')
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        response['Vary'] = 'Accept-Encoding'
+        return response
+
+
 # Visitor View for Exercises
-class ExerciseList(generics.ListAPIView): # include exercise id
+class ExerciseList(CachedLookupListMixin, generics.ListAPIView): # include exercise id
     queryset = ExerciseBank.objects.filter(is_active=1)
     serializer_class = ExerciseListSerializer
+    lookup_bank = EXERCISES
 
 class ExerciseListId(generics.RetrieveAPIView):
-    queryset = ExerciseBank.objects.filter(is_active=1)
+    queryset = ExerciseBank.objects.filter(is_active=1).select_related('muscle_group', 'equipment')
     serializer_class = ExerciseListSerializer
 
-class MuscleGroupList(generics.ListAPIView):
+class MuscleGroupList(CachedLookupListMixin, generics.ListAPIView):
     queryset = MuscleGroupBank.objects.all()
     serializer_class = MuscleGroupBankSerializer
+    lookup_bank = MUSCLE_GROUPS
 
 
-class EquipmentList(generics.ListAPIView):
+class EquipmentList(CachedLookupListMixin, generics.ListAPIView):
     queryset = EquipmentBank.objects.all()
     serializer_class = EquipmentBankSerializer
+    lookup_bank = EQUIPMENT
 
 
+class GoalList(CachedLookupListMixin, generics.ListAPIView):
+    queryset = GoalBank.objects.all()
+    serializer_class = GoalSerializer
+    lookup_bank = GOALS
+
+
+# Optional ?q= free text search over exercise names and descriptions, results are ranked best match first
+# Words match the start of longer words from two letters on ("be pr" finds "Bench Press")
+# Can be combined with the exact filters; ?limit= caps the number of text search results (default 50)
 class SearchExercises(APIView):
+    SEARCH_LIMIT = 50
+    FILTERED_CANDIDATES = 1000
+
     def get(self, request, *args, **kwargs):
         # Get the request parameters
         exercise_id = request.query_params.get('exercise_id')
         muscle_group_id = request.query_params.get('muscle_group_id')
         equipment_id = request.query_params.get('equipment_id')
+        query = request.query_params.get('q')
 
-        queryset = ExerciseBank.objects.filter(is_active=1)
+        queryset = ExerciseBank.objects.filter(is_active=1).select_related('muscle_group', 'equipment')
+
+        ranked_ids = None
+        if query:
+            try:
+                limit = int(request.query_params.get('limit', self.SEARCH_LIMIT))
+            except ValueError:
+                return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+            if limit < 1 or limit > self.FILTERED_CANDIDATES:
+                return Response({'error': f'limit must be between 1 and {self.FILTERED_CANDIDATES}'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            # Filters are applied to a wider candidate set so a filtered search still fills its limit
+            filtered = exercise_id or muscle_group_id or equipment_id
+            ranked_ids = search_exercises(query, self.FILTERED_CANDIDATES if filtered else limit)
+            queryset = queryset.filter(exercise_id__in=ranked_ids)
 
         if exercise_id:
             queryset = queryset.filter(exercise_id=exercise_id)
@@ -517,12 +808,18 @@ class SearchExercises(APIView):
             queryset = queryset.filter(equipment__equipment_id=equipment_id)
 
 
+        if ranked_ids is not None:
+            rank = {pk: position for position, pk in enumerate(ranked_ids)}
+            queryset = sorted(queryset, key=lambda exercise: rank[exercise.exercise_id])[:limit]
+
         serializer = ExerciseSerializer(queryset, many=True)
 
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
 class DailySurveyView(APIView):
+    query_budget = {'GET': 2}
+
     # Sample JSON format for GET and POST requests
     # These are attached to a user_id in the url, for example the following JSON could be posted to the endpoint:
     # /fitConnect/daily_survey/1/
@@ -537,85 +834,64 @@ class DailySurveyView(APIView):
     # Which would be for the user with user_id=1
     # A GET request will return a list of JSON in the above format
 
+    # GET accepts optional query params:
+    # ?from=YYYY-MM-DD&to=YYYY-MM-DD to restrict the date range
+    # ?limit=N for the number of days returned (default 5)
+    # ?before=YYYY-MM-DD to fetch the page of days older than the last one received
+
+    @staticmethod
+    def validate_timeline_params(params):
+        dates = {}
+        for param in ['from', 'to', 'before']:
+            value = params.get(param)
+            if value is not None:
+                try:
+                    dates[param] = parse_date(value)
+                except ValueError:
+                    dates[param] = None
+                if dates[param] is None:
+                    raise ValidationError(f'{param} must be a valid date (YYYY-MM-DD)')
+
+        limit = params.get('limit', DEFAULT_TIMELINE_LIMIT)
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise ValidationError('limit must be a number')
+        if limit < 1 or limit > MAX_TIMELINE_LIMIT:
+            raise ValidationError(f'limit must be between 1 and {MAX_TIMELINE_LIMIT}')
+
+        return [dates.get('from'), dates.get('to'), dates.get('before'), limit]
+
     def get(self, request, user_id):
+        if not User.objects.filter(user_id=user_id).exists():
+            return Response({'error': 'User matching query does not exist.'}, status=status.HTTP_400_BAD_REQUEST)
+
         try:
-            user = User.objects.get(user_id=user_id)
-        except User.DoesNotExist as e:
-            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            start, end, before, limit = self.validate_timeline_params(request.query_params)
+        except ValidationError as err:
+            return Response({'error': err.messages}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            # Fetch the last 5 logs for each type
-            calorie_logs = CalorieLog.objects.filter(
-                user_id=user_id).order_by('-recorded_date')[:5]
-            water_logs = WaterLog.objects.filter(
-                user_id=user_id).order_by('-recorded_date')[:5]
-            mental_health_logs = MentalHealthLog.objects.filter(
-                user_id=user_id).order_by('-recorded_date')[:5]
-            physical_health_logs = PhysicalHealthLog.objects.filter(
-                user_id=user_id).order_by('-recorded_date')[:5]
-
-            data = {}
-
-            # Process calorie logs
-            for log in calorie_logs:
-                date = log.recorded_date
-                if date not in data:
-                    data[date] = {'recorded_date': date, 'calorie_amount': None,
-                                'water_amount': None, 'mood': None, 'weight': None}
-                data[date]['calorie_amount'] = log.amount
-
-            # Process water logs
-            for log in water_logs:
-                date = log.recorded_date
-                if date not in data:
-                    data[date] = {'recorded_date': date, 'calorie_amount': None,
-                                'water_amount': None, 'mood': None, 'weight': None}
-                data[date]['water_amount'] = log.amount
-
-            # Process mental health logs
-            for log in mental_health_logs:
-                date = log.recorded_date
-                if date not in data:
-                    data[date] = {'recorded_date': date, 'calorie_amount': None,
-                                'water_amount': None, 'mood': None, 'weight': None}
-                data[date]['mood'] = log.mood
-
-            # Process physical health logs
-            for log in physical_health_logs:
-                date = log.recorded_date
-                if date not in data:
-                    data[date] = {'recorded_date': date, 'calorie_amount': None,
-                                'water_amount': None, 'mood': None, 'weight': None}
-                data[date]['weight'] = log.weight
-
-            # Return data for the last 5 recorded entries of each type
-            return Response(list(data.values()), status=status.HTTP_200_OK)
+            # Merged per-day logs, most recent day first, in a single query
+            days = get_daily_timeline(user_id, start=start, end=end, before=before, limit=limit)
+            serializer = DailySurveySerializer(days, many=True)
+            return Response(serializer.data, status=status.HTTP_200_OK)
 
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
    
+    @idempotent('user_id')
     def post(self, request, user_id):
         # Check to see if the requested user exists in the database
-        try:
-            user = User.objects.get(user_id=user_id)
-        except User.DoesNotExist as e:
-            return Response({'error:': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not User.objects.filter(user_id=user_id).exists():
+            return Response({'error:': 'User matching query does not exist.'}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
             serializer = DailySurveySerializer(data=request.data)
             if serializer.is_valid():
-                # This assumes that recorded_date, calorie_amount, water_amount, and mood are all required fields
-                recorded_date = serializer.validated_data['recorded_date']
-                calorie_amount = serializer.validated_data['calorie_amount']
-                water_amount = serializer.validated_data['water_amount']
-                mood = serializer.validated_data['mood']
-                weight = serializer.validated_data['weight']
-
-                # Save data to respective models
-                CalorieLog.objects.create(user_id=user_id, amount=calorie_amount, recorded_date=recorded_date)
-                WaterLog.objects.create(user_id=user_id, amount=water_amount, recorded_date=recorded_date)
-                MentalHealthLog.objects.create(user_id=user_id, mood=mood, recorded_date=recorded_date)
-                PhysicalHealthLog.objects.create(user_id=user_id, weight=weight, recorded_date=recorded_date)
+                # This assumes that recorded_date, calorie_amount, water_amount, mood and weight are all required fields
+                # All four logs and the day's summary are written in one transaction
+                save_daily_surveys(user_id, [serializer.validated_data])
 
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
             else:
@@ -625,48 +901,140 @@ class DailySurveyView(APIView):
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+# Batch import of daily surveys, e.g. an offline client syncing a week at once
+# Expects a list of surveys in the DailySurveyView format, either as the body or under "days":
+# { "days": [ { "recorded_date": "2023-11-29", "calorie_amount": 1500, "water_amount": 1000, "mood": "Happy", "weight": 150.0 }, ... ] }
+# Days that were already logged are updated instead of duplicated, so a retried sync is harmless
+class DailySurveyBatchView(APIView):
+    MAX_DAYS = 366
+
+    def post(self, request, user_id):
+        if not User.objects.filter(user_id=user_id).exists():
+            return Response({'error': 'User matching query does not exist.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        days = request.data.get('days') if isinstance(request.data, dict) else request.data
+        if not isinstance(days, list) or not days:
+            return Response({'error': 'Expected a non-empty list of days'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(days) > self.MAX_DAYS:
+            return Response({'error': f'Cannot import more than {self.MAX_DAYS} days at once'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = DailySurveySerializer(data=days, many=True)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            save_daily_surveys(user_id, serializer.validated_data, upsert=True)
+        except Exception as e:
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+# Compact per-day rollup of the daily survey logs, most recent day first
+# Same query params as DailySurveyView.get: ?from=YYYY-MM-DD&to=YYYY-MM-DD to restrict the date range,
+# ?limit=N for the number of days returned (default 5) and ?before=YYYY-MM-DD for the page of older days
+class DailyHealthSummaryView(ListAPIView):
+    serializer_class = DailyHealthSummarySerializer
+
+    def list(self, request, *args, **kwargs):
+        try:
+            self.start, self.end, self.before, self.limit = DailySurveyView.validate_timeline_params(request.query_params)
+        except ValidationError as err:
+            return Response({'error': err.messages}, status=status.HTTP_400_BAD_REQUEST)
+        return super().list(request, *args, **kwargs)
+
+    def get_queryset(self):
+        summaries = DailyHealthSummary.objects.filter(user_id=self.kwargs['user_id'])
+        if self.start is not None:
+            summaries = summaries.filter(recorded_date__gte=self.start)
+        if self.end is not None:
+            summaries = summaries.filter(recorded_date__lte=self.end)
+        if self.before is not None:
+            summaries = summaries.filter(recorded_date__lt=self.before)
+        return summaries.order_by('-recorded_date')[:self.limit]
+
+
 class WorkoutLogCreateView(APIView):
+    @idempotent('user')
     def post(self, request, *args, **kwargs):
         serializer = WorkoutLogSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            log = serializer.save()
+            invalidate_progression(log.user_id)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+
+# Logs a whole workout session at once
+# expecting { "user": 1, "plan": 2, "completed_date": "2024-03-05" (optional, defaults to today),
+#   "sets": [ { "exercise_in_plan": 5, "reps": 10, "weight": 100, "duration_minutes": null }, ... ] }
+class WorkoutSessionCreateView(APIView):
+    query_budget = 9  # Including 4 for Idempotency-Key bookkeeping and 1 to read the logs back on MySQL
+
+    @idempotent('user')
+    def post(self, request, *args, **kwargs):
+        serializer = WorkoutSessionSerializer(data=request.data)
+        if serializer.is_valid():
+            logs = serializer.save()
+            return Response({'count': len(logs), 'logs': WorkoutLogSerializer(logs, many=True).data},
+                            status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+# Per exercise progression of a user: sessions, total volume, personal records and the daily history
+# { "exercises": [{ "exercise_id": 1, "name": "Squat", "sessions": 2, "total_volume": 2400,
+#                   "personal_records": {"top_weight": {"value": 100, "date": "2024-03-05"}, "e1rm": {...}, "volume": {...}},
+#                   "history": [{ "date": "2024-03-01", "sets": 3, "reps": 30, "volume": 1200, "top_weight": 90,
+#                                 "e1rm": 117.0, "records": ["top_weight", "e1rm", "volume"] }, ...] }, ...] }
+# With an exercise id in the url, just that exercise's entry
+class ProgressionView(APIView):
+    query_budget = 1
+
+    def get(self, request, user_id, exercise_id=None):
+        progression = get_progression(user_id)
+        if exercise_id is None:
+            return Response({'exercises': [progression[key] for key in sorted(progression)]}, status=status.HTTP_200_OK)
+        if exercise_id not in progression:
+            return Response({'error': 'No workout logs found for this exercise.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(progression[exercise_id], status=status.HTTP_200_OK)
+
+class WorkoutLogPagination(LimitOffsetPagination):
+    max_limit = MAX_SEARCH_LIMIT  # No ?limit= returns every log
+
+
+# Logs of a plan from the last ?days= days (default 5), or from the last day anything was logged if there are none
+# Most recent first, optionally paginated with ?limit=&offset=
 class WorkoutLogView(ListAPIView):
     serializer_class = WorkoutLogSerializerDom
+    pagination_class = WorkoutLogPagination
+    query_budget = 2  # Logs, count when paginated
+    DEFAULT_DAYS = 5
+    MAX_DAYS = 366
 
     def get_queryset(self):
         plan_id = self.kwargs['plan_id']
-        end_date = timezone.now()
-        start_date = end_date - timedelta(days=4)  # Last 5 days
-
-        # Join WorkoutLog with ExerciseInPlan and filter by plan_id
-        return WorkoutLog.objects.filter(
-            exercise_in_plan__plan_id=plan_id,
-            completed_date__range=(start_date, end_date)
-        ).order_by('-completed_date')
+        end_date = timezone.localdate()
+        start_date = end_date - timedelta(days=self.days - 1)
 
-    def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        if not queryset:
-            return self.get_workout_logs_for_last_plan(kwargs['plan_id'])
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # The window starts at the last logged day instead when that is older, so it holds just that day's logs
+        # No logs at all compares against NULL and matches nothing
+        plan_logs = logs_of_plan(plan_id).filter(completed_date__lte=end_date)
+        last_logged = plan_logs.order_by('-completed_date').values('completed_date')[:1]
+        window_start = Least(Value(start_date, output_field=DateField()), Subquery(last_logged))
 
-    def get_workout_logs_for_last_plan(self, plan_id):
-        latest_log = WorkoutLog.objects.filter(
-            exercise_in_plan__plan_id=plan_id
-        ).latest('completed_date')
+        return plan_logs.filter(completed_date__gte=window_start).select_related(
+            'plan', 'exercise_in_plan__plan', 'exercise_in_plan__exercise'
+        ).order_by('-completed_date', '-workout_id')
 
-        latest_log_date = latest_log.completed_date
-        logs_on_latest_log_date = WorkoutLog.objects.filter(
-            exercise_in_plan__plan_id=plan_id,
-            completed_date=latest_log_date
-        ).order_by('-completed_date')
+    def list(self, request, *args, **kwargs):
+        try:
+            self.days = int(request.query_params.get('days', self.DEFAULT_DAYS))
+        except ValueError:
+            return Response('days must be a number', status=status.HTTP_400_BAD_REQUEST)
+        if self.days < 1 or self.days > self.MAX_DAYS:
+            return Response(f'days must be between 1 and {self.MAX_DAYS}', status=status.HTTP_400_BAD_REQUEST)
+        return super().list(request, *args, **kwargs)
 
-        serializer = self.get_serializer(logs_on_latest_log_date, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
 
 class DeclineClient(APIView):
     def post(self, request, *args, **kwargs):
@@ -678,65 +1046,115 @@ class DeclineClient(APIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 # Give it a user id in url. Get the user ids and names of the people that have a chat history
+# Most recent conversation first, with a preview of the last message and the user's unread count
 class ContactHistoryView(APIView):
-    def get(self, request, user_id, format=None):
-        # Retrieve all user IDs paired with the given user_id
-        paired_user_ids = MessageLog.objects.filter(
-            Q(sender_id=user_id) | Q(recipient_id=user_id)
-        ).values_list('sender_id', 'recipient_id')
-
-        all_paired_user_ids = set([user_id for pair in paired_user_ids for user_id in pair])
+    PREVIEW_LENGTH = 100
+    query_budget = {'GET': 1}
 
-        # Remove the original user_id from the list
-        all_paired_user_ids.discard(user_id)
+    def get(self, request, user_id, format=None):
+        conversations = Conversation.objects.filter(
+            Q(user_one_id=user_id) | Q(user_two_id=user_id)
+        ).select_related('user_one', 'user_two', 'last_message').order_by('-last_message_time')
 
-        # Retrieve user names and create the response data
         response_data = []
-        for paired_user_id in all_paired_user_ids:
-            user_data = User.objects.filter(user_id=paired_user_id).values('user_id', 'first_name', 'last_name').first()
+        for conversation in conversations:
+            is_user_one = conversation.user_one_id == user_id
+            contact = conversation.user_two if is_user_one else conversation.user_one
+            last_message = conversation.last_message
             response_data.append({
-                'user_id': user_data['user_id'],
-                'name': user_data['first_name'] + ' ' + user_data['last_name']
+                'user_id': contact.user_id,
+                'name': f'{contact.first_name} {contact.last_name}',
+                'last_message': last_message.message_text[:self.PREVIEW_LENGTH] if last_message else None,
+                'last_message_sender': last_message.sender_id if last_message else None,
+                'last_message_time': conversation.last_message_time,
+                'unread_count': conversation.user_one_unread if is_user_one else conversation.user_two_unread,
             })
 
-
         return Response(response_data, status=status.HTTP_200_OK)
 
 
+# Marks the conversation with another user as read for user_id
+class ConversationReadView(APIView):
+    def post(self, request, user_id, other_user_id, format=None):
+        if not Conversation.mark_read(user_id, other_user_id):
+            return Response({'error': 'Conversation not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(status=status.HTTP_200_OK)
+
+
 class MostRecentWorkoutPlanView(APIView):
+    query_budget = 2
+
     def get(self, request, user_id, format=None):
-        try:
-            user = User.objects.get(user_id=user_id)
+        # Get the most recently logged workout plan for the user and all of its logs on that day
+        most_recent = most_recent_workout(user_id)
+        if most_recent is None:
+            if not User.objects.filter(user_id=user_id).exists():
+                return Response({'error': 'User not found.'}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({'error': 'No workout logs found.'}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Get the most recently logged workout plan for the user
-            most_recent_log = WorkoutLog.objects.filter(user=user).latest('created')
-            most_recent_plan = most_recent_log.exercise_in_plan.plan
+        most_recent_plan, plan_logs = most_recent
+        log_serializer = WorkoutLogSerializerDom(plan_logs, many=True)
 
-            # Get the plan name and ID
-            plan_name = most_recent_plan.plan_name
-            plan_id = most_recent_plan.plan_id
+        # Prepare the response data
+        response_data = {
+            'plan_name': most_recent_plan.plan_name,
+            'plan_id': most_recent_plan.plan_id,
+            'logs': log_serializer.data,
+        }
 
-            # Get the most recent day
-            most_recent_day = most_recent_log.completed_date
+        return Response(response_data, status=status.HTTP_200_OK)
 
-            # Get all logs for the most recent workout plan
-            plan_logs = WorkoutLog.objects.filter(exercise_in_plan__plan=most_recent_plan, user=user, completed_date=most_recent_day)
-            log_serializer = WorkoutLogSerializerDom(plan_logs, many=True)
+# Everything of a user that changed after ?since=<ISO 8601 timestamp>, for offline-first clients
+# The user is the authenticated one, or ?user_id= without a token. No since returns all of the user's active rows
+# { "next_since": "<pass as since next time>",
+#   "changes": { "workout_plans": [...], "exercises_in_plan": [...], "workout_logs": [...], "calorie_logs": [...],
+#                "water_logs": [...], "mental_health_logs": [...], "physical_health_logs": [...], "messages": [...] },
+#   "deleted": { "workout_plans": [plan_id, ...], "exercises_in_plan": [exercise_in_plan_id, ...] } }
+class SyncView(APIView):
+    query_budget = len(SYNC_COLLECTIONS)
 
-            # Prepare the response data
-            response_data = {
-                'plan_name': plan_name,
-                'plan_id': plan_id,
-                'logs': log_serializer.data,
-            }
+    def get(self, request):
+        if isinstance(request.user, User):
+            user_id = request.user.user_id
+        else:
+            try:
+                user_id = int(request.query_params['user_id'])
+            except (KeyError, ValueError):
+                return Response({'error': 'user_id is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-            return Response(response_data, status=status.HTTP_200_OK)
+        since = request.query_params.get('since')
+        if since is not None:
+            try:
+                since = parse_datetime(since)
+            except ValueError:
+                since = None
+            if since is None:
+                return Response({'error': 'since must be an ISO 8601 timestamp'}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
 
-        except User.DoesNotExist:
-            return Response({'error': 'User not found.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(get_changes(user_id, since), status=status.HTTP_200_OK)
+
+
+# Per view request metrics of this process (see FitConnect/middleware.py): request count, query budget overruns,
+# latency and query count histograms, and average db time, serializer time and response size
+# Open to admins (by token) and to everyone when DEBUG is on
+class RequestMetricsView(APIView):
+    def get(self, request):
+        if not settings.DEBUG and getattr(request.auth, 'user_type', None) != 'admin':
+            return Response({'error': 'Admins only'}, status=status.HTTP_403_FORBIDDEN)
+        return Response(self.get_metrics(), status=status.HTTP_200_OK)
+
+    def get_metrics(self):
+        return request_metrics.snapshot()
+
+
+# Auth token cache metrics of this process (see FitConnect/services/token_cache.py): size, hits, misses, hit rate,
+# expirations and evictions. Same access as RequestMetricsView
+class TokenCacheMetricsView(RequestMetricsView):
+    def get_metrics(self):
+        return token_cache.stats()
 
-        except WorkoutLog.DoesNotExist:
-            return Response({'error': 'No workout logs found.'}, status=status.HTTP_400_BAD_REQUEST)
 
 class ServerTimeView(APIView):
     def get(self, request):
@@ -2,6 +2,8 @@
 ASGI config for FitConnectProjectDjango project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server (e.g. ``uvicorn FitConnectProjectDjango.asgi:application``)
+so the async fitConnect/stream_messages long-poll endpoint doesn't hold a worker thread per waiting client.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -14,3 +16,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "FitConnectProjectDjango.settings")
 
 application = get_asgi_application()
+
+# Build the exercise search index while the server starts instead of on the first search
+from FitConnect.services.exercise_search import warm_exercise_search_index  # noqa: E402
+
+warm_exercise_search_index()
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'FitConnect.middleware.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
 
     "django.middleware.security.SecurityMiddleware",
@@ -97,6 +98,31 @@ DATABASES = {
 if 'test' in sys.argv or 'test_coverage' in sys.argv:
     DATABASES['default']['ENGINE'] = 'django.db.backends.sqlite3'
 
+# Views going over their query budget raise instead of logging a warning (see FitConnect/middleware.py)
+QUERY_BUDGET_STRICT = 'test' in sys.argv or 'test_coverage' in sys.argv
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Local memory by default; point CACHE_BACKEND/CACHE_LOCATION at a shared cache (e.g. Redis or Memcached)
+# when running more than one worker process
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'fitconnect'),
+    }
+}
+
+# Cache used for the exercise, muscle group, equipment and goal banks (see FitConnect/services/lookup_cache.py)
+LOOKUP_CACHE_ALIAS = 'default'
+LOOKUP_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Cached workout progression per user, dropped whenever the user logs a workout (see FitConnect/services/progression.py)
+# Kept apart from LOOKUP_CACHE_ALIAS, which only holds the static banks
+PROGRESSION_CACHE_ALIAS = 'default'
+PROGRESSION_CACHE_TIMEOUT = 60 * 60
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -111,6 +137,39 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Argon2 password hashing (see FitConnect/services/passwords.py)
+# Stored hashes made with other parameters are rehashed on the user's next login
+
+ARGON2_TIME_COST = 3
+ARGON2_MEMORY_COST = 65536  # KiB
+ARGON2_PARALLELISM = 4
+
+# Threads used to verify passwords at login; bounds the number of concurrent verifications.
+# 0 verifies on the request thread
+PASSWORD_VERIFY_POOL_SIZE = int(os.environ.get('PASSWORD_VERIFY_POOL_SIZE', 0))
+
+# How long (seconds) the response to a request sent with an Idempotency-Key is kept for retries
+# (see FitConnect/services/idempotency.py)
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+# How long (seconds) a request holds its key while it runs. If it dies before storing a response,
+# retries get a 409 until then, after which the next retry takes the key over
+IDEMPOTENCY_KEY_LEASE = 30
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'FitConnect.authentication.CachedTokenAuthentication',
+    ],
+}
+
+# Per-process token -> user cache used by the token authentication (see FitConnect/services/token_cache.py)
+# The TTL (seconds) bounds how long a user or role change takes to reach other worker processes
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_TTL = int(os.environ.get('TOKEN_CACHE_TTL', 300))
+# Cache shared by all workers where logged out tokens are marked revoked; use a shared backend (CACHE_BACKEND)
+# when running several processes
+TOKEN_REVOCATION_CACHE_ALIAS = 'default'
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
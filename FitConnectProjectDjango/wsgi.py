@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "FitConnectProjectDjango.settings")
 
 application = get_wsgi_application()
+
+# Build the exercise search index while the server starts instead of on the first search
+from FitConnect.services.exercise_search import warm_exercise_search_index  # noqa: E402
+
+warm_exercise_search_index()